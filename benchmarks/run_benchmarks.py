@@ -0,0 +1,321 @@
+# ElPsychicMustache
+# 2025-01-04
+
+# Times the loader and the analyzers on seeded synthetic data at several scales and compares the results to a stored baseline.
+#   Interactive analyzers are driven with scripted answers, and every case runs in a fresh process so its peak memory is its own.
+#
+#   Run from the repository root:
+#       python -m benchmarks.run_benchmarks --scales 1e4 1e5 1e6 --save-baseline benchmarks/baseline.json
+#       python -m benchmarks.run_benchmarks --scales 1e4 1e5 1e6 --baseline benchmarks/baseline.json
+
+import argparse
+import builtins
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator
+
+import pandas as pd
+
+from benchmarks.synthetic_data import generate_dataframe
+from src.approximate_profile import ApproximateProfile, sketch_csv
+from src.column_handler import ColumnHandler
+from src.dataframe_manager import DataframeManager
+from src.duplicate_analyzer import DuplicateAnalyzer
+from src.feature_analyzer import FeatureAnalyzer
+from src.null_analyzer import NullAnalyzer
+from src.parallel import set_max_workers
+from src.utilities import get_df_from_csv, get_peak_memory_mb
+
+DEFAULT_SCALES: list[float] = [1e4, 1e5, 1e6]
+
+
+@contextlib.contextmanager
+def scripted_input(answers: list[str]) -> Iterator[None]:
+    """Answers every input() prompt from a list, so interactive analyzers run unattended.
+
+    Args:
+        answers (list[str]): The answers, in prompt order.
+
+    Raises:
+        RuntimeError: If a prompt is reached after every answer was used, e.g. because an analyzer's prompts changed.
+    """
+    remaining_answers: Iterator[str] = iter(answers)
+
+    def answer_prompt(prompt: str="") -> str:
+        try:
+            return next(remaining_answers)
+        except StopIteration:
+            raise RuntimeError(f"The benchmark ran out of scripted answers at the prompt: {prompt!r}") from None
+
+    original_input: Callable = builtins.input
+    builtins.input = answer_prompt
+    try:
+        yield
+    finally:
+        builtins.input = original_input
+
+
+# Each setup function prepares one run and returns the call that is timed.
+def _setup_get_df_from_csv(dataframe: pd.DataFrame, work_directory: str, options: dict) -> Callable[[], object]:
+    file_name: str = "data.csv"
+    if not os.path.exists(os.path.join(work_directory, file_name)):
+        dataframe.to_csv(os.path.join(work_directory, file_name), index=False)
+    date_columns: list[str] = [column for column in dataframe.columns if column.startswith("datetime")]
+    return lambda: get_df_from_csv(work_directory, file_name, date_columns, None)
+
+
+def _setup_null_analyzer(dataframe: pd.DataFrame, work_directory: str, options: dict) -> Callable[[], object]:
+    dataframe = dataframe.copy()
+    columns_with_null: list[str] = [column for column in dataframe.columns if dataframe[column].isna().any()]
+
+    # analyze, continue past the null ratios, select every column with nulls,
+    #   then fill numeric columns with the median and the others with the mode
+    answers: list[str] = ["y", ""]
+    if columns_with_null:
+        answers.append(" ".join(str(index) for index in range(len(columns_with_null))))
+        answers += ["2" if pd.api.types.is_numeric_dtype(dataframe[column].dtype) else "3" for column in columns_with_null]
+
+    def run() -> None:
+        with scripted_input(answers):
+            NullAnalyzer(dataframe)
+    return run
+
+
+def _setup_duplicate_analyzer(dataframe: pd.DataFrame, work_directory: str, options: dict) -> Callable[[], object]:
+    dataframe = dataframe.copy()
+    has_duplicates: bool = bool(dataframe.duplicated().any())
+
+    # analyze exact duplicates, use every column as the subset, remove the duplicates (or decline to try another subset)
+    answers: list[str] = ["y", "", "", "y" if has_duplicates else "n"]
+
+    def run() -> None:
+        with scripted_input(answers):
+            DuplicateAnalyzer(dataframe)
+    return run
+
+
+def _setup_column_handler(dataframe: pd.DataFrame, work_directory: str, options: dict) -> Callable[[], object]:
+    column_handler = ColumnHandler(dataframe.copy())
+    return lambda: column_handler.optimize_dtypes(apply=True)
+
+
+def _setup_feature_analyzer(dataframe: pd.DataFrame, work_directory: str, options: dict) -> Callable[[], object]:
+    output_directory: str = tempfile.mkdtemp(dir=work_directory)
+    return lambda: FeatureAnalyzer(dataframe, output_directory=output_directory, max_workers=options.get("max_workers"))
+
+
+def _setup_refresh(dataframe: pd.DataFrame, work_directory: str, options: dict) -> Callable[[], object]:
+    # load 90% of the rows, rename and drop a column with a pipeline, then time reading the other 10% appended to the csv;
+    #   refresh has to map the csv's original header to the renamed columns
+    csv_directory: str = tempfile.mkdtemp(dir=work_directory)
+    file_name: str = "data.csv"
+    loaded_rows: int = len(dataframe) - len(dataframe) // 10
+    dataframe.iloc[:loaded_rows].to_csv(os.path.join(csv_directory, file_name), index=False)
+    date_columns: list[str] = [column for column in dataframe.columns if column.startswith("datetime")]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        dataframe_manager = DataframeManager(file_path=csv_directory, file_name=file_name, date_columns=date_columns or None)
+        dataframe_manager.run_pipeline({"rename_columns": {dataframe.columns[0]: dataframe.columns[0].upper()}, "drop_columns": [dataframe.columns[-1]]})
+    dataframe.iloc[loaded_rows:].to_csv(os.path.join(csv_directory, file_name), mode="a", header=False, index=False)
+
+    def run() -> None:
+        dataframe_manager.refresh()
+        if len(dataframe_manager.dataframe) != len(dataframe):
+            raise RuntimeError(f"refresh appended {len(dataframe_manager.dataframe) - loaded_rows} of {len(dataframe) - loaded_rows} rows.")
+    return run
+
+
+def _setup_sketch_csv(dataframe: pd.DataFrame, work_directory: str, options: dict) -> Callable[[], object]:
+    # the string columns are empty in the whole first chunk, which pandas reads as float; the text after it has to be
+    #   counted instead of being coerced to nulls
+    chunk_size: int = max(1, len(dataframe) // 10)
+    file_name: str = "sparse.csv"
+    dataframe = dataframe.copy()
+    string_columns: list[str] = [column for column in dataframe.columns if column.startswith("string")]
+    dataframe.loc[dataframe.index[:chunk_size], string_columns] = None
+    if not os.path.exists(os.path.join(work_directory, file_name)):
+        dataframe.to_csv(os.path.join(work_directory, file_name), index=False)
+    null_counts: pd.Series = dataframe.isna().sum()
+
+    def run() -> None:
+        profile: ApproximateProfile = sketch_csv(os.path.join(work_directory, file_name), chunk_size=chunk_size)
+        wrong_columns: list[str] = [column for column in dataframe.columns if profile.null_counts()[column] != null_counts[column]]
+        if wrong_columns:
+            raise RuntimeError(f"sketch_csv miscounted the nulls of {wrong_columns}.")
+    return run
+
+
+BENCHMARKS: dict[str, Callable[[pd.DataFrame, str, dict], Callable[[], object]]] = {
+    "get_df_from_csv": _setup_get_df_from_csv,
+    "null_analyzer": _setup_null_analyzer,
+    "duplicate_analyzer": _setup_duplicate_analyzer,
+    "column_handler": _setup_column_handler,
+    "feature_analyzer": _setup_feature_analyzer,
+    "refresh": _setup_refresh,
+    "sketch_csv": _setup_sketch_csv,
+}
+
+
+def run_benchmarks(benchmarks: list[str], scales: list[float], data_options: dict, repeat: int=3, options: dict=None) -> dict[str, dict]:
+    """Runs every benchmark at every scale, each case in a fresh process.
+
+    Args:
+        benchmarks (list[str]): Names from BENCHMARKS.
+        scales (list[float]): Row counts.
+        data_options (dict): Keyword arguments for generate_dataframe, except rows.
+        repeat (int, optional): Runs per case; the fastest is kept. Defaults to 3.
+        options (dict, optional): Options for the benchmarks, e.g. max_workers for the feature analyzer and threads for
+            per-column work. Defaults to None.
+
+    Returns:
+        dict[str, dict]: The seconds and peak memory of each case, keyed by "<benchmark>@<rows>".
+    """
+    results: dict[str, dict] = {}
+    # spawn instead of fork, so a case does not inherit the memory of the cases before it
+    context = multiprocessing.get_context("spawn")
+    for scale in scales:
+        rows: int = int(scale)
+        for benchmark in benchmarks:
+            case: str = f"{benchmark}@{rows}"
+            print(f"[!] Running {case} ...", end="", flush=True)
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                results[case] = executor.submit(_run_case, benchmark, rows, data_options, repeat, options or {}).result()
+            print(f" {results[case]['seconds']:.3f} s, {results[case]['peak_memory_mb']:.1f} MB")
+    return results
+
+
+def _run_case(benchmark: str, rows: int, data_options: dict, repeat: int, options: dict) -> dict:
+    """Worker function: generates the data, then times repeat runs of one benchmark.
+
+    Args:
+        benchmark (str): The benchmark name.
+        rows (int): Number of rows.
+        data_options (dict): Keyword arguments for generate_dataframe.
+        repeat (int): Number of runs.
+        options (dict): Options for the benchmark.
+
+    Returns:
+        dict: The fastest time, the peak resident memory of the process and the size of the input.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+
+    # per-column work of every case uses this many threads
+    set_max_workers(options.get("threads"))
+
+    dataframe: pd.DataFrame = generate_dataframe(rows, **data_options)
+    input_memory_mb: float = dataframe.memory_usage(deep=True).sum() / 1024**2
+    memory_before_mb: float = get_peak_memory_mb() or 0.0
+
+    timings: list[float] = []
+    with tempfile.TemporaryDirectory() as work_directory:
+        for _ in range(repeat):
+            run: Callable[[], object] = BENCHMARKS[benchmark](dataframe, work_directory, options)
+            with contextlib.redirect_stdout(io.StringIO()):
+                start: float = time.perf_counter()
+                run()
+                timings.append(time.perf_counter() - start)
+
+    peak_memory_mb: float = get_peak_memory_mb() or 0.0
+    return {
+        "seconds": min(timings),
+        "peak_memory_mb": peak_memory_mb,
+        "memory_above_input_mb": max(0.0, peak_memory_mb - memory_before_mb),
+        "input_memory_mb": input_memory_mb,
+    }
+
+
+def compare_to_baseline(results: dict[str, dict], baseline: dict[str, dict], time_tolerance: float, memory_tolerance: float) -> pd.DataFrame:
+    """Compares each case to the baseline.
+
+    Args:
+        results (dict[str, dict]): The current results.
+        baseline (dict[str, dict]): The baseline results.
+        time_tolerance (float): Allowed relative slowdown, e.g. 0.2 for 20%.
+        memory_tolerance (float): Allowed relative increase of the peak memory.
+
+    Returns:
+        pd.DataFrame: One row per case with the baseline, current value, ratio and whether it regressed.
+    """
+    rows: dict[str, dict] = {}
+    for case, result in results.items():
+        if case not in baseline:
+            continue
+        time_ratio: float = result["seconds"] / baseline[case]["seconds"] if baseline[case]["seconds"] else float("nan")
+        memory_ratio: float = result["peak_memory_mb"] / baseline[case]["peak_memory_mb"] if baseline[case]["peak_memory_mb"] else float("nan")
+        rows[case] = {
+            "baseline s": baseline[case]["seconds"],
+            "current s": result["seconds"],
+            "time ratio": time_ratio,
+            "baseline MB": baseline[case]["peak_memory_mb"],
+            "current MB": result["peak_memory_mb"],
+            "memory ratio": memory_ratio,
+            "regressed": time_ratio > 1 + time_tolerance or memory_ratio > 1 + memory_tolerance,
+        }
+    return pd.DataFrame.from_dict(rows, orient="index")
+
+
+def main(arguments: list[str]=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the loader and analyzers on synthetic data.")
+    parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("--scales", nargs="+", type=float, default=DEFAULT_SCALES, help="Row counts, e.g. 1e4 1e6 1e8.")
+    parser.add_argument("--columns", type=int, default=10)
+    parser.add_argument("--null-rate", type=float, default=0.05)
+    parser.add_argument("--duplicate-rate", type=float, default=0.05)
+    parser.add_argument("--string-cardinality", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-workers", type=int, default=None, help="Processes used by the feature analyzer.")
+    parser.add_argument("--threads", type=int, default=None, help="Threads used for per-column work; defaults to one per CPU.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Compare the results to this JSON file.")
+    parser.add_argument("--save-baseline", help="Write the results as a baseline JSON file.")
+    parser.add_argument("--time-tolerance", type=float, default=0.2)
+    parser.add_argument("--memory-tolerance", type=float, default=0.1)
+    parsed = parser.parse_args(arguments)
+
+    data_options: dict = {
+        "columns": parsed.columns,
+        "null_rate": parsed.null_rate,
+        "duplicate_rate": parsed.duplicate_rate,
+        "string_cardinality": parsed.string_cardinality,
+        "seed": parsed.seed,
+    }
+    results: dict[str, dict] = run_benchmarks(parsed.benchmarks, parsed.scales, data_options, repeat=parsed.repeat, options={"max_workers": parsed.max_workers, "threads": parsed.threads})
+
+    report: dict = {
+        "environment": {"python": platform.python_version(), "pandas": pd.__version__, "machine": platform.machine(), "platform": platform.platform()},
+        "data_options": data_options,
+        "results": results,
+    }
+    for file_path in (parsed.output, parsed.save_baseline):
+        if file_path:
+            with open(file_path, "w") as json_file:
+                json.dump(report, json_file, indent=2)
+            print(f"[+] Results written to {file_path}")
+
+    if parsed.baseline:
+        with open(parsed.baseline) as json_file:
+            baseline: dict = json.load(json_file)
+        if baseline.get("data_options") != data_options:
+            print(f"[-] The baseline was recorded with different data options: {baseline.get('data_options')}")
+        comparison: pd.DataFrame = compare_to_baseline(results, baseline["results"], parsed.time_tolerance, parsed.memory_tolerance)
+        print(f"======= Comparison to {parsed.baseline} ======= \n{comparison.round(3).to_string()}")
+        if not comparison.empty and comparison["regressed"].any():
+            print(f"[-] {int(comparison['regressed'].sum())} cases regressed.")
+            return 1
+        print("[+] No regressions.")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
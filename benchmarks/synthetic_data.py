@@ -0,0 +1,90 @@
+# ElPsychicMustache
+# 2025-01-04
+
+# Seeded synthetic dataframes for the benchmarks. The same arguments always produce the same data, so timings from
+#   different runs and releases are measured on identical inputs.
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_DTYPE_MIX: dict[str, float] = {"int": 0.3, "float": 0.3, "string": 0.25, "datetime": 0.1, "bool": 0.05}
+
+
+def generate_dataframe(rows: int, columns: int=10, dtype_mix: dict[str, float]=None, null_rate: float=0.05, duplicate_rate: float=0.05, string_cardinality: int=1000, seed: int=0) -> pd.DataFrame:
+    """Generates a dataframe with a controlled shape and content.
+
+    Args:
+        rows (int): Number of rows.
+        columns (int, optional): Number of columns. Defaults to 10.
+        dtype_mix (dict[str, float], optional): Share of columns per kind: "int", "float", "string", "datetime" and "bool".
+            Defaults to 30% int, 30% float, 25% string, 10% datetime and 5% bool.
+        null_rate (float, optional): Share of null values in every column except bool columns. Defaults to 0.05.
+        duplicate_rate (float, optional): Share of rows that are exact copies of another row. Defaults to 0.05.
+        string_cardinality (int, optional): Number of distinct values in each string column. Defaults to 1000.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: The generated dataframe.
+    """
+    if not 0 <= null_rate < 1 or not 0 <= duplicate_rate < 1:
+        raise ValueError(f"null_rate and duplicate_rate must be in [0, 1), but got {null_rate} and {duplicate_rate}.")
+
+    rng: np.random.Generator = np.random.default_rng(seed)
+    unique_rows: int = max(1, rows - int(rows * duplicate_rate))
+    string_pool: np.ndarray = np.array([f"value_{index:07d}" for index in range(max(1, string_cardinality))], dtype=object)
+
+    data: dict[str, np.ndarray] = {}
+    for index, kind in enumerate(_get_column_kinds(columns, dtype_mix or DEFAULT_DTYPE_MIX)):
+        column: str = f"{kind}_{index}"
+        if kind == "int":
+            values: np.ndarray = rng.integers(0, 1_000_000, unique_rows).astype(np.float64 if null_rate else np.int64)
+        elif kind == "float":
+            values = rng.normal(100, 25, unique_rows)
+        elif kind == "string":
+            values = string_pool[rng.integers(0, len(string_pool), unique_rows)]
+        elif kind == "datetime":
+            values = np.datetime64("2020-01-01") + rng.integers(0, 5 * 365 * 24 * 3600, unique_rows).astype("timedelta64[s]")
+        else:
+            values = rng.random(unique_rows) < 0.5
+
+        if null_rate and kind != "bool":
+            # nulls are set before rows are copied, so duplicates stay exact copies
+            null_mask: np.ndarray = rng.random(unique_rows) < null_rate
+            if kind == "datetime":
+                values[null_mask] = np.datetime64("NaT")
+            elif kind == "string":
+                values = values.copy()
+                values[null_mask] = None
+            else:
+                values[null_mask] = np.nan
+        data[column] = values
+
+    dataframe: pd.DataFrame = pd.DataFrame(data)
+    if rows > unique_rows:
+        copied_rows: np.ndarray = rng.integers(0, unique_rows, rows - unique_rows)
+        row_order: np.ndarray = rng.permutation(np.concatenate([np.arange(unique_rows), copied_rows]))
+        dataframe = dataframe.take(row_order).reset_index(drop=True)
+    return dataframe
+
+
+def _get_column_kinds(columns: int, dtype_mix: dict[str, float]) -> list[str]:
+    """Splits the columns over the kinds in proportion to dtype_mix, largest remainders first.
+
+    Args:
+        columns (int): Number of columns.
+        dtype_mix (dict[str, float]): Share of columns per kind.
+
+    Returns:
+        list[str]: The kind of each column, grouped by kind.
+    """
+    unknown_kinds: set[str] = set(dtype_mix) - set(DEFAULT_DTYPE_MIX)
+    if unknown_kinds:
+        raise ValueError(f"Unknown column kinds {sorted(unknown_kinds)}. Expected some of {list(DEFAULT_DTYPE_MIX)}.")
+
+    total_share: float = sum(dtype_mix.values())
+    exact_counts: dict[str, float] = {kind: columns * share / total_share for kind, share in dtype_mix.items()}
+    counts: dict[str, int] = {kind: int(count) for kind, count in exact_counts.items()}
+    for kind in sorted(exact_counts, key=lambda kind: exact_counts[kind] - counts[kind], reverse=True)[:columns - sum(counts.values())]:
+        counts[kind] += 1
+
+    return [kind for kind, count in counts.items() for _ in range(count)]
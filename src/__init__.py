@@ -1 +1,7 @@
-from .dataframe_manager import DataframeManager
\ No newline at end of file
+from .approximate_profile import sketch_csv
+from .batch_processor import process_batch
+from .dataframe_manager import DataframeManager
+from .dataset_profile import DatasetProfile, compare_profiles, compare_snapshots
+from .instrumentation import start_instrumentation, stop_instrumentation
+from .parallel import set_max_workers
+from .streaming_dedup import deduplicate_csv
@@ -0,0 +1,353 @@
+# ElPsychicMustache
+# 2024-12-30
+
+# Profiles csv files that are too large to load by streaming them in chunks into mergeable sketches.
+#   Counts, nulls, mean, std, min and max stay exact; quantiles, distinct counts and the most common values are approximate
+#   with the error bounds reported by error_bounds(). Profiles of separate files or workers are combined with merge().
+
+import copy
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .column_profile import NUMERIC_STATS, OBJECT_STATS
+from .plot_aggregates import get_top_values
+from .sketches import DistinctCountSketch, HeavyHitterSketch, QuantileSketch
+
+QUANTILES: dict[str, float] = {"25%": 0.25, "50%": 0.5, "75%": 0.75}
+
+
+class ColumnSketch:
+    def __init__(self, kind: str, dtype: object, quantile_k: int=200, distinct_precision: int=12, heavy_hitters: int=100) -> None:
+        """The sketches of a single column.
+
+        Args:
+            kind (str): "numeric", "datetime" or "other". Quantiles and moments are only kept for "numeric" columns.
+            dtype (object): The d-type of the column in the first chunk. Both are decided again by the first chunk with values.
+            quantile_k (int, optional): Size of the quantile sketch. Defaults to 200.
+            distinct_precision (int, optional): Precision of the distinct count sketch. Defaults to 12.
+            heavy_hitters (int, optional): Number of most common values kept. Defaults to 100.
+        """
+        self._quantile_k = quantile_k
+        self.null_count: int = 0
+        self.count: int = 0
+        self.min_value: object = None
+        self.max_value: object = None
+        # mean and sum of squared deviations, combined exactly across chunks
+        self.mean: float = 0.0
+        self.squared_deviations: float = 0.0
+
+        self._set_kind(kind, dtype)
+        self.distinct: DistinctCountSketch = DistinctCountSketch(precision=distinct_precision)
+        self.heavy_hitters: HeavyHitterSketch = HeavyHitterSketch(capacity=heavy_hitters)
+
+    def update(self, column_data: pd.Series) -> None:
+        if self.count == 0 and column_data.notna().any():
+            # a chunk of only nulls is read as float, so the kind is decided by the first chunk with values
+            self._set_kind(get_column_kind(column_data.dtype), column_data.dtype)
+        values: pd.Series = _normalize_values(column_data, self.kind)
+        if self.kind != "other" and values.count() < column_data.count():
+            # some values do not parse as numbers or datetimes, e.g. text after a numeric first chunk
+            self.widen()
+            values = _normalize_values(column_data, self.kind)
+        not_null: pd.Series = values.dropna()
+
+        self.null_count += len(values) - len(not_null)
+        if not_null.empty:
+            return
+
+        if self.kind == "numeric":
+            numbers: np.ndarray = not_null.to_numpy(dtype=np.float64)
+            self.quantiles.update(numbers)
+            self._combine_moments(len(numbers), float(numbers.mean()), float(((numbers - numbers.mean()) ** 2).sum()))
+        else:
+            self.count += len(not_null)
+        self._combine_range(not_null.min(), not_null.max())
+
+        self.distinct.update(pd.util.hash_pandas_object(not_null, index=False).to_numpy())
+        self.heavy_hitters.update(not_null)
+
+    def merge(self, other: "ColumnSketch") -> None:
+        if other.count and not self.count:
+            # this sketch has only seen nulls, so the other decides the kind
+            self._set_kind(other.kind, other.dtype)
+        elif other.count and other.kind != self.kind:
+            other = copy.deepcopy(other)
+            other.widen()
+            self.widen()
+
+        self.null_count += other.null_count
+        if self.kind == "numeric":
+            self.quantiles.merge(other.quantiles)
+            self._combine_moments(other.count, other.mean, other.squared_deviations)
+        else:
+            self.count += other.count
+        if other.count:
+            self._combine_range(other.min_value, other.max_value)
+        self.distinct.merge(other.distinct)
+        self.heavy_hitters.merge(other.heavy_hitters)
+
+    def widen(self) -> None:
+        """Summarizes the column as text from now on, used when a chunk has values that do not parse as the column's kind.
+        The most common values and the range seen so far are converted to text, quantiles and moments are dropped. A value
+        that was counted as a number before and as text after may be counted twice by the distinct estimate.
+        """
+        if self.kind == "other":
+            return
+        self.heavy_hitters.relabel(pd.Index(_to_text(self.heavy_hitters.top().index.to_series())))
+        if self.count:
+            range_text: pd.Series = _to_text(pd.Series([self.min_value, self.max_value]))
+            self.min_value, self.max_value = range_text.min(), range_text.max()
+        self.mean, self.squared_deviations = 0.0, 0.0
+        self._set_kind("other", np.dtype(object))
+
+    def _set_kind(self, kind: str, dtype: object) -> None:
+        self.kind = kind
+        self.dtype = dtype
+        self.quantiles: QuantileSketch = QuantileSketch(k=self._quantile_k) if kind == "numeric" else None
+
+    def _combine_moments(self, count: int, mean: float, squared_deviations: float) -> None:
+        # Chan et al.: the pairwise update keeps mean and variance exact without storing the values
+        if count == 0:
+            return
+        total_count: int = self.count + count
+        delta: float = mean - self.mean
+        self.mean += delta * count / total_count
+        self.squared_deviations += squared_deviations + delta**2 * self.count * count / total_count
+        self.count = total_count
+
+    def _combine_range(self, min_value: object, max_value: object) -> None:
+        self.min_value = min_value if self.min_value is None else min(self.min_value, min_value)
+        self.max_value = max_value if self.max_value is None else max(self.max_value, max_value)
+
+    def to_dict(self) -> dict[str, object]:
+        value_counts: pd.Series = self.heavy_hitters.top()
+        column_stats: dict[str, object] = {
+            "dtype": self.dtype,
+            "null_count": self.null_count,
+            "count": self.count,
+            "unique": self.distinct.estimate(),
+            "top": value_counts.index[0] if len(value_counts) else None,
+            "freq": int(value_counts.iloc[0]) if len(value_counts) else None,
+            "min": self.min_value,
+            "max": self.max_value,
+        }
+        if self.kind == "numeric":
+            quantile_values: np.ndarray = self.quantiles.quantile(list(QUANTILES.values()))
+            column_stats.update({
+                "mean": self.mean if self.count else np.nan,
+                "std": np.sqrt(self.squared_deviations / (self.count - 1)) if self.count > 1 else np.nan,
+                **dict(zip(QUANTILES, quantile_values)),
+            })
+        return column_stats
+
+
+class ApproximateProfile:
+    def __init__(self, quantile_k: int=200, distinct_precision: int=12, heavy_hitters: int=100) -> None:
+        """Column statistics built from chunks with bounded memory. Offers the same statistic names as ColumnProfile.
+
+        Args:
+            quantile_k (int, optional): Size of each quantile sketch, the rank error is about 1.7 / quantile_k. Defaults to 200.
+            distinct_precision (int, optional): Each distinct count uses 2**distinct_precision bytes, the relative error
+                is about 1.04 / sqrt(2**distinct_precision). Defaults to 12.
+            heavy_hitters (int, optional): Number of most common values kept per column. Defaults to 100.
+        """
+        self._sketch_options: dict[str, int] = {"quantile_k": quantile_k, "distinct_precision": distinct_precision, "heavy_hitters": heavy_hitters}
+        self._columns: dict[str, ColumnSketch] = {}
+        self.row_count: int = 0
+
+    def update(self, chunk: pd.DataFrame) -> None:
+        """Adds one chunk of rows to the profile. A column's kind is decided by the first chunk with values in it, and a
+        numeric or datetime column is summarized as text once a chunk has values that do not parse.
+
+        Args:
+            chunk (pd.DataFrame): The chunk.
+        """
+        for column in chunk.columns:
+            if column not in self._columns:
+                self._columns[column] = ColumnSketch(get_column_kind(chunk[column].dtype), chunk[column].dtype, **self._sketch_options)
+            self._columns[column].update(chunk[column])
+        self.row_count += len(chunk)
+
+    def merge(self, other: "ApproximateProfile") -> None:
+        """Adds the rows summarized by another profile, e.g. of another file or worker, to this one.
+
+        Args:
+            other (ApproximateProfile): A profile built with the same sketch options.
+        """
+        for column, column_sketch in other._columns.items():
+            if column in self._columns:
+                self._columns[column].merge(column_sketch)
+            else:
+                self._columns[column] = column_sketch
+        self.row_count += other.row_count
+
+    def get_stat(self, column: str, stat: str) -> object:
+        """Returns a single statistic for a column.
+
+        Args:
+            column (str): The column name.
+            stat (str): The statistic name, e.g. "mean", "50%", "unique", "mode", "value_counts", "top_values".
+
+        Returns:
+            object: The value of the statistic.
+        """
+        if stat == "value_counts":
+            return self._columns[column].heavy_hitters.top()
+        if stat == "top_values":
+            return get_top_values(self._columns[column].heavy_hitters.top())
+        if stat == "mode":
+            stat = "top"
+        return self.get_column_stats(column)[stat]
+
+    def get_column_stats(self, column: str) -> dict[str, object]:
+        return self._columns[column].to_dict()
+
+    def quantile(self, column: str, quantiles: float|list[float]) -> float|np.ndarray:
+        return self._columns[column].quantiles.quantile(quantiles)
+
+    def null_counts(self) -> pd.Series:
+        return pd.Series({column: column_sketch.null_count for column, column_sketch in self._columns.items()}, dtype="int64")
+
+    def describe(self) -> pd.DataFrame:
+        """Builds the same table as ColumnProfile.describe(), with approximate quantiles and unique counts.
+
+        Returns:
+            pd.DataFrame: The descriptive statistics of the numeric columns, or of the other columns if there are no numeric columns.
+        """
+        all_stats: dict[str, dict[str, object]] = {column: self.get_column_stats(column) for column in self._columns}
+
+        numeric_columns: list[str] = [column for column, column_sketch in self._columns.items() if column_sketch.kind == "numeric"]
+        if numeric_columns:
+            return pd.DataFrame({column: [all_stats[column][stat] for stat in NUMERIC_STATS] for column in numeric_columns}, index=NUMERIC_STATS)
+
+        return pd.DataFrame({column: [all_stats[column][stat] for stat in OBJECT_STATS] for column in self._columns}, index=OBJECT_STATS)
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame.from_dict({column: self.get_column_stats(column) for column in self._columns}, orient="index")
+
+    def error_bounds(self) -> pd.DataFrame:
+        """Returns the error bounds of the approximate statistics of each column.
+
+        Returns:
+            pd.DataFrame: Per column the quantile rank error, the relative error of "unique" and the largest undercount of "freq" and value counts.
+        """
+        return pd.DataFrame.from_dict({
+            column: {
+                "quantile_rank_error": column_sketch.quantiles.rank_error if column_sketch.quantiles is not None else np.nan,
+                "unique_relative_error": column_sketch.distinct.relative_error,
+                "frequency_error": column_sketch.heavy_hitters.frequency_error,
+            }
+            for column, column_sketch in self._columns.items()
+        }, orient="index")
+
+    @property
+    def columns(self) -> list[str]:
+        return list(self._columns)
+
+
+def sketch_csv(source: str, chunk_size: int=100_000, date_columns: list[str]=None, usecols: list[str]=None, max_workers: int=None, **sketch_options) -> ApproximateProfile:
+    """Profiles one or many csv files without loading them, streaming each in chunks. Multiple files are sketched by a process pool
+    and the per-file profiles are merged.
+
+    Args:
+        source (str): A csv file, a directory (every .csv file in it is used) or a glob pattern.
+        chunk_size (int, optional): Number of rows to read per chunk. Defaults to 100_000.
+        date_columns (list[str], optional): Columns to parse as dates. Defaults to None.
+        usecols (list[str], optional): Only these columns are read. Defaults to None.
+        max_workers (int, optional): Number of worker processes when there are several files. Defaults to None, one per CPU.
+        **sketch_options: quantile_k, distinct_precision and heavy_hitters, passed to ApproximateProfile.
+
+    Returns:
+        ApproximateProfile: The profile of every row of every file.
+    """
+    if os.path.isfile(source):
+        file_paths: list[str] = [source]
+    else:
+        pattern: str = os.path.join(source, "*.csv") if os.path.isdir(source) else source
+        file_paths = sorted(glob.glob(pattern))
+    if not file_paths:
+        raise FileNotFoundError(f"No files matched {source}")
+
+    read_csv_kwargs: dict = {}
+    if usecols:
+        read_csv_kwargs["usecols"] = usecols
+    if date_columns:
+        read_csv_kwargs["parse_dates"] = [column for column in date_columns if not usecols or column in usecols]
+
+    if len(file_paths) == 1:
+        return _sketch_file(file_paths[0], chunk_size, read_csv_kwargs, sketch_options)
+
+    print(f"[!] Sketching {len(file_paths)} files ...")
+    profile = ApproximateProfile(**sketch_options)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # merging in file order keeps the result independent of which worker finishes first
+        for file_profile in executor.map(_sketch_file, file_paths, [chunk_size] * len(file_paths), [read_csv_kwargs] * len(file_paths), [sketch_options] * len(file_paths)):
+            profile.merge(file_profile)
+
+    print(f"[+] Sketched {profile.row_count} rows.")
+    return profile
+
+
+def _sketch_file(file_path: str, chunk_size: int, read_csv_kwargs: dict, sketch_options: dict) -> ApproximateProfile:
+    profile = ApproximateProfile(**sketch_options)
+    for chunk in pd.read_csv(file_path, chunksize=chunk_size, **read_csv_kwargs):
+        profile.update(chunk)
+    return profile
+
+
+def get_column_kind(dtype: object) -> str:
+    """Returns how a column of a d-type is summarized: "numeric", "datetime" or "other" (strings, categories, booleans, ...).
+
+    Args:
+        dtype (object): The d-type of the column.
+
+    Returns:
+        str: The kind.
+    """
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "datetime"
+    if pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype):
+        return "numeric"
+    return "other"
+
+
+def _normalize_values(column_data: pd.Series, kind: str) -> pd.Series:
+    """Casts a chunk's values so equal values hash and count the same in every chunk, e.g. an integer column that is read
+    as float in a chunk with nulls.
+
+    Args:
+        column_data (pd.Series): The chunk's column.
+        kind (str): The column's kind.
+
+    Returns:
+        pd.Series: The normalized values.
+    """
+    if kind == "numeric":
+        # values that do not parse become nulls, ColumnSketch.update widens the column when that happens
+        return pd.to_numeric(column_data, errors="coerce").astype(np.float64)
+    if kind == "datetime":
+        return pd.to_datetime(column_data, errors="coerce")
+    # e.g. a boolean column is read as object in a chunk with nulls, comparing as text keeps both chunks consistent
+    return _to_text(column_data).where(column_data.notna())
+
+
+def _to_text(values: pd.Series) -> pd.Series:
+    """Converts values to text as they are written in the csv, e.g. 3.0 from a chunk read as float becomes "3", the same
+    as in a chunk read as text.
+
+    Args:
+        values (pd.Series): The values.
+
+    Returns:
+        pd.Series: The text of each value.
+    """
+    text: pd.Series = values.astype(str)
+    if pd.api.types.is_float_dtype(values.dtype):
+        # beyond 2**53 floats are not exact integers anymore
+        integral: pd.Series = np.isfinite(values) & (values == np.round(values)) & (values.abs() < 2**53)
+        text[integral] = values[integral].astype(np.int64).astype(str)
+    return text
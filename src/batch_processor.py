@@ -0,0 +1,113 @@
+# ElPsychicMustache
+# 2024-12-21
+
+# Loads, prepares and profiles many csv files at once with a pool of worker processes.
+#   Preparation uses a non-interactive PreparationPipeline spec, since workers cannot prompt the user.
+
+import contextlib
+import glob
+import io
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from .dataframe_manager import DataframeManager
+from .preparation_pipeline import PreparationPipeline, load_pipeline
+
+
+class BatchResult:
+    def __init__(self, profiles: dict[str, pd.DataFrame], errors: dict[str, str], dataframe: pd.DataFrame=None) -> None:
+        """The outcome of process_batch.
+
+        Args:
+            profiles (dict[str, pd.DataFrame]): The column profile of each file that was processed successfully.
+            errors (dict[str, str]): The traceback of each file that failed.
+            dataframe (pd.DataFrame, optional): Every prepared file concatenated in file name order, if requested. Defaults to None.
+        """
+        self.profiles = profiles
+        self.errors = errors
+        self.dataframe = dataframe
+
+    def summary(self) -> None:
+        print(f"======= Batch summary ======= \n{len(self.profiles)} files processed, {len(self.errors)} files failed.")
+        for file_path, error in self.errors.items():
+            print(f"[-] {file_path}: {error.strip().splitlines()[-1]}")
+
+
+def process_batch(source: str, pipeline: PreparationPipeline|dict|str, max_workers: int=None, concatenate: bool=False, load_options: dict=None) -> BatchResult:
+    """Runs load, prepare and profile for every csv file matched by source, spread over a process pool.
+
+    Args:
+        source (str): A directory (every .csv file in it is used) or a glob pattern, which may also match memory-mapped formats such as .feather.
+        pipeline (PreparationPipeline|dict|str): The preparation pipeline, spec dict or path to a json/yaml spec.
+        max_workers (int, optional): Number of worker processes. Defaults to None, which uses one per CPU.
+        concatenate (bool, optional): Return every prepared dataframe concatenated into one. Defaults to False.
+        load_options (dict, optional): Extra keyword arguments for DataframeManager, e.g. date_columns or memory_budget_mb. Defaults to None.
+
+    Returns:
+        BatchResult: The per-file profiles and errors, and the concatenated dataframe if requested.
+    """
+    pattern: str = os.path.join(source, "*.csv") if os.path.isdir(source) else source
+    file_paths: list[str] = sorted(glob.glob(pattern))
+    if not file_paths:
+        raise FileNotFoundError(f"No files matched {pattern}")
+
+    # the spec is a plain dict, so it is cheap to send to every worker
+    spec: dict = load_pipeline(pipeline).spec
+
+    profiles: dict[str, pd.DataFrame] = {}
+    errors: dict[str, str] = {}
+    dataframes: dict[str, pd.DataFrame] = {}
+
+    print(f"[!] Processing {len(file_paths)} files ...")
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_process_file, file_path, spec, load_options or {}, concatenate) for file_path in file_paths]
+
+        for index, future in enumerate(as_completed(futures)):
+            file_path, profile, dataframe, error = future.result()
+            if error is None:
+                profiles[file_path] = profile
+                if dataframe is not None:
+                    dataframes[file_path] = dataframe
+            else:
+                errors[file_path] = error
+            print(f"[!] Processed {index + 1}/{len(file_paths)} files.")
+
+    concatenated_dataframe: pd.DataFrame = None
+    if concatenate and dataframes:
+        concatenated_dataframe = pd.concat([dataframes[file_path] for file_path in file_paths if file_path in dataframes], ignore_index=True)
+
+    # results arrive in completion order, so both are put back in file order to not depend on the scheduling of the workers
+    result = BatchResult(
+        profiles={file_path: profiles[file_path] for file_path in file_paths if file_path in profiles},
+        errors={file_path: errors[file_path] for file_path in file_paths if file_path in errors},
+        dataframe=concatenated_dataframe,
+    )
+    result.summary()
+    return result
+
+
+def _process_file(file_path: str, spec: dict, load_options: dict, keep_dataframe: bool) -> tuple[str, pd.DataFrame|None, pd.DataFrame|None, str|None]:
+    """Worker function: loads, prepares and profiles a single file. Errors are returned instead of raised so one bad file does not stop the batch.
+
+    Args:
+        file_path (str): The csv file.
+        spec (dict): The preparation spec.
+        load_options (dict): Extra keyword arguments for DataframeManager.
+        keep_dataframe (bool): Return the prepared dataframe.
+
+    Returns:
+        tuple[str, pd.DataFrame|None, pd.DataFrame|None, str|None]: The file path, its profile, its prepared dataframe and its error.
+    """
+    try:
+        # every worker printing its progress would interleave, so the output is discarded
+        with contextlib.redirect_stdout(io.StringIO()):
+            directory, file_name = os.path.split(file_path)
+            dataframe_manager = DataframeManager(file_path=directory or ".", file_name=file_name, pipeline=spec, **load_options)
+            dataframe_manager.run_pipeline(spec)
+            profile: pd.DataFrame = dataframe_manager.profile.to_frame()
+        return file_path, profile, dataframe_manager.dataframe if keep_dataframe else None, None
+    except Exception:
+        return file_path, None, None, traceback.format_exc()
@@ -0,0 +1,232 @@
+# ElPsychicMustache
+# 2025-01-16
+
+# Checkpoints the dataframe and the decisions of each prepare_data step, so a session that dies or is stopped can resume
+#   after its last completed step instead of loading and preparing the data again. Every column is stored as its own
+#   Feather file named after a hash of its content, and a json manifest per session lists which column files make up the
+#   dataframe after each step. A step that only touches a few columns therefore writes only those, and every checkpoint
+#   of every session of the same source shares the unchanged column files.
+
+import hashlib
+import json
+import os
+import pickle
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+
+COLUMN_FILE_SUFFIX: str = ".feather"
+MANIFEST_FILE_SUFFIX: str = ".json"
+# the field of a column file that holds a pickled column Arrow cannot store, e.g. object values of mixed types
+PICKLED_FIELD: str = "pickled"
+
+
+class CheckpointStore:
+    def __init__(self, checkpoint_directory: str) -> None:
+        """A directory of content-addressed column files and the manifests of prepare_data sessions.
+
+        Args:
+            checkpoint_directory (str): The directory the checkpoints are stored in. Created if it does not exist.
+        """
+        if pa is None:
+            raise ImportError("pyarrow is required for CheckpointStore. Install it with 'pip install pyarrow'.")
+
+        self._checkpoint_directory = checkpoint_directory
+        self._column_directory: str = os.path.join(checkpoint_directory, "columns")
+        os.makedirs(self._column_directory, exist_ok=True)
+
+    def make_session_key(self, source_path: str=None, reader_options: dict=None, dataframe: pd.DataFrame=None) -> str:
+        """Builds the key of a session from its source: the file's path, size and modification time plus the reader options,
+        or the content of the dataframe when it was not loaded from a file.
+
+        Args:
+            source_path (str, optional): The file the dataframe was loaded from. Defaults to None.
+            reader_options (dict, optional): Every option that changes what is loaded from the file. Defaults to None.
+            dataframe (pd.DataFrame, optional): The dataframe, used when there is no source file. Defaults to None.
+
+        Returns:
+            str: The session key.
+        """
+        if source_path is not None:
+            source_stat: os.stat_result = os.stat(source_path)
+            key_data: dict = {"path": os.path.abspath(source_path), "size": source_stat.st_size, "mtime_ns": source_stat.st_mtime_ns, "reader_options": reader_options or {}}
+        elif dataframe is not None:
+            key_data = {"columns": {str(column): hash_column(dataframe[column]) for column in dataframe.columns}}
+        else:
+            raise ValueError("make_session_key requires a source_path or a dataframe.")
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True, default=str).encode()).hexdigest()
+
+    def save(self, session_key: str, step: str, dataframe: pd.DataFrame, decisions: dict=None) -> None:
+        """Checkpoints the dataframe after a step. Only columns without a stored file are written, and the manifest is
+        replaced last, so a crash while saving leaves the previous checkpoint intact.
+
+        Args:
+            session_key (str): The session key.
+            step (str): The completed step.
+            dataframe (pd.DataFrame): The dataframe after the step.
+            decisions (dict, optional): What the step changed, stored as json. Defaults to None.
+        """
+        if dataframe.columns.has_duplicates:
+            raise ValueError("Dataframes with duplicate column names cannot be checkpointed.")
+
+        columns: list[list[str]] = [[str(column), self._store_column(dataframe[column])] for column in dataframe.columns]
+        checkpoint: dict = {"step": step, "columns": columns, "index": self._store_index(dataframe.index), "decisions": decisions or {}}
+
+        manifest: dict = self.load_manifest(session_key) or {"session": session_key, "checkpoints": []}
+        # a step run again replaces its checkpoint and every checkpoint after it
+        completed_steps: list[str] = [previous["step"] for previous in manifest["checkpoints"]]
+        if step in completed_steps:
+            manifest["checkpoints"] = manifest["checkpoints"][:completed_steps.index(step)]
+        manifest["checkpoints"].append(checkpoint)
+        self._write_manifest(session_key, manifest)
+
+    def load(self, session_key: str, step: str=None) -> tuple[pd.DataFrame, dict]|None:
+        """Loads a checkpointed dataframe through memory maps.
+
+        Args:
+            session_key (str): The session key.
+            step (str, optional): The step to load. Defaults to None, which loads the last completed step.
+
+        Returns:
+            tuple[pd.DataFrame, dict]|None: The dataframe and its checkpoint entry (step, columns, index and decisions),
+                or None if the session has no checkpoint of the step.
+        """
+        manifest: dict|None = self.load_manifest(session_key)
+        if manifest is None or not manifest["checkpoints"]:
+            return None
+
+        checkpoints: dict[str, dict] = {checkpoint["step"]: checkpoint for checkpoint in manifest["checkpoints"]}
+        checkpoint: dict|None = manifest["checkpoints"][-1] if step is None else checkpoints.get(step)
+        if checkpoint is None:
+            return None
+
+        columns: dict[str, pd.Series] = {column: self._read_column(column_hash) for column, column_hash in checkpoint["columns"]}
+        dataframe: pd.DataFrame = pd.DataFrame(columns, copy=False)
+        dataframe.index = self._read_index(checkpoint["index"])
+        return dataframe, checkpoint
+
+    def load_manifest(self, session_key: str) -> dict|None:
+        manifest_file_path: str = self._get_manifest_file_path(session_key)
+        if not os.path.exists(manifest_file_path):
+            return None
+        with open(manifest_file_path, encoding="utf-8") as manifest_file:
+            return json.load(manifest_file)
+
+    def completed_steps(self, session_key: str) -> list[str]:
+        manifest: dict|None = self.load_manifest(session_key)
+        return [checkpoint["step"] for checkpoint in manifest["checkpoints"]] if manifest is not None else []
+
+    def clear_session(self, session_key: str) -> None:
+        """Removes the manifest of a session and every column file no other session uses.
+
+        Args:
+            session_key (str): The session key.
+        """
+        manifest_file_path: str = self._get_manifest_file_path(session_key)
+        if os.path.exists(manifest_file_path):
+            os.remove(manifest_file_path)
+        self.prune()
+
+    def prune(self) -> int:
+        """Removes the column files no manifest refers to, e.g. of checkpoints replaced by running a step again.
+
+        Returns:
+            int: The number of removed column files.
+        """
+        referenced_hashes: set[str] = set()
+        for file_name in os.listdir(self._checkpoint_directory):
+            if file_name.endswith(MANIFEST_FILE_SUFFIX):
+                manifest: dict = self.load_manifest(file_name[:-len(MANIFEST_FILE_SUFFIX)])
+                for checkpoint in manifest["checkpoints"]:
+                    referenced_hashes.update(column_hash for _, column_hash in checkpoint["columns"])
+                    referenced_hashes.update(checkpoint["index"].get("levels", []))
+
+        removed_count: int = 0
+        for file_name in os.listdir(self._column_directory):
+            if file_name.endswith(COLUMN_FILE_SUFFIX) and file_name[:-len(COLUMN_FILE_SUFFIX)] not in referenced_hashes:
+                os.remove(os.path.join(self._column_directory, file_name))
+                removed_count += 1
+        return removed_count
+
+    def _store_column(self, column_data: pd.Series) -> str:
+        column_hash: str = hash_column(column_data)
+        column_file_path: str = self._get_column_file_path(column_hash)
+        if os.path.exists(column_file_path):
+            return column_hash  # the same content is already stored, e.g. by an earlier step or session
+
+        # the file holds the values under a fixed name, so a renamed column still shares its file
+        try:
+            table: pa.Table = pa.Table.from_pandas(column_data.to_frame(name="values"), preserve_index=False)
+        except (pa.ArrowException, TypeError, ValueError):
+            # e.g. [1, "1", None] has no Arrow type; the column is pickled whole, which keeps each value's type
+            table = pa.table({PICKLED_FIELD: pa.array([pickle.dumps(column_data.reset_index(drop=True), protocol=pickle.HIGHEST_PROTOCOL)], type=pa.large_binary())})
+        temporary_file_path: str = f"{column_file_path}.tmp"
+        feather.write_feather(table, temporary_file_path, compression="uncompressed")
+        # replacing in one step means a reader never sees a half written column
+        os.replace(temporary_file_path, column_file_path)
+        return column_hash
+
+    def _read_column(self, column_hash: str) -> pd.Series:
+        # uncompressed files are mapped, so columns without nulls are read without a copy
+        table: pa.Table = feather.read_table(self._get_column_file_path(column_hash), memory_map=True)
+        if table.column_names == [PICKLED_FIELD]:
+            return pickle.loads(table[PICKLED_FIELD][0].as_py())
+        return table.to_pandas(split_blocks=True)["values"]
+
+    def _store_index(self, index: pd.Index) -> dict:
+        if isinstance(index, pd.RangeIndex):
+            # a range needs no file
+            return {"range": [index.start, index.stop, index.step], "names": [index.name]}
+        levels: pd.DataFrame = index.to_frame(index=False)
+        return {"levels": [self._store_column(levels.iloc[:, position]) for position in range(levels.shape[1])], "names": list(index.names)}
+
+    def _read_index(self, index_entry: dict) -> pd.Index:
+        if "range" in index_entry:
+            return pd.RangeIndex(*index_entry["range"], name=index_entry["names"][0])
+        levels: list[pd.Series] = [self._read_column(column_hash) for column_hash in index_entry["levels"]]
+        if len(levels) == 1:
+            # rename instead of name=, which pandas ignores for None and keeps the stored field name
+            return pd.Index(levels[0]).rename(index_entry["names"][0])
+        return pd.MultiIndex.from_arrays(levels, names=index_entry["names"])
+
+    def _write_manifest(self, session_key: str, manifest: dict) -> None:
+        manifest_file_path: str = self._get_manifest_file_path(session_key)
+        temporary_file_path: str = f"{manifest_file_path}.tmp"
+        with open(temporary_file_path, "w", encoding="utf-8") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2, default=str)
+        os.replace(temporary_file_path, manifest_file_path)
+
+    def _get_column_file_path(self, column_hash: str) -> str:
+        return os.path.join(self._column_directory, f"{column_hash}{COLUMN_FILE_SUFFIX}")
+
+    def _get_manifest_file_path(self, session_key: str) -> str:
+        return os.path.join(self._checkpoint_directory, f"{session_key}{MANIFEST_FILE_SUFFIX}")
+
+
+def hash_column(column_data: pd.Series) -> str:
+    """Hashes the values and d-type of a column, but not its name or index.
+
+    Args:
+        column_data (pd.Series): The column.
+
+    Returns:
+        str: The hex digest of the column's content.
+    """
+    column_hash = hashlib.sha256(repr(column_data.dtype).encode())
+    column_hash.update(str(len(column_data)).encode())
+    # hashes every value in one vectorized pass; nulls hash the same wherever they are
+    column_hash.update(pd.util.hash_pandas_object(column_data, index=False).to_numpy().tobytes())
+    if pd.api.types.is_object_dtype(column_data.dtype):
+        # object values are hashed by their text, so 1 and "1" only differ by their type
+        inferred_type: str = pd.api.types.infer_dtype(column_data, skipna=True)
+        column_hash.update(inferred_type.encode())
+        if inferred_type.startswith("mixed"):
+            type_codes, value_types = pd.factorize(column_data.map(type))
+            column_hash.update(repr([f"{value_type.__module__}.{value_type.__qualname__}" for value_type in value_types]).encode())
+            column_hash.update(type_codes.astype("int64").tobytes())
+    return column_hash.hexdigest()
@@ -5,13 +5,21 @@
 
 import pandas as pd
 
+from .column_profile import ColumnProfile
+from .dtype_optimizer import convert_column, propose_dtypes
+from .instrumentation import instrumented
+from .parallel import map_columns
+from .type_conversion import convert_columns
 from .utilities import prompt_selection_for_column_list, prompt_for_columns_to_rename, prompt_user_for_int
 from .validate_input import get_user_confirmation
 
 class ColumnHandler:
-    def __init__(self, dataframe: pd.DataFrame) -> None:
+    def __init__(self, dataframe: pd.DataFrame, profile: ColumnProfile=None) -> None:
         self._dataframe = dataframe
+        self._profile = profile if profile is not None else ColumnProfile(dataframe)
+        self._conversion_report: pd.DataFrame = None
 
+    @instrumented("column_handler.remove_columns")
     def remove_columns_interactively(self) -> None:
         """Provides the user a way to interactively delete columns from the dataframe.
         """
@@ -25,10 +33,13 @@ class ColumnHandler:
         if columns_to_remove:    
             print(f"[!] Removing the following columns: {columns_to_remove}")
             self._dataframe = self._dataframe.drop(columns=columns_to_remove)
+            self._profile.set_dataframe(self._dataframe)
+            self._profile.drop(columns_to_remove)
             print(f"[+] Columns removed!")
         else:
             print("[-] No columns removed!")
 
+    @instrumented("column_handler.rename_columns")
     def rename_columns_interactively(self) -> None:
         """Provides the user a way to interactively rename the columns.
         """
@@ -47,13 +58,24 @@ class ColumnHandler:
         if columns_to_rename:
             print(f"[!] Renaming the following columns: {rename_dict.keys()}")
             self._dataframe = self._dataframe.rename(columns=rename_dict)
+            self._profile.set_dataframe(self._dataframe)
+            self._profile.rename(rename_dict)
             print(f"[+] Columns have been renamed.")
         else:
             print("[-] No columns renamed!")
 
+    @instrumented("column_handler.analyze_dtypes")
     def analyze_dtypes(self) -> None:
         self._explain_dtypes()
         print()
+        if get_user_confirmation(
+            message="[*] Would you like to automatically optimize d-types? [y/N] ",
+            true_options=["y", "yes"],
+            false_options=["n", "no", ""]
+            ):
+            self.optimize_dtypes()
+            print()
+
         if get_user_confirmation(
             message="[*] Would you like to change any d-types? [y/N] ", 
             true_options=["y", "yes"], 
@@ -63,6 +85,46 @@ class ColumnHandler:
             columns_to_update: list[str] = prompt_selection_for_column_list(message="[*] Please enter the numbers next to each column that you would like to change the d-type. Leaving blank skips this step.", list_of_options=self._dataframe.columns, default_all=False)
             self._ask_new_dtypes(columns=columns_to_update)
     
+    @instrumented("column_handler.optimize_dtypes")
+    def optimize_dtypes(self, apply: bool=None) -> dict[str, str]:
+        """Proposes the most compact safe d-type for every column, prints the memory before and after, and applies them.
+
+        Args:
+            apply (bool, optional): Whether to apply the proposed d-types. Defaults to None, which asks the user.
+
+        Returns:
+            dict[str, str]: The proposed d-type of each column that can be stored more compactly.
+        """
+        proposals: dict[str, str] = propose_dtypes(self._dataframe)
+        if not proposals:
+            print("[-] Every column already uses a compact d-type.")
+            return proposals
+
+        converted_columns: dict[str, pd.Series] = map_columns(lambda column: convert_column(self._dataframe[column], proposals[column]), proposals, row_count=len(self._dataframe))
+
+        memory_table: pd.DataFrame = pd.DataFrame({
+            "current dtype": [str(self._dataframe[column].dtype) for column in proposals],
+            "proposed dtype": list(proposals.values()),
+            "memory before (MB)": [self._dataframe[column].memory_usage(deep=True, index=False) / 1024**2 for column in proposals],
+            "memory after (MB)": [converted_columns[column].memory_usage(deep=True, index=False) / 1024**2 for column in proposals],
+        }, index=list(proposals.keys()))
+
+        print(f"======= Proposed d-types ======= \n{memory_table.round(3)}")
+        print(f"[!] Total: {memory_table['memory before (MB)'].sum():.3f} MB -> {memory_table['memory after (MB)'].sum():.3f} MB")
+
+        if apply is None:
+            apply = get_user_confirmation(message="[*] Would you like to apply these d-types? [Y/n] ", true_options=["y", "yes", ""], false_options=["n", "no"])
+
+        if apply:
+            for column, converted_column in converted_columns.items():
+                self._dataframe[column] = converted_column
+            self._profile.invalidate(list(proposals.keys()))
+            print("[+] D-types optimized!")
+        else:
+            print("[-] D-types not changed.")
+
+        return proposals
+
     def _explain_dtypes(self):
         """Prints the column names and dtypes.
         """
@@ -82,6 +144,9 @@ class ColumnHandler:
         }
 
         print()
+        # the answers are collected first, so the datetime and numeric columns are converted together
+        conversions: dict[str, str] = {}
+        categorical_columns: list[str] = []
         for column in columns:
             change_to_value = prompt_user_for_int(message=f"[*] What would you like to do with column {column}?", options=options)
             
@@ -89,19 +154,44 @@ class ColumnHandler:
                 print("[!] Doing nothing.")
                 pass
             elif change_to_value == 1:
-                self._change_column_to_datetime(column_name=column)
+                conversions[column] = "datetime"
             elif change_to_value == 2:
-                self._change_column_to_numeric(column_name=column)
+                conversions[column] = "numeric"
             elif change_to_value == 3:
-                self._change_column_to_categorical(column_name=column)
-            
-    def _change_column_to_datetime(self, column_name:str) -> None:
-        self._dataframe[column_name] = pd.to_datetime(self._dataframe[column_name])
-    def _change_column_to_numeric(self, column_name:str) -> None:
-        self._dataframe[column_name] = pd.to_numeric(self._dataframe[column_name])
-    def _change_column_to_categorical(self, column_name:str) -> None:
-        self._dataframe[column_name] = pd.Categorical(self._dataframe[column_name])
+                categorical_columns.append(column)
+
+        if conversions:
+            self._convert_columns(conversions)
+        if categorical_columns:
+            self._change_columns_to_categorical(categorical_columns)
+
+        self._profile.invalidate(list(conversions) + categorical_columns)
+
+    def _convert_columns(self, conversions: dict[str, str]) -> None:
+        """Converts columns to datetime or numeric. Values that cannot be converted become null and are reported.
+
+        Args:
+            conversions (dict[str, str]): "datetime" or "numeric" per column.
+        """
+        self._dataframe, self._conversion_report = convert_columns(self._dataframe, conversions)
+        self._profile.set_dataframe(self._dataframe)
+
+        failed_report: pd.DataFrame = self._conversion_report[self._conversion_report["failed"] > 0]
+        if not failed_report.empty:
+            print(f"[-] Some values could not be converted and were set to null: \n{failed_report[['target', 'failed', 'examples']]}")
+        print(f"[+] Converted {list(conversions)}.")
+
+    def _change_columns_to_categorical(self, columns: list[str]) -> None:
+        categorical_columns: dict[str, pd.Categorical] = map_columns(lambda column: pd.Categorical(self._dataframe[column]), columns, row_count=len(self._dataframe))
+        for column, categorical_column in categorical_columns.items():
+            self._dataframe[column] = categorical_column
 
     @property
     def dataframe(self) -> pd.DataFrame:
-        return self._dataframe
\ No newline at end of file
+        return self._dataframe
+
+    @property
+    def conversion_report(self) -> pd.DataFrame|None:
+        """The converted, failed and example failed values of each column of the last datetime/numeric conversion.
+        """
+        return self._conversion_report
\ No newline at end of file
@@ -0,0 +1,434 @@
+# ElPsychicMustache
+# 2024-12-02
+
+# Holds the per-column statistics that understand_data and the analyzers used to compute separately.
+#   Statistics are computed for every column that needs them in one batched pass, then cached until a step mutates that column.
+#   Appended rows are profiled on their own and merged into the cached statistics, so a refresh scales with the new rows.
+
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+
+from .parallel import map_columns
+from .plot_aggregates import compute_histograms, get_top_values
+from .time_buckets import FREQUENCIES, bucket_datetimes, can_rebucket, choose_frequency, rebucket
+
+NUMERIC_STATS: list[str] = ["count", "mean", "std", "min", "25%", "50%", "75%", "max"]
+QUARTILE_STATS: list[str] = ["25%", "50%", "75%"]
+OBJECT_STATS: list[str] = ["count", "unique", "top", "freq"]
+NON_SCALAR_STATS: list[str] = ["value_counts", "histogram", "top_values", "time_buckets"]
+
+
+class ColumnProfile:
+    def __init__(self, dataframe: pd.DataFrame) -> None:
+        """Lazily computes and caches statistics for each column of a dataframe.
+
+        Args:
+            dataframe (pd.DataFrame): The dataframe to profile.
+        """
+        self._dataframe = dataframe
+        self._stats: dict[str, dict[str, object]] = {}
+        # null counts of columns without a full profile, so answering null_counts does not compute every statistic
+        self._null_counts: dict[str, int] = {}
+
+    def get_stat(self, column: str, stat: str) -> object:
+        """Returns a single statistic for a column, computing the column's profile if it is not cached.
+
+        Args:
+            column (str): The column name.
+            stat (str): The statistic name, e.g. "mean", "50%", "null_count", "mode".
+
+        Returns:
+            object: The value of the statistic.
+        """
+        column_stats: dict[str, object] = self.get_column_stats(column)
+
+        if stat == "mode" and "mode" not in column_stats:
+            column_stats["mode"] = self._compute_mode(column)
+        elif stat == "value_counts" and "value_counts" not in column_stats:
+            column_stats["value_counts"] = self._dataframe[column].value_counts()
+        elif stat == "histogram" and "histogram" not in column_stats:
+            self.compute_histograms([column])
+        elif stat == "top_values" and "top_values" not in column_stats:
+            column_stats["top_values"] = get_top_values(self.get_stat(column, "value_counts"))
+
+        return column_stats[stat]
+
+    def get_column_stats(self, column: str) -> dict[str, object]:
+        """Returns all cached statistics for a column, computing them if needed.
+
+        Args:
+            column (str): The column name.
+
+        Returns:
+            dict[str, object]: The statistics of the column.
+        """
+        if column not in self._stats or self._has_stale_quartiles(column):
+            self.compute([column])
+        return self._stats[column]
+
+    def compute(self, columns: list[str]=None) -> None:
+        """Computes the profile for every column in columns that is not already cached. Columns are profiled in parallel
+        on the thread pool of parallel.py, each with vectorized passes over its values.
+
+        Args:
+            columns (list[str], optional): The columns to compute. Defaults to None, which computes all columns.
+        """
+        if columns is None:
+            columns = list(self._dataframe.columns)
+
+        stale_columns: list[str] = [column for column in columns if column in self._stats and self._has_stale_quartiles(column)]
+        if stale_columns:
+            self._compute_quartiles(stale_columns)
+
+        missing_columns: list[str] = [column for column in columns if column not in self._stats]
+        if not missing_columns:
+            return
+
+        self._stats.update(map_columns(self._profile_column, missing_columns, row_count=len(self._dataframe)))
+
+    def _profile_column(self, column: str) -> dict[str, object]:
+        """Computes the statistics of one column. Runs on a worker thread, so it only reads the dataframe.
+
+        Args:
+            column (str): The column name.
+
+        Returns:
+            dict[str, object]: The statistics of the column.
+        """
+        column_data: pd.Series = self._dataframe[column]
+        null_count: int = int(column_data.isna().sum())
+        column_stats: dict[str, object] = {"dtype": column_data.dtype, "null_count": null_count, "count": len(column_data) - null_count}
+
+        if self._is_numeric(column_data):
+            column_stats.update({"mean": column_data.mean(), "std": column_data.std(), "min": column_data.min(), "max": column_data.max()})
+            column_stats.update(self._quartiles(column))
+            return column_stats
+
+        if pd.api.types.is_datetime64_any_dtype(column_data.dtype):
+            # the span of the column picks the automatic time bucket frequency
+            column_stats.update({"min": column_data.min(), "max": column_data.max()})
+        value_counts: pd.Series = column_data.value_counts()
+        column_stats.update({
+            "value_counts": value_counts,
+            "unique": len(value_counts),
+            "top": value_counts.index[0] if len(value_counts) else None,
+            "freq": int(value_counts.iloc[0]) if len(value_counts) else None,
+        })
+        return column_stats
+
+    def _compute_quartiles(self, columns: list[str]) -> None:
+        for column, quartiles in map_columns(self._quartiles, columns, row_count=len(self._dataframe)).items():
+            self._stats[column].update(quartiles)
+
+    def _quartiles(self, column: str) -> dict[str, float]:
+        return dict(zip(QUARTILE_STATS, self._dataframe[column].quantile([0.25, 0.5, 0.75])))
+
+    def compute_modes(self, columns: list[str]) -> None:
+        """Computes the mode of every column in columns that is not already cached, in parallel.
+
+        Args:
+            columns (list[str]): The columns.
+        """
+        self.compute(columns)
+        missing_columns: list[str] = [column for column in columns if "mode" not in self._stats[column]]
+        for column, mode_value in map_columns(self._compute_mode, missing_columns, row_count=len(self._dataframe)).items():
+            self._stats[column]["mode"] = mode_value
+
+    def compute_histograms(self, columns: list[str]) -> None:
+        """Computes the plotting histogram of every column in columns that is not already cached, reusing the cached min and max.
+
+        Args:
+            columns (list[str]): The numeric (or boolean) columns.
+        """
+        self.compute(columns)
+        missing_columns: list[str] = [column for column in columns if "histogram" not in self._stats[column]]
+        if not missing_columns:
+            return
+
+        value_ranges: dict[str, tuple[float, float]] = {
+            column: (self._stats[column]["min"], self._stats[column]["max"])
+            for column in missing_columns
+            if "min" in self._stats[column] and pd.notna(self._stats[column]["min"])
+        }
+        for column, histogram in compute_histograms(self._dataframe, missing_columns, value_ranges).items():
+            self._stats[column]["histogram"] = histogram
+
+    def get_time_buckets(self, column: str, frequency: str="auto") -> pd.Series:
+        """Returns the value counts of a datetime column per time bucket, cached per frequency. A coarser frequency is
+        derived from a cached finer one instead of rescanning the column.
+
+        Args:
+            column (str): The datetime column.
+            frequency (str, optional): "hour", "day", "week", "month" or "auto", which picks one from the column's span. Defaults to "auto".
+
+        Returns:
+            pd.Series: The count per bucket, indexed by the start of each bucket.
+        """
+        column_stats: dict[str, object] = self.get_column_stats(column)
+        if frequency == "auto":
+            frequency = choose_frequency(column_stats["min"], column_stats["max"])
+
+        cached_buckets: dict[str, pd.Series] = column_stats.setdefault("time_buckets", {})
+        if frequency not in cached_buckets:
+            finer_frequencies: list[str] = [cached_frequency for cached_frequency in FREQUENCIES if cached_frequency in cached_buckets and can_rebucket(cached_frequency, frequency)]
+            if finer_frequencies:
+                cached_buckets[frequency] = rebucket(cached_buckets[finer_frequencies[-1]], frequency)
+            else:
+                cached_buckets[frequency] = bucket_datetimes(self._dataframe[column], frequency)
+
+        return cached_buckets[frequency]
+
+    def compute_time_buckets(self, columns: list[str], frequency: str="auto") -> None:
+        """Buckets every datetime column in columns that has no cached buckets at its frequency, in parallel.
+
+        Args:
+            columns (list[str]): The datetime columns.
+            frequency (str, optional): As in get_time_buckets. Defaults to "auto".
+        """
+        self.compute(columns)
+        frequencies: dict[str, str] = {column: choose_frequency(self._stats[column]["min"], self._stats[column]["max"]) if frequency == "auto" else frequency for column in columns}
+        missing_columns: list[str] = [column for column in columns if frequencies[column] not in self._stats[column].get("time_buckets", {})]
+        # get_time_buckets derives coarser buckets from cached finer ones, so columns with finer buckets are left to it
+        missing_columns = [column for column in missing_columns if not any(can_rebucket(cached_frequency, frequencies[column]) for cached_frequency in self._stats[column].get("time_buckets", {}))]
+
+        bucketed_columns: dict[str, pd.Series] = map_columns(lambda column: bucket_datetimes(self._dataframe[column], frequencies[column]), missing_columns, row_count=len(self._dataframe))
+        for column, buckets in bucketed_columns.items():
+            self._stats[column].setdefault("time_buckets", {})[frequencies[column]] = buckets
+
+    def null_counts(self) -> pd.Series:
+        """Returns how many null values appear in each column.
+
+        Returns:
+            pd.Series: Null count per column.
+        """
+        uncounted_columns: list[str] = [column for column in self._dataframe.columns if column not in self._stats and column not in self._null_counts]
+        if uncounted_columns:
+            self._null_counts.update({column: int(null_count) for column, null_count in self._dataframe[uncounted_columns].isna().sum().items()})
+        return pd.Series(
+            {column: self._stats[column]["null_count"] if column in self._stats else self._null_counts[column] for column in self._dataframe.columns},
+            dtype="int64",
+        )
+
+    def describe(self) -> pd.DataFrame:
+        """Builds the same table as pd.DataFrame.describe() from the cached statistics.
+
+        Returns:
+            pd.DataFrame: The descriptive statistics of the numeric columns, or of the other columns if there are no numeric columns.
+        """
+        self.compute()
+
+        numeric_columns: list[str] = [column for column in self._dataframe.columns if "mean" in self._stats[column]]
+        if numeric_columns:
+            return pd.DataFrame({column: [self._stats[column][stat] for stat in NUMERIC_STATS] for column in numeric_columns}, index=NUMERIC_STATS)
+
+        return pd.DataFrame({column: [self._stats[column][stat] for stat in OBJECT_STATS] for column in self._dataframe.columns}, index=OBJECT_STATS)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Returns every cached scalar statistic as a dataframe with one row per column.
+
+        Returns:
+            pd.DataFrame: The profile as a dataframe.
+        """
+        self.compute()
+        return pd.DataFrame.from_dict(
+            {column: {stat: value for stat, value in self._stats[column].items() if stat not in NON_SCALAR_STATS} for column in self._dataframe.columns},
+            orient="index",
+        )
+
+    # Cache maintenance suite
+    def set_dataframe(self, dataframe: pd.DataFrame) -> None:
+        """Points the profile at a new dataframe object. Does not invalidate anything, use invalidate for the columns that changed.
+
+        Args:
+            dataframe (pd.DataFrame): The new dataframe.
+        """
+        self._dataframe = dataframe
+
+    def invalidate(self, columns: list[str]=None) -> None:
+        """Removes cached statistics so they are recomputed on next access.
+
+        Args:
+            columns (list[str], optional): The columns that changed. Defaults to None, which invalidates every column (e.g. after rows are removed).
+        """
+        if columns is None:
+            self._stats.clear()
+            self._null_counts.clear()
+            return
+
+        for column in columns:
+            self._stats.pop(column, None)
+            self._null_counts.pop(column, None)
+
+    def append(self, new_rows: pd.DataFrame, dataframe: pd.DataFrame) -> None:
+        """Updates the cached statistics after rows were appended to the end of the dataframe, profiling only the new rows.
+        Counts, null counts, mean, std, min, max, value counts, time buckets and histograms (while the range is unchanged)
+        are merged exactly. Quartiles cannot be merged, so they are recomputed in one batched pass when they are next needed.
+
+        Args:
+            new_rows (pd.DataFrame): The appended rows, with the same d-types as dataframe.
+            dataframe (pd.DataFrame): The dataframe including the appended rows.
+        """
+        self._dataframe = dataframe
+        self._null_counts = {column: null_count + int(new_rows[column].isna().sum()) for column, null_count in self._null_counts.items() if column in dataframe.columns}
+
+        # a column whose d-type changed when the rows were added (e.g. ints that got a null) is profiled again
+        changed_columns: list[str] = [column for column, column_stats in self._stats.items() if column not in dataframe.columns or not self._is_same_dtype(column_stats["dtype"], dataframe[column].dtype)]
+        self.invalidate(changed_columns)
+        if not self._stats or new_rows.empty:
+            return
+
+        new_profile = ColumnProfile(new_rows[list(self._stats)])
+        new_profile.compute()
+        for column, column_stats in self._stats.items():
+            self._merge_stats(column, column_stats, new_profile, new_rows[column])
+
+    def drop(self, columns: list[str]) -> None:
+        """Forgets the statistics of removed columns.
+
+        Args:
+            columns (list[str]): The removed columns.
+        """
+        self.invalidate(columns)
+
+    def rename(self, rename_dict: dict[str, str]) -> None:
+        """Moves cached statistics to the new column names.
+
+        Args:
+            rename_dict (dict[str, str]): Mapping of old column names to new column names.
+        """
+        renamed_stats: dict[str, dict[str, object]] = {old_name: self._stats.pop(old_name) for old_name in rename_dict if old_name in self._stats}
+        for old_name, column_stats in renamed_stats.items():
+            self._stats[rename_dict[old_name]] = column_stats
+        renamed_null_counts: dict[str, int] = {old_name: self._null_counts.pop(old_name) for old_name in rename_dict if old_name in self._null_counts}
+        for old_name, null_count in renamed_null_counts.items():
+            self._null_counts[rename_dict[old_name]] = null_count
+    # End cache maintenance suite
+
+    def _merge_stats(self, column: str, column_stats: dict[str, object], new_profile: "ColumnProfile", new_values: pd.Series) -> None:
+        """Merges the statistics of appended rows into the cached statistics of a column.
+
+        Args:
+            column (str): The column name.
+            column_stats (dict[str, object]): The cached statistics, updated in place.
+            new_profile (ColumnProfile): The computed profile of the appended rows.
+            new_values (pd.Series): The appended values of the column.
+        """
+        new_stats: dict[str, object] = new_profile.get_column_stats(column)
+        old_count: int = column_stats["count"]
+        old_range: tuple[object, object] = (column_stats.get("min"), column_stats.get("max"))
+
+        column_stats["dtype"] = new_values.dtype  # categoricals may have gained categories
+        column_stats["null_count"] += new_stats["null_count"]
+        column_stats["count"] = old_count + new_stats["count"]
+
+        if "mean" in column_stats:
+            column_stats["mean"], column_stats["std"] = _merge_moments(old_count, column_stats["mean"], column_stats["std"], new_stats["count"], new_stats["mean"], new_stats["std"])
+            for stat in QUARTILE_STATS:
+                column_stats.pop(stat, None)
+        if "min" in column_stats:
+            column_stats["min"] = _merge_extreme(column_stats["min"], new_stats["min"], min)
+            column_stats["max"] = _merge_extreme(column_stats["max"], new_stats["max"], max)
+
+        if "value_counts" in column_stats:
+            new_value_counts: pd.Series = new_stats["value_counts"] if "value_counts" in new_stats else new_values.value_counts()
+            value_counts: pd.Series = _merge_value_counts(column_stats["value_counts"], new_value_counts)
+            column_stats["value_counts"] = value_counts
+            if "unique" in column_stats:
+                column_stats.update({
+                    "unique": len(value_counts),
+                    "top": value_counts.index[0] if len(value_counts) else None,
+                    "freq": int(value_counts.iloc[0]) if len(value_counts) else None,
+                })
+
+        if "time_buckets" in column_stats:
+            # the buckets are counts, so a concat of old and new buckets rebucketed at the same frequency adds them up and fills the gaps
+            column_stats["time_buckets"] = {
+                frequency: rebucket(pd.concat([buckets, bucket_datetimes(new_values, frequency)]), frequency)
+                for frequency, buckets in column_stats["time_buckets"].items()
+            }
+
+        if "histogram" in column_stats:
+            if (column_stats.get("min"), column_stats.get("max")) == old_range and pd.notna(old_range[0]):
+                counts, bin_edges = column_stats["histogram"]
+                new_counts, _ = compute_histograms(new_values.to_frame(), [column], {column: old_range}, bins=len(counts))[column]
+                column_stats["histogram"] = (counts + new_counts, bin_edges)
+            else:
+                del column_stats["histogram"]  # the bin edges follow the range, so a wider range needs new bins
+
+        # cheap to derive again from the merged statistics
+        column_stats.pop("mode", None)
+        column_stats.pop("top_values", None)
+
+    def _has_stale_quartiles(self, column: str) -> bool:
+        return "mean" in self._stats[column] and "50%" not in self._stats[column]
+
+    def _is_same_dtype(self, old_dtype: object, new_dtype: object) -> bool:
+        if isinstance(old_dtype, pd.CategoricalDtype) and isinstance(new_dtype, pd.CategoricalDtype):
+            return True
+        return old_dtype == new_dtype
+
+    def _compute_mode(self, column: str) -> object:
+        column_stats: dict[str, object] = self._stats[column]
+        if "top" in column_stats:
+            return column_stats["top"]
+
+        mode_values: pd.Series = self._dataframe[column].mode()
+        return mode_values.iloc[0] if len(mode_values) else None
+
+    def _is_numeric(self, column_data: pd.Series) -> bool:
+        return pd.api.types.is_numeric_dtype(column_data.dtype) and not pd.api.types.is_bool_dtype(column_data.dtype)
+
+    @property
+    def dataframe(self) -> pd.DataFrame:
+        return self._dataframe
+
+
+def _merge_moments(count: int, mean: float, std: float, new_count: int, new_mean: float, new_std: float) -> tuple[float, float]:
+    """Combines the mean and sample standard deviation of two sets of values (Chan et al.), without the values themselves.
+
+    Args:
+        count (int): Number of values in the first set.
+        mean (float): Mean of the first set.
+        std (float): Standard deviation of the first set.
+        new_count (int): Number of values in the second set.
+        new_mean (float): Mean of the second set.
+        new_std (float): Standard deviation of the second set.
+
+    Returns:
+        tuple[float, float]: The mean and standard deviation of both sets together.
+    """
+    if new_count == 0:
+        return mean, std
+    if count == 0:
+        return new_mean, new_std
+
+    total_count: int = count + new_count
+    delta: float = new_mean - mean
+    squared_deviations: float = (std**2 * (count - 1) if count > 1 else 0.0) + (new_std**2 * (new_count - 1) if new_count > 1 else 0.0)
+    squared_deviations += delta**2 * count * new_count / total_count
+    return mean + delta * new_count / total_count, np.sqrt(squared_deviations / (total_count - 1))
+
+
+def _merge_extreme(value: object, new_value: object, extreme: Callable) -> object:
+    if pd.isna(value):
+        return new_value
+    if pd.isna(new_value):
+        return value
+    return extreme(value, new_value)
+
+
+def _merge_value_counts(value_counts: pd.Series, new_value_counts: pd.Series) -> pd.Series:
+    """Adds up two value counts. Values keep the order they were first seen in, so ties are broken like value_counts on the whole column.
+
+    Args:
+        value_counts (pd.Series): The counts of the existing rows.
+        new_value_counts (pd.Series): The counts of the appended rows.
+
+    Returns:
+        pd.Series: The combined counts, most frequent first.
+    """
+    values: pd.Index = value_counts.index.append(new_value_counts.index.difference(value_counts.index, sort=False))
+    merged_counts: pd.Series = value_counts.reindex(values, fill_value=0) + new_value_counts.reindex(values, fill_value=0)
+    return merged_counts.astype(np.int64).sort_values(ascending=False, kind="stable")
@@ -4,37 +4,247 @@
 
 # Code is a work in progress based on teachings of Rob Mulla https://youtu.be/xi0vhXFPegw?si=cicV7Pdf9NTjYBRC
 
+import os
+
+import numpy as np
 import pandas as pd
 import seaborn as sns
 
+from .checkpoint_store import CheckpointStore
 from .column_handler import ColumnHandler
+from .column_profile import ColumnProfile
+from .dataset_profile import DatasetProfile, compare_profiles
 from .duplicate_analyzer import DuplicateAnalyzer
 from .feature_analyzer import FeatureAnalyzer
+from .frame_cache import FrameCache
+from .instrumentation import instrument_step, instrumented
+from .mapped_loader import get_df_from_mapped_file, get_file_format, get_mapped_file_columns
 from .null_analyzer import NullAnalyzer
+from .null_index import NullMaskIndex
+from .preparation_pipeline import PreparationPipeline, load_pipeline
+from .row_hash_index import RowHashIndex
+from .sample_estimates import mean_intervals, null_ratio_intervals
 
-from .utilities import get_df_from_csv, prompt_selection_for_column_list, prompt_for_columns_to_rename, prompt_user_for_int
+from .utilities import get_csv_block_sample, get_csv_columns, get_csv_reservoir_sample, get_csv_rows_after, get_df_from_csv, get_full_file_path, prompt_selection_for_column_list, prompt_for_columns_to_rename, prompt_user_for_int
 from .validate_input import get_user_confirmation, validate_argument
 
+SAMPLE_METHODS: list[str] = ["reservoir", "block"]
+PREPARE_STEPS: list[str] = ["remove", "rename", "dtypes", "nulls", "duplicates", "reset"]
+
 
 # TODO: Add a pause between each step of prepare_data
 class DataframeManager:
 
-    def __init__(self, dataframe: pd.DataFrame=None, file_path: str="../data/input/", file_name: str="data.csv", date_columns: list[str]=None, column_names: list[str]=None) -> None:
+    def __init__(self, dataframe: pd.DataFrame=None, file_path: str="../data/input/", file_name: str="data.csv", date_columns: list[str]=None, column_names: list[str]=None, chunk_size: int=None, memory_budget_mb: float=None, usecols: list[str]=None, dtypes: dict[str, str]=None, pipeline: PreparationPipeline|dict|str=None, cache_directory: str=None, cache_max_size_mb: float=1024, cache_steps: bool=False, sample_size: int=None, sample_method: str="reservoir", sample_seed: int=0, checkpoint_directory: str=None, resume: bool=False) -> None:
         """Class used to hold a Pandas dataframe so that standardized analysis can be performed on it.
 
         Args:
             dataframe: (pd.DataFrame, optional): A pandas dataframe; else, pass file_path and/or file_name.
             file_path (str, optional): The path to the csv file. Defaults to "../data/input/".
-            file_name (str, optional): The name of the csv file. Defaults to "data.csv".
+            file_name (str, optional): The name of the csv file. Defaults to "data.csv". Arrow/Feather (.arrow, .feather, .ipc),
+                Parquet (.parquet) and NumPy (.npy, or a directory of one .npy file per column) files are loaded through a
+                memory map instead; the chunk and cache options only apply to csv files.
             date_columns (list[str], optional): Columns that contain date information.. Defaults to None.
             column_names (list[str], optional): The names to provide each column. Defaults to None.
+            chunk_size (int, optional): Load the csv in chunks of this many rows, compacting each chunk as it is read. Defaults to None.
+            memory_budget_mb (float, optional): Load the csv in chunks that each fit in roughly this many MB. Defaults to None.
+            usecols (list[str], optional): Only parse these columns of the csv. Defaults to None.
+            dtypes (dict[str, str], optional): D-types to parse columns of the csv as. Defaults to None.
+            pipeline (PreparationPipeline|dict|str, optional): A preparation pipeline (or its spec) whose dropped columns and
+                d-type changes are pushed into the csv reader. The pipeline still needs to be run with prepare_data. Defaults to None.
+            cache_directory (str, optional): Directory of an on-disk Arrow cache. Loading the same unchanged csv with the same
+                options again reads the cached columns instead of parsing the text. Defaults to None, which disables the cache.
+            cache_max_size_mb (float, optional): Size limit of the cache; least recently used entries are evicted. Defaults to 1024.
+            cache_steps (bool, optional): Also cache the dataframe after each prepare_data step. Defaults to False.
+            sample_size (int, optional): Load only a random sample of this many rows for a first look. understand_data,
+                recommend_nulls and understand_features then work on the sample with estimated row counts and confidence
+                intervals; call load_full before preparing the data. Defaults to None, which loads every row.
+            sample_method (str, optional): "reservoir" samples uniformly in one pass over a csv file, "block" reads runs of
+                rows from seeded random offsets without reading the rest of the file. Defaults to "reservoir".
+            sample_seed (int, optional): Seed of the sample, so the same rows can be drawn again. Defaults to 0.
+            checkpoint_directory (str, optional): Directory to checkpoint the dataframe and the decisions to after each
+                prepare_data step. Checkpoints of the same source share unchanged columns on disk. Defaults to None.
+            resume (bool, optional): Load the last checkpoint of the same unchanged source instead of the file, and skip the
+                steps it completed in the next prepare_data. Defaults to False.
         """
 
-        if dataframe:
+        self._cache: FrameCache = None
+        self._cache_source: tuple[str, dict] = None
+        self._cache_steps: bool = cache_steps
+        # where refresh reads rows appended to the csv since it was loaded
+        self._csv_source: dict[str, object] = None
+        # how the rows were sampled, None once the whole file is loaded
+        self._sample_info: dict[str, object] = None
+        # kept so load_full can load the whole file after a sample
+        self._load_options: dict[str, object] = None
+        self._checkpoint_store: CheckpointStore = CheckpointStore(checkpoint_directory) if checkpoint_directory is not None else None
+        self._session_key: str = None
+        # the columns of the source file, when a pipeline's dropped columns were left out while loading
+        self._source_columns: list[str] = None
+        # steps of a resumed session that the next prepare_data skips
+        self._resumed_steps: list[str] = []
+
+        if dataframe is not None:
             self._dataframe = dataframe
+            if self._checkpoint_store is not None:
+                self._session_key = self._checkpoint_store.make_session_key(dataframe=dataframe)
+                if resume:
+                    self._resume_checkpoint()
         else:
-            self._dataframe: pd.DataFrame = get_df_from_csv(file_path, file_name, date_columns, column_names)
+            full_file_path: str = get_full_file_path(file_path, file_name)
+            file_format: str = get_file_format(full_file_path)
+
+            if pipeline is not None:
+                file_columns: list[str] = get_csv_columns(file_path, file_name, column_names) if file_format == "csv" else get_mapped_file_columns(file_path, file_name, column_names)
+                read_options: dict[str, object] = load_pipeline(pipeline).read_options(file_columns)
+                self._source_columns = file_columns
+                usecols = usecols or read_options["usecols"]
+                dtypes = {**(read_options["dtypes"] or {}), **(dtypes or {})} or None
+                date_columns = sorted(set(date_columns or []) | set(read_options["date_columns"] or [])) or None
+
+            self._load_options = {
+                "file_path": file_path, "file_name": file_name, "date_columns": date_columns, "column_names": column_names, "chunk_size": chunk_size,
+                "memory_budget_mb": memory_budget_mb, "usecols": usecols, "dtypes": dtypes, "cache_directory": cache_directory, "cache_max_size_mb": cache_max_size_mb,
+            }
+            if self._checkpoint_store is not None:
+                reader_options: dict = {"date_columns": date_columns, "column_names": column_names, "usecols": usecols, "dtypes": dtypes}
+                self._session_key = self._checkpoint_store.make_session_key(source_path=full_file_path, reader_options=reader_options)
+
+            if resume and self._session_key is not None and self._resume_checkpoint():
+                self._set_csv_source(file_path, file_name, date_columns, column_names, usecols, dtypes)
+                if self._csv_source is not None:
+                    resumed_column_map: dict[str, str]|None = self._checkpoint_store.load_manifest(self._session_key)["checkpoints"][-1]["decisions"].get("column_map")
+                    self._csv_source["column_map"] = resumed_column_map or self._csv_source["column_map"]
+            elif sample_size is not None:
+                self._load_sample(sample_size, sample_method, sample_seed)
+            else:
+                self._load_file(**self._load_options)
+
+        # shared by every analyzer so column statistics are computed once and only recomputed for columns that change
+        self._profile: ColumnProfile = ColumnProfile(self._dataframe)
+        # kept between analyses (and extended by append) once the null and duplicate analyses have built them
+        self._null_index: NullMaskIndex = None
+        self._row_hash_index: RowHashIndex = None
         
+    def _load_file(self, file_path: str, file_name: str, date_columns: list[str], column_names: list[str], chunk_size: int, memory_budget_mb: float, usecols: list[str], dtypes: dict[str, str], cache_directory: str, cache_max_size_mb: float) -> None:
+        """Loads every row of the file, from the cache if possible. See __init__ for the arguments.
+        """
+        full_file_path: str = get_full_file_path(file_path, file_name)
+        file_format: str = get_file_format(full_file_path)
+
+        self._dataframe: pd.DataFrame = None
+        if file_format != "csv":
+            # already a memory-mapped read, so the cache and the csv options do not apply
+            self._dataframe = get_df_from_mapped_file(file_path, file_name, date_columns=date_columns, column_names=column_names, usecols=usecols, dtypes=dtypes)
+        elif cache_directory is not None:
+            self._cache = FrameCache(cache_directory, max_size_mb=cache_max_size_mb)
+            # chunked loading compacts d-types, so it changes what is loaded just like the other reader options
+            reader_options: dict = {"date_columns": date_columns, "column_names": column_names, "usecols": usecols, "dtypes": dtypes, "compact": chunk_size is not None or memory_budget_mb is not None}
+            self._cache_source = (full_file_path, reader_options)
+            self._dataframe = self._cache.load(self._get_cache_key("raw"))
+            if self._dataframe is not None:
+                print("[+] Loaded dataframe from cache.")
+
+        if self._dataframe is None:
+            self._dataframe = get_df_from_csv(file_path, file_name, date_columns, column_names, chunk_size=chunk_size, memory_budget_mb=memory_budget_mb, usecols=usecols, dtypes=dtypes)
+            if self._cache is not None:
+                self._cache.store(self._get_cache_key("raw"), self._dataframe)
+
+        self._set_csv_source(file_path, file_name, date_columns, column_names, usecols, dtypes)
+
+    def _set_csv_source(self, file_path: str, file_name: str, date_columns: list[str], column_names: list[str], usecols: list[str], dtypes: dict[str, str]) -> None:
+        full_file_path: str = get_full_file_path(file_path, file_name)
+        if get_file_format(full_file_path) == "csv":
+            source_columns: list[str] = get_csv_columns(file_path, file_name, column_names)
+            self._csv_source = {
+                "file_path": full_file_path,
+                "offset": os.path.getsize(full_file_path),
+                "read_options": {"column_names": source_columns, "date_columns": date_columns, "usecols": usecols, "dtypes": dtypes},
+                # the current name of every source column still in the dataframe, updated as columns are removed or renamed
+                "column_map": {column: column for column in (usecols or source_columns)},
+            }
+
+    def _resume_checkpoint(self) -> bool:
+        """Replaces the dataframe with the last checkpoint of the session.
+
+        Returns:
+            bool: True if the session had a checkpoint.
+        """
+        checkpoint: tuple[pd.DataFrame, dict]|None = self._checkpoint_store.load(self._session_key)
+        if checkpoint is None:
+            print("[-] No checkpoint to resume from, starting from the source.")
+            return False
+
+        self._dataframe = checkpoint[0]
+        self._resumed_steps = self._checkpoint_store.completed_steps(self._session_key)
+        print(f"[+] Resumed from the checkpoint after step {checkpoint[1]['step']}. Completed steps: {self._resumed_steps}")
+        return True
+
+    def _load_sample(self, sample_size: int, sample_method: str, sample_seed: int) -> None:
+        """Loads a random sample of rows instead of the whole file. Memory-mapped files are sampled by picking random rows
+        of the mapped file, which only reads the pages holding those rows, so both methods give a uniform sample there.
+
+        Args:
+            sample_size (int): The number of rows to sample.
+            sample_method (str): "reservoir" or "block".
+            sample_seed (int): Seed of the sample.
+        """
+        validate_argument(valid_arg_options=SAMPLE_METHODS, user_input=sample_method, parameter_name="sample_method")
+        options: dict[str, object] = self._load_options
+        file_format: str = get_file_format(get_full_file_path(options["file_path"], options["file_name"]))
+
+        row_count_is_estimated: bool = False
+        if file_format != "csv":
+            mapped_dataframe: pd.DataFrame = get_df_from_mapped_file(options["file_path"], options["file_name"], date_columns=options["date_columns"], column_names=options["column_names"], usecols=options["usecols"], dtypes=options["dtypes"])
+            row_count: int = len(mapped_dataframe)
+            positions: np.ndarray = np.sort(np.random.default_rng(sample_seed).choice(row_count, size=min(sample_size, row_count), replace=False))
+            self._dataframe = mapped_dataframe.take(positions)
+            sample_method = "random"
+        elif sample_method == "reservoir":
+            self._dataframe, row_count = get_csv_reservoir_sample(options["file_path"], options["file_name"], options["date_columns"], options["column_names"], sample_size, seed=sample_seed, chunk_size=options["chunk_size"] or 100_000, usecols=options["usecols"], dtypes=options["dtypes"])
+        else:
+            self._dataframe, row_count = get_csv_block_sample(options["file_path"], options["file_name"], options["date_columns"], options["column_names"], sample_size, seed=sample_seed, usecols=options["usecols"], dtypes=options["dtypes"])
+            row_count_is_estimated = len(self._dataframe) < row_count
+
+        self._sample_info = {"method": sample_method, "seed": sample_seed, "sample_rows": len(self._dataframe), "file_rows": row_count, "file_rows_estimated": row_count_is_estimated}
+        print(f"[+] Sampled {len(self._dataframe)} of {'about ' if row_count_is_estimated else ''}{row_count} rows. Call load_full() to load every row.")
+
+    @instrumented("load_full")
+    def load_full(self) -> None:
+        """Replaces a sample loaded with sample_size by every row of the file, e.g. once the sample shows the data is worth preparing.
+        """
+        if self._sample_info is None:
+            print("[-] The whole dataframe is already loaded.")
+            return
+
+        self._load_file(**self._load_options)
+        self._sample_info = None
+        self._profile = ColumnProfile(self._dataframe)
+        self._forget_indexes()
+        print(f"[+] Loaded all {len(self._dataframe)} rows.")
+
+    def sample_estimates(self, confidence: float=0.95) -> dict[str, pd.DataFrame]:
+        """Estimates the null ratio of every column and the mean of every numeric column of the whole file from the sample.
+
+        Args:
+            confidence (float, optional): The confidence level of the intervals. Defaults to 0.95.
+
+        Returns:
+            dict[str, pd.DataFrame]: The intervals of the null ratios ("null_ratio") and of the means ("mean"). See sample_estimates.py.
+        """
+        if self._sample_info is None:
+            raise ValueError("sample_estimates requires a dataframe loaded with sample_size.")
+        file_rows: int = self._sample_info["file_rows"]
+        return {
+            "null_ratio": null_ratio_intervals(self._profile, file_rows, confidence=confidence),
+            "mean": mean_intervals(self._profile, file_rows, confidence=confidence),
+        }
+
+    def _require_full_data(self, step: str) -> None:
+        if self._sample_info is not None:
+            raise ValueError(f"The dataframe is a sample of {self._sample_info['sample_rows']} rows. Call load_full() before {step}.")
+
+    @instrumented("understand_data")
     def understand_data(self, head_tail_size: int=20, analysis_type="short") -> None:
         """Step one of Exploratory data anlysis. Prints some information to help understand the dataframe.
 
@@ -49,6 +259,8 @@ class DataframeManager:
         self._explain_dtypes()
         self._show_descriptive_stats()
         self._show_head_tail()
+        if self._sample_info is not None:
+            self._show_sample_estimates()
 
         if analysis_type == "long":
             self._show_null_values()
@@ -59,6 +271,9 @@ class DataframeManager:
         """Prints the shape of the dataframe.
         """
         print(f"======= Dataframe shape ======= \nThe dataframe has {self._dataframe.shape[0]} rows and {self._dataframe.shape[1]} columns.")
+        if self._sample_info is not None:
+            estimated: str = "an estimated " if self._sample_info["file_rows_estimated"] else ""
+            print(f"[!] The rows are a {self._sample_info['method']} sample of the file, which has {estimated}{self._sample_info['file_rows']} rows.")
     def _explain_dtypes(self):
         """Prints the column names and dtypes.
         """
@@ -66,7 +281,7 @@ class DataframeManager:
     def _show_descriptive_stats(self):
         """Prints the descriptive stats of each column.
         """
-        print(f"======= Descriptive stats ======= \n{self._dataframe.describe()}")
+        print(f"======= Descriptive stats ======= \n{self._profile.describe()}")
     def _show_head_tail(self, head_tail_size: int = 20):
         """Prints the head and tail of the dataframe.
 
@@ -75,15 +290,26 @@ class DataframeManager:
         """
         print(f"======= First {head_tail_size} rows ======= \n{self._dataframe.head(head_tail_size)}")
         print(f"\n======= Last {head_tail_size} rows ======= \n{self._dataframe.tail(head_tail_size)}")
+    def _show_sample_estimates(self, confidence: float=0.95):
+        """Prints the estimated null percentages and means of the whole file with their confidence intervals.
+
+        Args:
+            confidence (float, optional): The confidence level of the intervals. Defaults to 0.95.
+        """
+        estimates: dict[str, pd.DataFrame] = self.sample_estimates(confidence=confidence)
+        print(f"======= Estimated null percentages of the file ({confidence:.0%} confidence) ======= \n{(estimates['null_ratio'] * 100).round(2)}")
+        if not estimates["mean"].empty:
+            print(f"======= Estimated means of the file ({confidence:.0%} confidence) ======= \n{estimates['mean']}")
     def _show_null_values(self):
         """Prints how many null values appear in each column.
         """
         print("======= Null values in each column ======= ")
-        print(f"{self._dataframe.isna().sum()}")
+        print(f"{self._profile.null_counts()}")
     # END OF COLLECTION OF SIMPLE PRINT FUNCTIONS
 
 
-    def prepare_data(self, skip_remove:bool=False, skip_rename:bool=False, skip_dtypes:bool=False, skip_nulls:bool=False, skip_dups: bool=False, skip_reset:bool=False) -> None:
+    @instrumented("prepare_data")
+    def prepare_data(self, skip_remove:bool=False, skip_rename:bool=False, skip_dtypes:bool=False, skip_nulls:bool=False, skip_dups: bool=False, skip_reset:bool=False, pipeline: PreparationPipeline|dict|str=None) -> None:
         """Step two of exploratory data anlalysis. Provides a suite of methods that allow a user to prepare the data for further anlaysis.
 
         Args:
@@ -93,57 +319,255 @@ class DataframeManager:
             skip_nulls (bool, optional): Skip the null aalysis step. Defaults to False.
             skip_dups (bool, optional): Skip the duplicate analysis step. Defaults to False.
             skip_reset (bool, optional): Skip the index reset step. Defaults to False.
+            pipeline (PreparationPipeline|dict|str, optional): A pipeline, spec dict or path to a json/yaml spec. When passed,
+                every step runs from the spec without prompting and the skip flags are ignored. Defaults to None.
+
+        With a checkpoint_directory, the dataframe and the step's decisions are checkpointed after every step, and the steps
+        completed by a resumed session are skipped.
         """
 
+        self._require_full_data("prepare_data")
+        if pipeline is not None:
+            if "pipeline" in self._resumed_steps:
+                print("[+] The pipeline already ran in the resumed session, skipped.")
+            else:
+                state_before: dict = self._describe_state()
+                self.run_pipeline(pipeline)
+                self._checkpoint_step("pipeline", state_before)
+            self._resumed_steps = []
+            return
+
+        # steps the resumed session completed count as skipped
+        skip_remove, skip_rename, skip_dtypes, skip_nulls, skip_dups, skip_reset = (
+            skip or step in self._resumed_steps for skip, step in zip((skip_remove, skip_rename, skip_dtypes, skip_nulls, skip_dups, skip_reset), PREPARE_STEPS)
+        )
+        if self._resumed_steps:
+            print(f"[!] Skipping the steps completed before the checkpoint: {[step for step in PREPARE_STEPS if step in self._resumed_steps]}")
+            self._resumed_steps = []
+
         # TODO: Validate argument types as bools using validate_input
-        if not skip_remove and not skip_rename and not skip_dtypes:
-            column_handler = ColumnHandler(self._dataframe)
+        if not (skip_remove and skip_rename and skip_dtypes):
+            column_handler = ColumnHandler(self._dataframe, profile=self._profile)
 
+        columns_before: pd.Series = self._dataframe.dtypes
         if not skip_remove:
             print("\n[!] Starting remove columns step:")
-            column_handler.remove_columns_interactively()
-            self._dataframe = column_handler.dataframe
+            state_before = self._describe_state()
+            column_names_before: list[str] = list(self._dataframe.columns)
+            with instrument_step("prepare_data.remove", lambda: self._dataframe):
+                column_handler.remove_columns_interactively()
+                self._dataframe = column_handler.dataframe
+            self._track_step_columns(column_names_before)
+            self._cache_step("remove")
+            self._checkpoint_step("remove", state_before)
             print("[!] Remove columns step finished.")
         if not skip_rename:
             print("\n[!] Starting rename columns step:")
-            column_handler.rename_columns_interactively()
-            self._dataframe = column_handler.dataframe
+            state_before = self._describe_state()
+            column_names_before = list(self._dataframe.columns)
+            with instrument_step("prepare_data.rename", lambda: self._dataframe):
+                column_handler.rename_columns_interactively()
+                self._dataframe = column_handler.dataframe
+            self._track_step_columns(column_names_before)
+            self._cache_step("rename")
+            self._checkpoint_step("rename", state_before)
             print("[!] Rename columns step finished.")
         if not skip_dtypes:
             print("\n[!] Starting d-types step:")
-            column_handler.analyze_dtypes()
-            self._dataframe = column_handler.dataframe
+            state_before = self._describe_state()
+            with instrument_step("prepare_data.dtypes", lambda: self._dataframe):
+                column_handler.analyze_dtypes()
+                self._dataframe = column_handler.dataframe
+            self._cache_step("dtypes")
+            self._checkpoint_step("dtypes", state_before)
             print("[!] D-types step finished.")
+        if not self._dataframe.dtypes.equals(columns_before):
+            self._forget_indexes()
         
         if not skip_nulls:
             print("\n[!] Starting null analysis step:")
-            self.analyze_nulls()
+            state_before = self._describe_state()
+            with instrument_step("prepare_data.nulls", lambda: self._dataframe):
+                self.analyze_nulls()
+            self._cache_step("nulls")
+            self._checkpoint_step("nulls", state_before)
             print("[!] Null step finished.")
         if not skip_dups:
             print("\n[!] Starting duplicate analysis step:")
-            self.analyze_duplicates()
+            state_before = self._describe_state()
+            with instrument_step("prepare_data.duplicates", lambda: self._dataframe):
+                self.analyze_duplicates()
+            self._cache_step("duplicates")
+            self._checkpoint_step("duplicates", state_before)
             print("[!] Duplicates step finished.")
         if not skip_reset:
             print("\n[!] Starting index reset step:")
-            self._reset_index()
+            state_before = self._describe_state()
+            with instrument_step("prepare_data.reset", lambda: self._dataframe):
+                self._reset_index()
+            self._cache_step("reset")
+            self._checkpoint_step("reset", state_before)
             print("[!] Index reset step complete!")
         
         print("\n[!] Data preparation step complete!")
 
+    def load_cached_step(self, step: str) -> bool:
+        """Replaces the dataframe with the cached output of a prepare_data step from an earlier session with cache_steps=True.
+
+        Args:
+            step (str): One of "remove", "rename", "dtypes", "nulls", "duplicates" or "reset".
+
+        Returns:
+            bool: True if the step was found in the cache.
+        """
+        validate_argument(valid_arg_options=["remove", "rename", "dtypes", "nulls", "duplicates", "reset"], user_input=step, parameter_name="step")
+        if self._cache is None:
+            raise ValueError("load_cached_step requires a cache_directory.")
+
+        cached_dataframe: pd.DataFrame|None = self._cache.load(self._get_cache_key(step))
+        if cached_dataframe is None:
+            print(f"[-] No cached dataframe for step {step}.")
+            return False
+
+        self._dataframe = cached_dataframe
+        self._profile = ColumnProfile(self._dataframe)
+        self._forget_indexes()
+        print(f"[+] Loaded dataframe after step {step} from cache.")
+        return True
+
+    def _checkpoint_step(self, step: str, state_before: dict) -> None:
+        """Checkpoints the dataframe after a step, with what the step changed as its decisions. A failed checkpoint is
+        reported but does not stop prepare_data.
+
+        Args:
+            step (str): The completed step.
+            state_before (dict): The state of the dataframe before the step, from _describe_state.
+        """
+        if self._checkpoint_store is None:
+            return
+        decisions: dict = self._describe_changes(state_before, self._describe_state())
+        if self._csv_source is not None:
+            # which csv column each column came from, so refresh still works in a resumed session
+            decisions["column_map"] = self._csv_source["column_map"]
+        try:
+            self._checkpoint_store.save(self._session_key, step, self._dataframe, decisions=decisions)
+        except (TypeError, ValueError, NotImplementedError, OSError) as e:  # pyarrow's errors derive from these
+            print(f"[-] Could not checkpoint step {step}: {e}")
+
+    def _describe_state(self) -> dict:
+        if self._checkpoint_store is None:
+            return {}
+        return {
+            "columns": [str(column) for column in self._dataframe.columns],
+            "dtypes": {str(column): str(dtype) for column, dtype in self._dataframe.dtypes.items()},
+            "rows": len(self._dataframe),
+            # counted directly, since the profile would compute every statistic of the columns the step invalidated
+            "null_counts": {str(column): int(null_count) for column, null_count in self._dataframe.isna().sum().items()},
+            "range_index": isinstance(self._dataframe.index, pd.RangeIndex),
+        }
+
+    def _describe_changes(self, state_before: dict, state_after: dict) -> dict:
+        """Summarizes what a step decided: removed and renamed columns, changed d-types, nulls filled or dropped and removed rows.
+
+        Args:
+            state_before (dict): The state before the step.
+            state_after (dict): The state after the step.
+
+        Returns:
+            dict: Only the kinds of changes the step made.
+        """
+        columns_before: list[str] = state_before["columns"]
+        columns_after: list[str] = state_after["columns"]
+        changes: dict[str, object] = {}
+        if len(columns_before) == len(columns_after):
+            # renaming keeps the column order
+            renamed: dict[str, str] = {old: new for old, new in zip(columns_before, columns_after) if old != new}
+            if renamed:
+                changes["renamed_columns"] = renamed
+        else:
+            changes["removed_columns"] = [column for column in columns_before if column not in columns_after]
+
+        old_names: dict[str, str] = {new: old for old, new in changes.get("renamed_columns", {}).items()}
+        dtypes_before: dict[str, str] = {column: state_before["dtypes"][old_names.get(column, column)] for column in columns_after if old_names.get(column, column) in state_before["dtypes"]}
+        changed_dtypes: dict[str, str] = {column: dtype for column, dtype in state_after["dtypes"].items() if column in dtypes_before and dtypes_before[column] != dtype}
+        if changed_dtypes:
+            changes["dtypes"] = changed_dtypes
+        removed_nulls: dict[str, int] = {
+            column: state_before["null_counts"][old_names.get(column, column)] - null_count
+            for column, null_count in state_after["null_counts"].items()
+            if old_names.get(column, column) in state_before["null_counts"] and state_before["null_counts"][old_names.get(column, column)] != null_count
+        }
+        if removed_nulls:
+            changes["removed_nulls"] = removed_nulls
+        if state_before["rows"] != state_after["rows"]:
+            changes["removed_rows"] = state_before["rows"] - state_after["rows"]
+        if state_after["range_index"] and not state_before["range_index"]:
+            changes["index_reset"] = True
+        return changes
+
+    def _cache_step(self, step: str) -> None:
+        if self._cache is not None and self._cache_steps:
+            self._cache.store(self._get_cache_key(step), self._dataframe)
+
+    def _get_cache_key(self, step: str) -> str:
+        source_path, reader_options = self._cache_source
+        return self._cache.make_key(source_path, reader_options, step=step)
+
+    @instrumented("run_pipeline")
+    def run_pipeline(self, pipeline: PreparationPipeline|dict|str) -> None:
+        """Runs a declarative preparation pipeline on the dataframe without any prompts.
+
+        Args:
+            pipeline (PreparationPipeline|dict|str): A pipeline, spec dict or path to a json/yaml spec.
+        """
+        self._require_full_data("run_pipeline")
+        pipeline = load_pipeline(pipeline)
+
+        columns_before: list[str] = list(self._dataframe.columns)
+        pipeline.explain(columns_before, self._source_columns)
+        self._dataframe = pipeline.run(self._dataframe, self._source_columns)
+        for operation, argument in pipeline.compile(columns_before, self._source_columns):
+            if operation == "project":
+                kept_columns, new_names = argument
+                self._track_columns([column for column in columns_before if column not in kept_columns], dict(zip(kept_columns, new_names)))
+        self._profile.set_dataframe(self._dataframe)
+        self._profile.invalidate()
+        self._forget_indexes()
+
     def analyze_duplicates(self) -> None:
         """Provides the user a way to analyze and handle the duplicate values of the dataframe.
         """
 
-        duplicate_analyzer = DuplicateAnalyzer(self._dataframe)
+        duplicate_analyzer = DuplicateAnalyzer(self._dataframe, profile=self._profile, row_hash_index=self._row_hash_index)
+        if duplicate_analyzer.dataframe is not self._dataframe:
+            self._null_index = None  # duplicate rows were removed
         self._dataframe = duplicate_analyzer.dataframe
+        self._profile.set_dataframe(self._dataframe)
+        self._row_hash_index = duplicate_analyzer.row_hash_index
         del duplicate_analyzer
             
+    def recommend_nulls(self) -> None:
+        """Prints the null percentage of each column with a recommendation on how to handle it, without changing anything.
+        On a sample, the confidence intervals of the null percentages of the whole file are printed as well.
+        """
+        null_analyzer = NullAnalyzer(self._dataframe, profile=self._profile, null_index=self._null_index, analyze=False)
+        self._null_index = null_analyzer.null_index
+        null_ratio_estimates: pd.DataFrame = self.sample_estimates()["null_ratio"] if self._sample_info is not None else None
+        null_analyzer.show_null_recommendations(null_ratio_estimates=null_ratio_estimates)
+        del null_analyzer
+
     def analyze_nulls(self) -> None:
         """Passes self.dataframe object into NullAnalyzer class which handles all the null analysis logic.
         This is to abstract some of the methods since it really polluted the DataframeManager class.
         """
-        null_analyzer = NullAnalyzer(self._dataframe)
+        columns_before: list[str] = list(self._dataframe.columns)
+        null_analyzer = NullAnalyzer(self._dataframe, profile=self._profile, null_index=self._null_index)
+        if null_analyzer.dataframe is not self._dataframe:
+            self._row_hash_index = None  # nulls were filled or rows and columns were dropped
         self._dataframe = null_analyzer.dataframe
+        self._track_step_columns(columns_before)
+        self._profile.set_dataframe(self._dataframe)
+        self._null_index = null_analyzer.null_index
         del null_analyzer
 
     def _reset_index(self) -> None:
@@ -152,19 +576,214 @@ class DataframeManager:
         user_wants_index_rest: bool = get_user_confirmation(message="[*] Would you like to reset the index? [Y/n]", true_options=["yes", "y", ""], false_options=["no", "n"])
         if user_wants_index_rest:
             self._dataframe = self._dataframe.reset_index(drop=True)
+            self._profile.set_dataframe(self._dataframe)
+            if self._row_hash_index is not None:
+                self._row_hash_index.set_dataframe(self._dataframe)
             print("[+] Index has been reset!")
         else:
             print("[-] Index has not been reset.")
 
-    def understand_features(self):
+    @instrumented("append")
+    def append(self, new_rows: pd.DataFrame, subset_list: list[str]=None) -> pd.DataFrame:
+        """Adds rows to the end of the dataframe. The cached statistics, null masks and duplicate index are updated from
+        the new rows only, so refreshing understand_data and the null and duplicate analyses scales with the new rows.
+
+        Args:
+            new_rows (pd.DataFrame): The rows to add. Must contain every column of the dataframe; other columns (e.g. ones
+                removed in prepare_data) are ignored and values are cast to the dataframe's d-types where possible.
+            subset_list (list[str], optional): The columns to consider duplicates. Defaults to None, which uses all columns.
+
+        Returns:
+            pd.DataFrame: One row per new row that repeats an earlier row, with the index label of the first row it repeats
+                ("duplicate_of") and whether that row was already in the dataframe ("matches_history").
+        """
+        self._require_full_data("append")
+        new_rows = self._align_new_rows(new_rows)
+        row_count: int = len(self._dataframe)
+
+        if isinstance(self._dataframe.index, pd.RangeIndex) and self._dataframe.index.step == 1:
+            # continue the numbering, so the new rows do not repeat existing labels
+            new_rows = new_rows.set_axis(pd.RangeIndex(self._dataframe.index.stop, self._dataframe.index.stop + len(new_rows)))
+        self._dataframe = pd.concat([self._dataframe, new_rows])
+
+        self._profile.append(new_rows, self._dataframe)
+        if self._null_index is not None:
+            self._null_index.append(new_rows)
+        if self._row_hash_index is not None:
+            self._row_hash_index.append(new_rows, self._dataframe)
+        else:
+            self._row_hash_index = RowHashIndex(self._dataframe)
+
+        new_duplicates: pd.DataFrame = self._row_hash_index.appended_duplicates(row_count, subset_list)
+        history_count: int = int(new_duplicates["matches_history"].sum())
+        print(f"[+] Appended {len(new_rows)} rows; the dataframe now has {len(self._dataframe)} rows.")
+        if len(new_duplicates):
+            print(f"[!] {len(new_duplicates)} new rows are duplicates: {history_count} of earlier rows and {len(new_duplicates) - history_count} of other new rows.")
+        return new_duplicates
+
+    def refresh(self, subset_list: list[str]=None) -> pd.DataFrame:
+        """Appends the rows added to the end of the source csv since it was loaded (or last refreshed), reading only those rows.
+
+        Args:
+            subset_list (list[str], optional): The columns to consider duplicates. Defaults to None, which uses all columns.
+
+        Returns:
+            pd.DataFrame: The new rows that repeat an earlier row, as returned by append.
+        """
+        self._require_full_data("refresh")
+        if self._csv_source is None:
+            raise ValueError("refresh requires a dataframe loaded from a csv file.")
+
+        new_rows, offset = get_csv_rows_after(self._csv_source["file_path"], self._csv_source["offset"], **self._csv_source["read_options"])
+        self._csv_source["offset"] = offset
+        if new_rows.empty:
+            print("[!] No new rows in the csv file.")
+            return pd.DataFrame(columns=["duplicate_of", "matches_history"])
+        # the file still has its original header, so the rows get the columns' current names
+        column_map: dict[str, str] = self._csv_source["column_map"]
+        new_rows = new_rows[list(column_map)].rename(columns=column_map)
+        return self.append(new_rows, subset_list=subset_list)
+
+    def _track_step_columns(self, columns_before: list[str]) -> None:
+        """Records the columns a step removed or renamed, so refresh can map the csv's columns to the current ones.
+
+        Args:
+            columns_before (list[str]): The columns before the step.
+        """
+        columns_after: list[str] = list(self._dataframe.columns)
+        if len(columns_before) == len(columns_after):
+            # renaming keeps the column order
+            self._track_columns([], dict(zip(columns_before, columns_after)))
+        else:
+            self._track_columns([column for column in columns_before if column not in columns_after])
+
+    def _track_columns(self, removed_columns: list[str], renamed_columns: dict[str, str]=None) -> None:
+        if self._csv_source is None:
+            return
+        renamed_columns = renamed_columns or {}
+        self._csv_source["column_map"] = {
+            source_column: renamed_columns.get(column, column) for source_column, column in self._csv_source["column_map"].items() if column not in removed_columns
+        }
+
+    def _align_new_rows(self, new_rows: pd.DataFrame) -> pd.DataFrame:
+        """Selects the dataframe's columns from new rows and casts them to the dataframe's d-types, so concatenating
+        does not change the d-type of existing columns.
+
+        Args:
+            new_rows (pd.DataFrame): The rows to add.
+
+        Returns:
+            pd.DataFrame: The aligned rows.
+        """
+        missing_columns: list[str] = [column for column in self._dataframe.columns if column not in new_rows.columns]
+        if missing_columns:
+            raise ValueError(f"The new rows are missing the columns {missing_columns}. Rows must be appended with the current column names.")
+        new_rows = new_rows[list(self._dataframe.columns)]
+
+        aligned_columns: dict[str, pd.Series] = {}
+        for column, dtype in self._dataframe.dtypes.items():
+            new_values: pd.Series = new_rows[column]
+            if new_values.dtype == dtype:
+                continue
+            if isinstance(dtype, pd.CategoricalDtype):
+                new_categories: pd.Index = pd.Index(new_values.dropna().unique()).difference(dtype.categories)
+                if len(new_categories):
+                    self._dataframe = self._dataframe.assign(**{column: self._dataframe[column].cat.add_categories(new_categories)})
+                aligned_columns[column] = new_values.astype(self._dataframe[column].dtype)
+            elif pd.api.types.is_integer_dtype(dtype):
+                # downcast integer columns only take the new values if they fit and there are no nulls
+                if pd.api.types.is_integer_dtype(new_values.dtype) and (new_values.empty or np.iinfo(dtype).min <= new_values.min() and new_values.max() <= np.iinfo(dtype).max):
+                    aligned_columns[column] = new_values.astype(dtype)
+            else:
+                try:
+                    aligned_columns[column] = new_values.astype(dtype)
+                except (TypeError, ValueError):
+                    pass  # concat finds a common d-type and the profile recomputes the column
+
+        return new_rows.assign(**aligned_columns) if aligned_columns else new_rows
+
+    def _forget_indexes(self) -> None:
+        """Drops the null and duplicate indexes after a step that changes the dataframe without updating them.
+        """
+        self._null_index = None
+        self._row_hash_index = None
+
+    @instrumented("understand_features")
+    def understand_features(self, output_directory: str=None, max_workers: int=None, time_frequency: str="auto"):
+        """Plots the distribution of every column.
+
+        Args:
+            output_directory (str, optional): Render the plots headlessly to image files and a report in this directory. Defaults to None.
+            max_workers (int, optional): Number of processes used to render plots headlessly. Defaults to None.
+            time_frequency (str, optional): The bucket size of time-series plots: "hour", "day", "week", "month" or "auto". Defaults to "auto".
+        """
         print("[!] Beginning feature understanding (univariate) analysis step!")
-        feature_analyzer = FeatureAnalyzer(self._dataframe)
+        if self._sample_info is not None:
+            print(f"[!] The plots show a sample of {self._sample_info['sample_rows']} of {self._sample_info['file_rows']} rows.")
+        feature_analyzer = FeatureAnalyzer(self._dataframe, profile=self._profile, output_directory=output_directory, max_workers=max_workers, time_frequency=time_frequency)
         del feature_analyzer
-            
+
+    def export_profile(self, file_path: str=None) -> DatasetProfile:
+        """Profiles the current dataframe (d-types, null counts, quantiles, top values, distinct counts and histograms),
+        reusing the cached column statistics, so later snapshots can be compared to it without loading this data again.
+
+        Args:
+            file_path (str, optional): Also write the profile as json to this file. Defaults to None.
+
+        Returns:
+            DatasetProfile: The profile.
+        """
+        metadata: dict[str, object] = {"sample_info": self._sample_info}
+        if self._load_options is not None:
+            metadata["source"] = get_full_file_path(self._load_options["file_path"], self._load_options["file_name"])
+        if self._checkpoint_store is not None and self.checkpointed_steps:
+            metadata["checkpointed_steps"] = self.checkpointed_steps
+
+        dataset_profile: DatasetProfile = DatasetProfile.from_dataframe(self._dataframe, profile=self._profile, metadata=metadata)
+        if file_path is not None:
+            dataset_profile.to_json(file_path)
+            print(f"[+] Exported the profile of {len(dataset_profile.columns)} columns to {file_path}.")
+        return dataset_profile
+
+    def compare_to_profile(self, reference: DatasetProfile|str, **thresholds) -> pd.DataFrame:
+        """Compares the current dataframe to an earlier profile for schema changes, null ratio shifts and distribution drift.
+
+        Args:
+            reference (DatasetProfile|str): The earlier profile, or the path to its json file.
+            **thresholds: The drift thresholds of compare_profiles.
+
+        Returns:
+            pd.DataFrame: The comparison per column. See compare_profiles.
+        """
+        comparison: pd.DataFrame = compare_profiles(reference, self.export_profile(), **thresholds)
+        drifted_columns: list[str] = comparison.index[comparison["drift"]].tolist()
+        if drifted_columns:
+            print(f"[!] {len(drifted_columns)} column(s) changed or drifted: {drifted_columns}")
+        else:
+            print("[+] No column changed or drifted.")
+        return comparison
+
     def __str__(self) -> str:
         return f"This is a pandas DataFrame object. Here are the first 25 rows: {self._dataframe.head(25)}"
 
     @property
     def dataframe(self) -> pd.DataFrame:
         return self._dataframe
-    
+
+    @property
+    def profile(self) -> ColumnProfile:
+        return self._profile
+
+    @property
+    def sample_info(self) -> dict[str, object]|None:
+        """How the rows were sampled ("method": "reservoir", "block" or "random" for memory-mapped files, "seed", "sample_rows", "file_rows", "file_rows_estimated"), or None if every row is loaded.
+        """
+        return self._sample_info
+
+    @property
+    def checkpointed_steps(self) -> list[str]:
+        """The prepare_data steps checkpointed for this source, in order, with their decisions in the checkpoint manifest.
+        """
+        if self._checkpoint_store is None:
+            return []
+        return self._checkpoint_store.completed_steps(self._session_key)
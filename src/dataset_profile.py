@@ -0,0 +1,378 @@
+# ElPsychicMustache
+# 2025-01-20
+
+# A compact profile of a whole dataset (d-types, null counts, quantiles, top values, distinct estimates and histograms)
+#   that is saved as json, so snapshots can be compared later without loading their data again. Distribution drift is
+#   measured from the stored summaries alone: the population stability index of numeric and datetime columns is read off
+#   the two quantile functions, and the most common values of other columns are compared by total variation distance.
+#   A comparison only touches a few dozen numbers per column, so a pair of snapshots is compared in milliseconds.
+
+import json
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from .approximate_profile import ApproximateProfile, get_column_kind
+from .column_profile import ColumnProfile
+from .parallel import map_columns
+from .plot_aggregates import DEFAULT_TOP_N, histogram_to_dict
+from .sketches import DistinctCountSketch
+
+PROFILE_VERSION: int = 1
+# the quantiles stored per column; every bin between them holds 5% of the values
+QUANTILE_GRID: np.ndarray = np.linspace(0, 1, 21)
+# common rule of thumb: below 0.1 is stable, 0.1 to 0.2 a moderate shift, above 0.2 a significant shift
+PSI_THRESHOLD: float = 0.2
+NULL_SHIFT_THRESHOLD: float = 0.05
+TOP_VALUE_DISTANCE_THRESHOLD: float = 0.1
+# empty bins get this share, so the logarithm of the stability index stays finite
+_MIN_BIN_RATIO: float = 1e-4
+
+
+class DatasetProfile:
+    def __init__(self, columns: dict[str, dict], row_count: int, metadata: dict=None) -> None:
+        """The profile of every column of a dataset, as plain json types. Build it with from_dataframe,
+        from_approximate_profile or from_json rather than directly.
+
+        Args:
+            columns (dict[str, dict]): The summary of each column, see _summarize_column.
+            row_count (int): The number of rows.
+            metadata (dict, optional): E.g. the source file and when the profile was made. Defaults to None.
+        """
+        self._columns: dict[str, dict] = columns
+        self._row_count: int = row_count
+        self._metadata: dict = metadata or {}
+
+    @classmethod
+    def from_dataframe(cls, dataframe: pd.DataFrame, profile: ColumnProfile=None, metadata: dict=None, top_n: int=DEFAULT_TOP_N) -> "DatasetProfile":
+        """Profiles a dataframe, reusing the cached statistics of its ColumnProfile. Columns are summarized in parallel.
+
+        Args:
+            dataframe (pd.DataFrame): The dataframe.
+            profile (ColumnProfile, optional): Cached column statistics of the dataframe. Defaults to None, which creates a new profile.
+            metadata (dict, optional): Stored with the profile. Defaults to None, which stores when the profile was made.
+            top_n (int, optional): How many of the most common values are kept per column. Defaults to 20.
+
+        Returns:
+            DatasetProfile: The profile.
+        """
+        profile = profile if profile is not None else ColumnProfile(dataframe)
+        profile.compute()
+        numeric_columns: list[str] = [column for column in dataframe.columns if get_column_kind(dataframe[column].dtype) == "numeric"]
+        profile.compute_histograms(numeric_columns)
+
+        columns: dict[str, dict] = map_columns(lambda column: _summarize_column(dataframe[column], profile, top_n), dataframe.columns, row_count=len(dataframe))
+        return cls({str(column): summary for column, summary in columns.items()}, len(dataframe), _with_created_time(metadata))
+
+    @classmethod
+    def from_approximate_profile(cls, approximate_profile: ApproximateProfile, metadata: dict=None, top_n: int=DEFAULT_TOP_N) -> "DatasetProfile":
+        """Converts the sketches of a file too large to load (see sketch_csv) into a profile. Quantiles, distinct counts
+        and top values are approximate, and there are no histograms or datetime quantiles.
+
+        Args:
+            approximate_profile (ApproximateProfile): The sketched profile.
+            metadata (dict, optional): Stored with the profile. Defaults to None, which stores when the profile was made.
+            top_n (int, optional): How many of the most common values are kept per column. Defaults to 20.
+
+        Returns:
+            DatasetProfile: The profile.
+        """
+        columns: dict[str, dict] = {}
+        for column in approximate_profile.columns:
+            column_stats: dict[str, object] = approximate_profile.get_column_stats(column)
+            kind: str = get_column_kind(column_stats["dtype"])
+            summary: dict[str, object] = {
+                "dtype": str(column_stats["dtype"]),
+                "kind": kind,
+                "count": int(column_stats["count"]),
+                "null_count": int(column_stats["null_count"]),
+                "distinct": int(column_stats["unique"]),
+                "min": _to_json_value(column_stats["min"]),
+                "max": _to_json_value(column_stats["max"]),
+                "top_values": _top_values_to_dict(approximate_profile.get_stat(column, "value_counts"), top_n),
+            }
+            if kind == "numeric":
+                summary.update({"mean": _to_json_value(column_stats["mean"]), "std": _to_json_value(column_stats["std"])})
+                if column_stats["count"]:
+                    summary["quantiles"] = _to_json_value(approximate_profile.quantile(column, QUANTILE_GRID.tolist()))
+            columns[str(column)] = summary
+        return cls(columns, approximate_profile.row_count, _with_created_time(metadata))
+
+    # Serialization suite
+    def to_dict(self) -> dict:
+        return {"version": PROFILE_VERSION, "row_count": self._row_count, "metadata": self._metadata, "quantile_grid": QUANTILE_GRID.tolist(), "columns": self._columns}
+
+    def to_json(self, file_path: str=None) -> str:
+        """Exports the profile as json.
+
+        Args:
+            file_path (str, optional): Also write the json to this file. Defaults to None.
+
+        Returns:
+            str: The json text.
+        """
+        profile_json: str = json.dumps(self.to_dict(), default=str)
+        if file_path is not None:
+            with open(file_path, "w", encoding="utf-8") as json_file:
+                json_file.write(profile_json)
+        return profile_json
+
+    @classmethod
+    def from_dict(cls, profile_dict: dict) -> "DatasetProfile":
+        if profile_dict.get("version") != PROFILE_VERSION:
+            raise ValueError(f"Unsupported profile version {profile_dict.get('version')}, expected {PROFILE_VERSION}.")
+        if not np.allclose(profile_dict["quantile_grid"], QUANTILE_GRID):
+            raise ValueError("The profile was stored with a different quantile grid.")
+        return cls(profile_dict["columns"], profile_dict["row_count"], profile_dict.get("metadata"))
+
+    @classmethod
+    def from_json(cls, file_path: str) -> "DatasetProfile":
+        with open(file_path, encoding="utf-8") as json_file:
+            return cls.from_dict(json.load(json_file))
+    # End serialization suite
+
+    def compare(self, current: "DatasetProfile", **thresholds) -> pd.DataFrame:
+        """Compares a later profile to this one. See compare_profiles.
+        """
+        return compare_profiles(self, current, **thresholds)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Returns the scalar summaries as a dataframe with one row per column.
+
+        Returns:
+            pd.DataFrame: The profile as a dataframe.
+        """
+        return pd.DataFrame.from_dict(
+            {column: {key: value for key, value in summary.items() if key not in ("quantiles", "histogram", "top_values")} for column, summary in self._columns.items()},
+            orient="index",
+        )
+
+    @property
+    def columns(self) -> dict[str, dict]:
+        return self._columns
+
+    @property
+    def row_count(self) -> int:
+        return self._row_count
+
+    @property
+    def metadata(self) -> dict:
+        return self._metadata
+
+
+def compare_profiles(reference: DatasetProfile|str, current: DatasetProfile|str, psi_threshold: float=PSI_THRESHOLD, null_shift_threshold: float=NULL_SHIFT_THRESHOLD, top_value_threshold: float=TOP_VALUE_DISTANCE_THRESHOLD) -> pd.DataFrame:
+    """Diffs two profiles for schema changes, null ratio shifts and distribution drift, without the data behind them.
+
+    Args:
+        reference (DatasetProfile|str): The earlier profile, or the path to its json file.
+        current (DatasetProfile|str): The later profile, or the path to its json file.
+        psi_threshold (float, optional): A population stability index from this value on counts as drift. Defaults to 0.2.
+        null_shift_threshold (float, optional): A change of the null ratio of at least this much counts as drift. Defaults to 0.05.
+        top_value_threshold (float, optional): A total variation distance of the most common values from this value on
+            counts as drift. Defaults to 0.1.
+
+    Returns:
+        pd.DataFrame: One row per column of either profile, reference columns first: the schema change ("added",
+            "removed", "dtype" or ""), both d-types and null ratios, the null ratio shift, the stability index (numeric and
+            datetime columns), the top value distance (other columns), both distinct counts and whether the column drifted.
+            The row counts of both profiles are in attrs["row_count"].
+    """
+    reference = DatasetProfile.from_json(reference) if isinstance(reference, str) else reference
+    current = DatasetProfile.from_json(current) if isinstance(current, str) else current
+
+    rows: dict[str, dict] = {}
+    for column in list(reference.columns) + [column for column in current.columns if column not in reference.columns]:
+        reference_summary: dict|None = reference.columns.get(column)
+        current_summary: dict|None = current.columns.get(column)
+        if reference_summary is None or current_summary is None:
+            change: str = "added" if reference_summary is None else "removed"
+        else:
+            change = "dtype" if reference_summary["dtype"] != current_summary["dtype"] else ""
+
+        row: dict[str, object] = {
+            "change": change,
+            "dtype_reference": _get(reference_summary, "dtype"),
+            "dtype_current": _get(current_summary, "dtype"),
+            "null_ratio_reference": _null_ratio(reference_summary),
+            "null_ratio_current": _null_ratio(current_summary),
+            "null_ratio_shift": np.nan,
+            "psi": np.nan,
+            "top_value_distance": np.nan,
+            "distinct_reference": _get(reference_summary, "distinct"),
+            "distinct_current": _get(current_summary, "distinct"),
+        }
+        if reference_summary is not None and current_summary is not None:
+            row["null_ratio_shift"] = row["null_ratio_current"] - row["null_ratio_reference"]
+            if reference_summary["kind"] == current_summary["kind"] and "quantiles" in reference_summary and "quantiles" in current_summary:
+                row["psi"] = quantile_stability_index(reference_summary["quantiles"], current_summary["quantiles"])
+            elif reference_summary["kind"] == current_summary["kind"] == "other":
+                row["top_value_distance"] = top_value_distance(reference_summary["top_values"], reference_summary["count"], current_summary["top_values"], current_summary["count"])
+
+        # comparisons with nan are False, so measures that do not apply never flag drift
+        row["drift"] = bool(change) or abs(row["null_ratio_shift"]) >= null_shift_threshold or row["psi"] >= psi_threshold or row["top_value_distance"] >= top_value_threshold
+        rows[column] = row
+
+    comparison: pd.DataFrame = pd.DataFrame.from_dict(rows, orient="index")
+    comparison.attrs["row_count"] = {"reference": reference.row_count, "current": current.row_count}
+    return comparison
+
+
+def compare_snapshots(profiles: list[DatasetProfile|str], labels: list[str]=None, **thresholds) -> pd.DataFrame:
+    """Compares every snapshot to the one before it, e.g. a year of daily profiles.
+
+    Args:
+        profiles (list[DatasetProfile|str]): The profiles or their json files, oldest first.
+        labels (list[str], optional): A label per snapshot, e.g. its date. Defaults to None, which numbers them.
+        **thresholds: The drift thresholds of compare_profiles.
+
+    Returns:
+        pd.DataFrame: The comparisons of compare_profiles, indexed by the label of the later snapshot and the column.
+    """
+    profiles = [DatasetProfile.from_json(profile) if isinstance(profile, str) else profile for profile in profiles]
+    labels = labels if labels is not None else list(range(len(profiles)))
+    if len(labels) != len(profiles):
+        raise ValueError(f"Got {len(labels)} labels for {len(profiles)} profiles.")
+    if len(profiles) < 2:
+        raise ValueError("compare_snapshots needs at least two profiles.")
+
+    comparisons: list[pd.DataFrame] = [compare_profiles(previous, current, **thresholds) for previous, current in zip(profiles, profiles[1:])]
+    return pd.concat(comparisons, keys=labels[1:], names=["snapshot", "column"])
+
+
+def quantile_stability_index(reference_quantiles: list[float], current_quantiles: list[float]) -> float:
+    """The population stability index of two distributions known only by their quantiles at QUANTILE_GRID. The bins are the
+    reference's quantiles, and the share of the current values in each bin is read off the current quantile function.
+
+    Args:
+        reference_quantiles (list[float]): The quantiles of the reference.
+        current_quantiles (list[float]): The quantiles of the current values.
+
+    Returns:
+        float: The index; 0 for identical distributions.
+    """
+    # repeated quantiles (a value taking several percent of the rows) are one bin edge
+    edges: np.ndarray = np.unique(np.asarray(reference_quantiles, dtype=np.float64)[1:-1])
+    reference_ratios: np.ndarray = np.diff(np.concatenate(([0.0], _cumulative_ratio(reference_quantiles, edges), [1.0])))
+    current_ratios: np.ndarray = np.diff(np.concatenate(([0.0], _cumulative_ratio(current_quantiles, edges), [1.0])))
+
+    reference_ratios = np.maximum(reference_ratios, _MIN_BIN_RATIO)
+    current_ratios = np.maximum(current_ratios, _MIN_BIN_RATIO)
+    return float(np.sum((current_ratios - reference_ratios) * np.log(current_ratios / reference_ratios)))
+
+
+def top_value_distance(reference_top_values: dict, reference_count: int, current_top_values: dict, current_count: int) -> float:
+    """The total variation distance between the shares of the most common values of two columns. The values outside either
+    top list are pooled into one "other" share, so the distance is a lower bound of the distance of the full distributions.
+
+    Args:
+        reference_top_values (dict): The reference's top values ("values" and "counts").
+        reference_count (int): The number of non-null values of the reference.
+        current_top_values (dict): The current top values.
+        current_count (int): The number of non-null values of the current column.
+
+    Returns:
+        float: The distance, between 0 (same shares) and 1 (no value in common).
+    """
+    if reference_count == 0 or current_count == 0:
+        return np.nan
+    reference_shares: dict[str, float] = {value: count / reference_count for value, count in zip(reference_top_values["values"], reference_top_values["counts"])}
+    current_shares: dict[str, float] = {value: count / current_count for value, count in zip(current_top_values["values"], current_top_values["counts"])}
+
+    values: set[str] = reference_shares.keys() | current_shares.keys()
+    distance: float = sum(abs(reference_shares.get(value, 0.0) - current_shares.get(value, 0.0)) for value in values)
+    distance += abs((1 - sum(reference_shares.values())) - (1 - sum(current_shares.values())))
+    return min(1.0, distance / 2)
+
+
+def _summarize_column(column_data: pd.Series, profile: ColumnProfile, top_n: int) -> dict[str, object]:
+    """Summarizes one column with json types. Runs on a worker thread, so it only reads the cached statistics.
+
+    Args:
+        column_data (pd.Series): The column.
+        profile (ColumnProfile): The computed profile of the dataframe.
+        top_n (int): How many of the most common values are kept.
+
+    Returns:
+        dict[str, object]: The summary.
+    """
+    column_stats: dict[str, object] = profile.get_column_stats(column_data.name)
+    kind: str = get_column_kind(column_data.dtype)
+    summary: dict[str, object] = {"dtype": str(column_data.dtype), "kind": kind, "count": int(column_stats["count"]), "null_count": int(column_stats["null_count"])}
+
+    if kind == "other":
+        value_counts: pd.Series = column_stats["value_counts"]
+        summary["distinct"] = int((value_counts > 0).sum())  # unused categories are counted with zero
+        summary["top_values"] = _top_values_to_dict(value_counts, top_n)
+        return summary
+
+    values: pd.Series = column_data.dropna()
+    numbers: np.ndarray = _datetime_seconds(values) if kind == "datetime" else values.to_numpy(dtype=np.float64)
+    numbers = numbers[np.isfinite(numbers)]
+    distinct_sketch = DistinctCountSketch()
+    distinct_sketch.update(pd.util.hash_array(numbers))
+    summary.update({
+        "distinct": distinct_sketch.estimate(),
+        "min": _to_json_value(column_stats["min"]),
+        "max": _to_json_value(column_stats["max"]),
+    })
+    if len(numbers):
+        summary["quantiles"] = np.quantile(numbers, QUANTILE_GRID).tolist()
+    if kind == "numeric":
+        summary.update({"mean": _to_json_value(column_stats["mean"]), "std": _to_json_value(column_stats["std"]), "histogram": histogram_to_dict(column_stats["histogram"])})
+    return summary
+
+
+def _datetime_seconds(values: pd.Series) -> np.ndarray:
+    # datetimes are compared as seconds since the epoch; aware ones in UTC
+    if values.dt.tz is not None:
+        values = values.dt.tz_convert("UTC").dt.tz_localize(None)
+    return values.to_numpy(dtype="datetime64[ns]").astype(np.int64) / 1e9
+
+
+def _cumulative_ratio(quantiles: list[float], edges: np.ndarray) -> np.ndarray:
+    """The share of values at or below each edge, interpolated from a column's quantiles at QUANTILE_GRID.
+
+    Args:
+        quantiles (list[float]): The quantiles.
+        edges (np.ndarray): The values to read the share at.
+
+    Returns:
+        np.ndarray: The share per edge.
+    """
+    # of repeated quantiles, the last one gives the share at or below the value
+    reversed_values, reversed_positions = np.unique(np.asarray(quantiles, dtype=np.float64)[::-1], return_index=True)
+    ratios: np.ndarray = QUANTILE_GRID[::-1][reversed_positions]
+    return np.interp(edges, reversed_values, ratios, left=0.0, right=1.0)
+
+
+def _top_values_to_dict(value_counts: pd.Series, top_n: int) -> dict[str, list]:
+    top_values: pd.Series = value_counts[value_counts > 0].head(top_n)
+    return {"values": [str(value) for value in top_values.index], "counts": [int(count) for count in top_values]}
+
+
+def _null_ratio(summary: dict|None) -> float:
+    if summary is None:
+        return np.nan
+    row_count: int = summary["count"] + summary["null_count"]
+    return summary["null_count"] / row_count if row_count else 0.0
+
+
+def _get(summary: dict|None, key: str) -> object:
+    return summary.get(key) if summary is not None else None
+
+
+def _to_json_value(value: object) -> object:
+    if isinstance(value, np.ndarray):
+        return [_to_json_value(item) for item in value.tolist()]
+    if value is None or pd.isna(value):
+        return None
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _with_created_time(metadata: dict|None) -> dict:
+    return {"created": datetime.now(timezone.utc).isoformat(), **(metadata or {})}
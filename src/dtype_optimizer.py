@@ -0,0 +1,137 @@
+# ElPsychicMustache
+# 2024-12-11
+
+# Finds the most compact dtype each column can be stored as without changing any of its values.
+#   Used by ColumnHandler.optimize_dtypes so columns do not need to be converted one prompt at a time.
+
+import importlib.util
+
+import numpy as np
+import pandas as pd
+
+from .parallel import map_columns
+
+_INTEGER_DTYPES: list[str] = ["int8", "uint8", "int16", "uint16", "int32", "uint32", "int64", "uint64"]
+_BOOL_STRINGS: dict[str, bool] = {"true": True, "false": False}
+# more distinct values than this are not checked for booleans, e.g. "True", "true", "TRUE " and "False" are four spellings
+_MAX_BOOL_SPELLINGS: int = 32
+
+
+def propose_dtypes(dataframe: pd.DataFrame, max_category_ratio: float=0.5, use_arrow_strings: bool=True) -> dict[str, str]:
+    """Proposes a more compact dtype for every column that can safely use one.
+
+    Args:
+        dataframe (pd.DataFrame): The dataframe to inspect.
+        max_category_ratio (float, optional): String columns with at most this ratio of unique values to non-null values become categorical. Defaults to 0.5.
+        use_arrow_strings (bool, optional): Propose Arrow-backed strings for the other string columns, if pyarrow is installed. Defaults to True.
+
+    Returns:
+        dict[str, str]: The proposed dtype of each column that should change.
+    """
+    arrow_strings_available: bool = use_arrow_strings and importlib.util.find_spec("pyarrow") is not None
+
+    proposed_dtypes: dict[str, str|None] = map_columns(lambda column: propose_column_dtype(dataframe[column], max_category_ratio, arrow_strings_available), dataframe.columns, row_count=len(dataframe))
+    return {column: proposed_dtype for column, proposed_dtype in proposed_dtypes.items() if proposed_dtype is not None and proposed_dtype != str(dataframe[column].dtype)}
+
+
+def propose_column_dtype(column_data: pd.Series, max_category_ratio: float=0.5, arrow_strings_available: bool=False) -> str|None:
+    """Proposes a more compact dtype for a single column.
+
+    Args:
+        column_data (pd.Series): The column's values.
+        max_category_ratio (float, optional): The maximum ratio of unique values to non-null values for categorical. Defaults to 0.5.
+        arrow_strings_available (bool, optional): Whether Arrow-backed strings may be proposed. Defaults to False.
+
+    Returns:
+        str|None: The proposed dtype, or None if the column should stay as it is.
+    """
+    column_dtype = column_data.dtype
+
+    if pd.api.types.is_bool_dtype(column_dtype) or isinstance(column_dtype, pd.CategoricalDtype) or pd.api.types.is_datetime64_any_dtype(column_dtype):
+        return None
+
+    non_null_values: pd.Series = column_data.dropna()
+    if non_null_values.empty:
+        return None
+
+    if pd.api.types.is_integer_dtype(column_dtype):
+        return _smallest_integer_dtype(non_null_values, nullable=pd.api.types.is_extension_array_dtype(column_dtype))
+
+    if pd.api.types.is_float_dtype(column_dtype):
+        return _propose_float_dtype(non_null_values, has_nulls=len(non_null_values) != len(column_data))
+
+    if pd.api.types.is_object_dtype(column_dtype) or pd.api.types.is_string_dtype(column_dtype):
+        return _propose_string_dtype(non_null_values, max_category_ratio, arrow_strings_available)
+
+    return None
+
+
+def convert_column(column_data: pd.Series, target_dtype: str) -> pd.Series:
+    """Converts a column to a dtype returned by propose_dtypes.
+
+    Args:
+        column_data (pd.Series): The column's values.
+        target_dtype (str): The dtype to convert to.
+
+    Returns:
+        pd.Series: The converted column.
+    """
+    if target_dtype == "boolean" and not pd.api.types.is_bool_dtype(column_data.dtype):
+        # strings like "True"/"false" need mapping, astype would treat every non-empty string as True
+        mapped: pd.Series = column_data.map(_parse_bool, na_action="ignore")
+        return mapped.astype("boolean")
+    return column_data.astype(target_dtype)
+
+
+def _parse_bool(value: object) -> bool|None:
+    # case and surrounding whitespace do not matter; anything other than true or false is None
+    return value if isinstance(value, bool) else _BOOL_STRINGS.get(str(value).strip().lower())
+
+
+def _smallest_integer_dtype(non_null_values: pd.Series, nullable: bool) -> str:
+    min_value, max_value = non_null_values.min(), non_null_values.max()
+    for integer_dtype in _INTEGER_DTYPES:
+        type_info = np.iinfo(integer_dtype)
+        if type_info.min <= min_value and max_value <= type_info.max:
+            # nullable integer dtypes are capitalized, e.g. "Int8" and "UInt8"
+            return integer_dtype.capitalize().replace("Uint", "UInt") if nullable else integer_dtype
+    return "Int64" if nullable else "int64"
+
+
+def _propose_float_dtype(non_null_values: pd.Series, has_nulls: bool) -> str|None:
+    values: np.ndarray = non_null_values.to_numpy(dtype=np.float64)
+    if not np.isfinite(values).all():
+        return None if str(non_null_values.dtype) == "float32" else _float32_if_lossless(values)
+
+    if (values == np.round(values)).all() and np.abs(values).max() < 2**53:
+        # whole numbers stored as float (usually because of nulls) fit a nullable integer dtype
+        return _smallest_integer_dtype(non_null_values, nullable=has_nulls)
+
+    return _float32_if_lossless(values)
+
+
+def _float32_if_lossless(values: np.ndarray) -> str|None:
+    with np.errstate(over="ignore"):
+        round_tripped: np.ndarray = values.astype(np.float32).astype(np.float64)
+    if np.array_equal(round_tripped, values, equal_nan=True):
+        return "float32"
+    return None
+
+
+def _propose_string_dtype(non_null_values: pd.Series, max_category_ratio: float, arrow_strings_available: bool) -> str|None:
+    unique_values: pd.Series = pd.Series(non_null_values.unique())
+
+    # spellings are normalized before counting, so "True", "true" and "FALSE" are one boolean column
+    if len(unique_values) <= _MAX_BOOL_SPELLINGS and unique_values.map(_parse_bool).notna().all():
+        return "boolean"
+
+    if pd.api.types.infer_dtype(unique_values, skipna=True) != "string":
+        return None  # mixed python objects are left alone
+
+    if len(unique_values) <= max_category_ratio * len(non_null_values):
+        return "category"
+
+    if arrow_strings_available and not isinstance(non_null_values.dtype, pd.StringDtype):
+        return "string[pyarrow]"
+
+    return None
@@ -3,14 +3,21 @@
 
 import pandas as pd
 
+from .column_profile import ColumnProfile
+from .fuzzy_duplicates import FuzzyDuplicateIndex
+from .instrumentation import instrumented
+from .row_hash_index import DuplicateIndex, RowHashIndex
 from .utilities import prompt_selection_for_column_list
 from .validate_input import get_user_confirmation
 
 class DuplicateAnalyzer:
-    def __init__(self, dataframe: pd.DataFrame) -> None:
+    def __init__(self, dataframe: pd.DataFrame, profile: ColumnProfile=None, row_hash_index: RowHashIndex=None) -> None:
         self._dataframe = dataframe
+        self._profile = profile if profile is not None else ColumnProfile(dataframe)
+        self._row_hash_index = row_hash_index if row_hash_index is not None else RowHashIndex(dataframe)
         self.analyze_duplicates()
 
+    @instrumented("duplicate_analyzer.analyze_duplicates")
     def analyze_duplicates(self) -> None:
         """Provides the user a way to analyze and handle the duplicate values of the dataframe.
         """
@@ -20,65 +27,96 @@ class DuplicateAnalyzer:
         if not user_wants_to_analyze_duplicates:
             print("[-] Duplicate analysis step skipped.")
             return
-        
-        subset_for_dup_identification: list[str] = prompt_selection_for_column_list(message="[*] Please enter the numbers next to each column to use as subsets to find duplicates.", list_of_options=self._dataframe.columns)
+
+        user_wants_near_duplicates: bool = get_user_confirmation(message="[*] Would you like to find near-duplicates (case, whitespace, punctuation and small typos) instead of exact duplicates? [y/N] ", true_options=["y", "yes"], false_options=["n", "no", ""])
+        # the fuzzy index answers the same queries as the exact one, so the rest of the flow does not change
+        duplicate_index: DuplicateIndex = FuzzyDuplicateIndex(self._dataframe) if user_wants_near_duplicates else self._row_hash_index
+
+        # column hashes are cached by the row hash index, so trying another subset is cheap
+        while True:
+            subset_for_dup_identification: list[str] = prompt_selection_for_column_list(message="[*] Please enter the numbers next to each column to use as subsets to find duplicates.", list_of_options=self._dataframe.columns)
+
+            if self._handle_subset(subset_for_dup_identification, duplicate_index):
+                return
+
+            if not get_user_confirmation(message="[*] Would you like to try a different subset? [y/N] ", true_options=["y", "yes"], false_options=["n", "no", ""]):
+                return
+
+    def _handle_subset(self, subset_for_dup_identification: list[str], duplicate_index: DuplicateIndex=None) -> bool:
+        """Shows the duplicates found with a subset and asks the user whether to remove them.
+
+        Args:
+            subset_for_dup_identification (list[str]): The columns to consider duplicates.
+            duplicate_index (DuplicateIndex, optional): The index grouping the duplicates, e.g. a FuzzyDuplicateIndex. Defaults to None, which uses the exact row hash index.
+
+        Returns:
+            bool: True if the duplicates were removed.
+        """
+        if duplicate_index is None:
+            duplicate_index = self._row_hash_index
 
         print(f"[!] Looking for duplicates in columns: {subset_for_dup_identification} ...")
-        duplicate_rows = self._return_duplicates(subset_for_dup_identification)
+        duplicate_count: int = duplicate_index.duplicate_count(subset_for_dup_identification)
 
-        if len(duplicate_rows) == 0:
+        if duplicate_count == 0:
             print("[!] There are no duplicates in this dataset with the selected subset_list.")
-            return
+            return False
         else:
-            print(f"\n[!] {len(duplicate_rows)} duplicate rows identified. Here is a specific example of a duplicate: ")
-            self._show_duplicate_example(duplicate_examples=duplicate_rows, subset_list=subset_for_dup_identification)
+            print(f"\n[!] {duplicate_count} duplicate rows identified. Here is a specific example of a duplicate: ")
+            self._show_duplicate_example(subset_list=subset_for_dup_identification, duplicate_index=duplicate_index)
         
         user_wants_to_remove_duplicates = get_user_confirmation(message="[*] Do you want to remove duplicates (first duplicate row is kept)? [y/N] ", true_options=["y", "yes"], false_options=["n", "no", ""])
         if user_wants_to_remove_duplicates:
-            self._remove_duplicates(subset_for_dup_identification)
+            self._remove_duplicates(subset_for_dup_identification, duplicate_index)
             print("[!] Duplicates removed!")
+            return True
         else:
             print("[!] Duplicates kept!")
+            return False
             
-    def _return_duplicates(self, subset_list: list[str]=None) -> pd.DataFrame:
+    def _return_duplicates(self, subset_list: list[str]=None, duplicate_index: DuplicateIndex=None) -> pd.DataFrame:
         """Returns a dataframe with all duplicate rows identified.
 
         Args:
             subset_list (list[str], optional): The columns to consider duplicates. Defaults to None.
+            duplicate_index (DuplicateIndex, optional): The index grouping the duplicates. Defaults to None, which uses the exact row hash index.
 
         Returns:
             pd.DataFrame: A dataframe consisting of only duplicate values.
         """
-        return self._dataframe.loc[self._dataframe.duplicated(subset=subset_list, keep=False)]
+        duplicate_index = duplicate_index if duplicate_index is not None else self._row_hash_index
+        return self._dataframe.loc[duplicate_index.duplicate_mask(subset_list)]
     
-    def _show_duplicate_example(self, duplicate_examples: pd.DataFrame, subset_list: list[str]=None) -> None:
+    def _show_duplicate_example(self, subset_list: list[str]=None, duplicate_index: DuplicateIndex=None) -> None:
         """Provides the user a simple example of duplicate rows from the dataframe.
 
         Args:
             subset_list (list[str]): The list of column names to consider duplicates. Default to None.
-            duplicate_examples (pd.DataFrame): A dataframe consisting of duplicate values.
+            duplicate_index (DuplicateIndex, optional): The index grouping the duplicates. Defaults to None, which uses the exact row hash index.
         """
-        
-        column_values: list[str] = [duplicate_examples.iloc[0][column] for column in subset_list]
-
-        query_dict: dict[str, str] = dict(zip(subset_list, column_values))
-
-        query_results: pd.DataFrame = duplicate_examples
+        duplicate_index = duplicate_index if duplicate_index is not None else self._row_hash_index
+        print(duplicate_index.example_group(subset_list))
 
-        for column, value in query_dict.items():
-            query_results = query_results[query_results[column] == value]
-
-        print(query_results)
-
-    def _remove_duplicates(self, subset_list: list[str]=None) -> None:
+    @instrumented("duplicate_analyzer.remove_duplicates")
+    def _remove_duplicates(self, subset_list: list[str]=None, duplicate_index: DuplicateIndex=None) -> None:
         """Removes duplicate values, keeping the first value.
 
         Args:
             subset_list (list[str]): The list of columns to consider duplicates. Defaults to None.
+            duplicate_index (DuplicateIndex, optional): The index grouping the duplicates. Defaults to None, which uses the exact row hash index.
         """
-        self._dataframe = self._dataframe.drop_duplicates(subset=subset_list, keep="first")
+        duplicate_index = duplicate_index if duplicate_index is not None else self._row_hash_index
+        self._dataframe = self._dataframe.loc[duplicate_index.keep_first_mask(subset_list)]
+        # the exact index is rebuilt either way, since later steps look for exact duplicates
+        self._row_hash_index = RowHashIndex(self._dataframe)
+        self._profile.set_dataframe(self._dataframe)
+        self._profile.invalidate()  # removing rows changes every column's statistics
 
     @property
     def dataframe(self) -> pd.DataFrame:
         return self._dataframe
 
+    @property
+    def row_hash_index(self) -> RowHashIndex:
+        return self._row_hash_index
+
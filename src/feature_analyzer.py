@@ -3,13 +3,38 @@
 
 # This class is used to perform the visualization of feature understanding step.
 
+import html
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 import matplotlib.pyplot as plt
 import pandas as pd
-from .validate_input import get_user_confirmation
+
+from .column_profile import ColumnProfile
+from .instrumentation import instrumented
+from .time_buckets import FREQUENCIES
+from .validate_input import get_user_confirmation, validate_argument
 
 class FeatureAnalyzer:
-    def __init__(self, dataframe) -> None:
+    def __init__(self, dataframe, profile: ColumnProfile=None, output_directory: str=None, max_workers: int=None, time_frequency: str="auto") -> None:
+        """Plots the distribution of every column.
+
+        Args:
+            dataframe (pd.DataFrame): The dataframe to analyze.
+            profile (ColumnProfile, optional): Cached column statistics of the dataframe. Defaults to None, which creates a new profile.
+            output_directory (str, optional): Render every plot headlessly to image files in this directory, plus a report.html
+                linking them, instead of showing them. Defaults to None.
+            max_workers (int, optional): Number of processes used to render plots in headless mode. Defaults to None, one per CPU.
+            time_frequency (str, optional): The bucket size of time-series plots: "hour", "day", "week", "month" or "auto",
+                which picks one from each column's span. Defaults to "auto".
+        """
+        validate_argument(valid_arg_options=FREQUENCIES + ["auto"], user_input=time_frequency, parameter_name="time_frequency")
         self._dataframe: pd.DataFrame = dataframe
+        self._profile: ColumnProfile = profile if profile is not None else ColumnProfile(dataframe)
+        self._output_directory = output_directory
+        self._max_workers = max_workers
+        self._time_frequency = time_frequency
         self._column_dtypes: dict[str, list[str]] = {
             "numeric": [],
             "datetime": [],
@@ -19,9 +44,14 @@ class FeatureAnalyzer:
         }
         self.understand_features()
 
+    @instrumented("feature_analyzer.understand_features")
     def understand_features(self) -> None:
         self._get_column_dtypes()
-        self._call_plots_from_dtypes()
+        self._compute_plot_aggregates()
+        if self._output_directory is not None:
+            self._render_plots_headless()
+        else:
+            self._call_plots_from_dtypes()
 
     def _get_column_dtypes(self) -> None:
         """Populates the private variable _column_dtypes with a masked version of each column's dtype.
@@ -42,6 +72,14 @@ class FeatureAnalyzer:
             else:
                 self._column_dtypes["unknown"].append(column)
 
+    def _compute_plot_aggregates(self) -> None:
+        """Computes what every plot is drawn from in parallel, column by column, so the plotting loops only draw.
+        Drawing stays on the main thread, since matplotlib figures are not thread-safe.
+        """
+        self._profile.compute(self._column_dtypes["numeric"] + self._column_dtypes["string"] + self._column_dtypes["datetime"])
+        self._profile.compute_histograms(self._column_dtypes["numeric"])
+        self._profile.compute_time_buckets(self._column_dtypes["datetime"], self._time_frequency)
+
     def _call_plots_from_dtypes(self):
         """Takes the columns for each dtype, and then sends to the appropriate plotting method to show distribution.
         """
@@ -123,48 +161,132 @@ class FeatureAnalyzer:
 
                 figures.append(plt.figure())
                 print(f"[!] Creating plot {index + 1}/{len(time_columns)}")
-                self._create_bar_plot(self._dataframe[column])
+                self._create_time_plot(self._dataframe[column])
             else:
                 figures.append(plt.figure())
                 print(f"[!] Creating plot {index + 1}/{len(time_columns)}")
-                self._create_bar_plot(self._dataframe[column])
+                self._create_time_plot(self._dataframe[column])
 
         if figures:
             plt.show()
 
+    @instrumented("feature_analyzer.render_plots_headless")
+    def _render_plots_headless(self) -> None:
+        """Renders every plot to a png file with a process pool and the non-interactive Agg backend, then writes report.html.
+        """
+        os.makedirs(self._output_directory, exist_ok=True)
+
+        # histograms and bar plots only need their aggregates, so workers get those instead of the column
+        plot_jobs: list[tuple[str, str, object]] = (
+            [("hist", column, self._profile.get_stat(column, "histogram")) for column in self._column_dtypes["numeric"]]
+            + [("bar", column, self._profile.get_stat(column, "top_values")) for column in self._column_dtypes["string"]]
+            + [("time", column, self._profile.get_time_buckets(column, self._time_frequency)) for column in self._column_dtypes["datetime"]]
+        )
+        if not plot_jobs:
+            print("[-] No columns to plot.")
+            return
+
+        image_paths: dict[int, str] = {}
+        with ProcessPoolExecutor(max_workers=self._max_workers) as executor:
+            futures = {
+                executor.submit(_render_plot, kind, data, column, self._get_image_path(index, kind, column)): index
+                for index, (kind, column, data) in enumerate(plot_jobs)
+            }
+            for completed, future in enumerate(as_completed(futures)):
+                image_paths[futures[future]] = future.result()
+                print(f"\r[!] Rendered {completed + 1}/{len(plot_jobs)} plots", end="")
+        print()
+
+        report_path: str = self._write_report(plot_jobs, image_paths)
+        print(f"[+] Plots written to {self._output_directory}, report: {report_path}")
+
+    def _get_image_path(self, index: int, kind: str, column: str) -> str:
+        safe_column_name: str = re.sub(r"[^\w.-]", "_", str(column))
+        return os.path.join(self._output_directory, f"{index:04d}_{kind}_{safe_column_name}.png")
+
+    def _write_report(self, plot_jobs: list[tuple[str, str, object]], image_paths: dict[int, str]) -> str:
+        section_titles: dict[str, str] = {"hist": "Numeric columns", "bar": "String columns", "time": "Time-series columns"}
+
+        report_lines: list[str] = ["<html><head><title>Feature understanding</title></head><body>"]
+        current_kind: str = None
+        for index, (kind, column, _) in enumerate(plot_jobs):
+            if kind != current_kind:
+                report_lines.append(f"<h2>{section_titles[kind]}</h2>")
+                current_kind = kind
+            report_lines.append(f'<figure><img src="{html.escape(os.path.basename(image_paths[index]))}"><figcaption>{html.escape(str(column))}</figcaption></figure>')
+        report_lines.append("</body></html>")
+
+        report_path: str = os.path.join(self._output_directory, "report.html")
+        with open(report_path, "w") as report_file:
+            report_file.write("\n".join(report_lines))
+        return report_path
+
     def _create_hist_plot(self, series_to_plot: pd.Series) -> plt.matplotlib.axes.Axes:
-        ax = series_to_plot.plot.hist()
-        ax.set_title(f"{series_to_plot.name} histogram", loc="left")
+        return self._plot_histogram(self._profile.get_stat(series_to_plot.name, "histogram"), series_to_plot.name)
+
+    @staticmethod
+    def _plot_histogram(histogram: tuple, column: str) -> plt.matplotlib.axes.Axes:
+        counts, bin_edges = histogram
+        ax = plt.gca()
+        ax.bar(bin_edges[:-1], counts, width=bin_edges[1:] - bin_edges[:-1], align="edge")
+        ax.set_title(f"{column} histogram", loc="left")
         ax.set_ylabel("frequency", loc="top")
         ax.spines[["top", "right"]].set_visible(False)
         plt.tight_layout()
         return ax
 
     def _create_bar_plot(self, series_to_plot: pd.Series) -> plt.matplotlib.axes.Axes:
-        top_20_values: pd.Series = series_to_plot.value_counts().head(20)
-
-        for index in top_20_values.index:
-            if len(index) > 30:
-                top_20_values = top_20_values.rename(index={index: f"{index[:27]}..."})
+        return self._plot_top_values(self._profile.get_stat(series_to_plot.name, "top_values"), series_to_plot.name)
 
+    @staticmethod
+    def _plot_top_values(top_20_values: pd.Series, column: str) -> plt.matplotlib.axes.Axes:
         ax = top_20_values.plot.barh()
-        ax.set_title(f"{series_to_plot.name} top {len(top_20_values)} values", loc="left")  # using len(top_20_values) in case there are less than 20 values
+        ax.set_title(f"{column} top {len(top_20_values)} values", loc="left")  # using len(top_20_values) in case there are less than 20 values
         ax.set_xlabel("frequency", loc="left")
         ax.spines[["top", "right"]].set_visible(False)
         plt.tight_layout()
         return ax
     
     def _create_time_plot(self, series_to_plot: pd.Series) -> plt.matplotlib.axes.Axes:
-        time_data = series_to_plot.dt.to_period(freq="M").value_counts()
-        time_data = time_data.sort_index()
+        return self._plot_time_buckets(self._profile.get_time_buckets(series_to_plot.name, self._time_frequency), series_to_plot.name)
 
-        ax = time_data.plot.bar()
-        ax.set_title(f"{series_to_plot.name}", loc="left")
+    @staticmethod
+    def _plot_time_buckets(time_buckets: pd.Series, column: str) -> plt.matplotlib.axes.Axes:
+        # buckets are evenly spaced (empty ones included), so a step plot over the bucket starts keeps the gaps visible
+        ax = plt.gca()
+        ax.fill_between(time_buckets.index, time_buckets.to_numpy(), step="post", alpha=0.4)
+        ax.step(time_buckets.index, time_buckets.to_numpy(), where="post")
+        ax.set_title(f"{column}", loc="left")
         ax.set_ylabel("frequency", loc="top")
+        ax.set_ylim(bottom=0)
+        plt.gcf().autofmt_xdate()
         ax.spines[["top", "right"]].set_visible(False)
         plt.tight_layout()
         return ax
 
 
+def _render_plot(kind: str, data: object, column: str, image_path: str) -> str:
+    """Worker function: draws one plot with the non-interactive Agg backend and saves it.
+
+    Args:
+        kind (str): "hist", "bar" or "time".
+        data (object): The (counts, bin edges) for "hist", the top values for "bar" and the time buckets for "time".
+        column (str): The column name.
+        image_path (str): Where to save the image.
+
+    Returns:
+        str: The image path.
+    """
+    plt.switch_backend("Agg")
+
+    figure = plt.figure()
+    if kind == "hist":
+        FeatureAnalyzer._plot_histogram(data, column)
+    elif kind == "bar":
+        FeatureAnalyzer._plot_top_values(data, column)
+    elif kind == "time":
+        FeatureAnalyzer._plot_time_buckets(data, column)
 
-    
\ No newline at end of file
+    figure.savefig(image_path)
+    plt.close(figure)
+    return image_path
@@ -0,0 +1,139 @@
+# ElPsychicMustache
+# 2024-12-18
+
+# Stores loaded (and optionally prepared) dataframes as Arrow IPC files, so loading the same csv again is a memory-mapped read instead of a text parse.
+#   Entries are keyed by the source file's path, size and modification time plus the reader options, so a changed file is never served stale.
+#   The least recently used entries are removed once the cache grows past its size limit.
+
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+CACHE_FILE_SUFFIX: str = ".arrow"
+
+
+class FrameCache:
+    def __init__(self, cache_directory: str, max_size_mb: float=1024) -> None:
+        """A size-bounded, least recently used cache of dataframes on disk.
+
+        Args:
+            cache_directory (str): The directory the cache files are stored in. Created if it does not exist.
+            max_size_mb (float, optional): The maximum total size of the cache files in MB. Defaults to 1024.
+        """
+        if pa is None:
+            raise ImportError("pyarrow is required for FrameCache. Install it with 'pip install pyarrow'.")
+
+        self._cache_directory = cache_directory
+        self._max_size_bytes: float = max_size_mb * 1024**2
+        os.makedirs(cache_directory, exist_ok=True)
+
+    def make_key(self, source_path: str, reader_options: dict=None, step: str="raw") -> str:
+        """Builds the cache key of a source file.
+
+        Args:
+            source_path (str): The file the dataframe was loaded from.
+            reader_options (dict, optional): Every option that changes what is loaded from the file. Defaults to None.
+            step (str, optional): Which version of the dataframe, e.g. "raw" or a prepare_data step. Defaults to "raw".
+
+        Returns:
+            str: The cache key.
+        """
+        source_stat: os.stat_result = os.stat(source_path)
+        key_data: dict = {
+            "path": os.path.abspath(source_path),
+            "size": source_stat.st_size,
+            "mtime_ns": source_stat.st_mtime_ns,
+            "reader_options": reader_options or {},
+            "step": step,
+        }
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True, default=str).encode()).hexdigest()
+
+    def load(self, key: str) -> pd.DataFrame|None:
+        """Loads a cached dataframe through a memory map.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            pd.DataFrame|None: The cached dataframe, or None on a cache miss.
+        """
+        cache_file_path: str = self._get_cache_file_path(key)
+        if not os.path.exists(cache_file_path):
+            return None
+
+        with pa.memory_map(cache_file_path, "r") as source:
+            table: pa.Table = pa.ipc.open_file(source).read_all()
+        os.utime(cache_file_path)  # marks the entry as recently used for eviction
+
+        # one block per column keeps the buffers of columns without nulls in the memory map instead of copying them
+        return table.to_pandas(split_blocks=True)
+
+    def store(self, key: str, dataframe: pd.DataFrame) -> bool:
+        """Writes a dataframe to the cache, then evicts the least recently used entries if the cache is too large.
+        Caching is best-effort: a dataframe Arrow cannot hold (e.g. an object column mixing numbers and strings) or one
+        larger than the whole cache is skipped with a warning.
+
+        Args:
+            key (str): The cache key.
+            dataframe (pd.DataFrame): The dataframe to cache.
+
+        Returns:
+            bool: Whether the dataframe was cached.
+        """
+        try:
+            table: pa.Table = pa.Table.from_pandas(dataframe, preserve_index=True)
+        except (pa.ArrowException, TypeError, ValueError) as e:
+            print(f"[-] Could not cache the dataframe: {e}")
+            return False
+        # the IPC file is about the size of the table's buffers, so an entry that would be evicted at once is not written
+        if table.nbytes > self._max_size_bytes:
+            print(f"[-] Not caching the dataframe: {table.nbytes / 1024**2:.1f} MB is more than the cache's {self._max_size_bytes / 1024**2:.1f} MB limit.")
+            return False
+
+        cache_file_path: str = self._get_cache_file_path(key)
+        temporary_file_path: str = f"{cache_file_path}.tmp"
+        with pa.OSFile(temporary_file_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        # replacing in one step means a reader never sees a half written entry
+        os.replace(temporary_file_path, cache_file_path)
+
+        self._evict()
+        return True
+
+    def clear(self) -> None:
+        for cache_file_path, _, _ in self._list_entries():
+            os.remove(cache_file_path)
+
+    def _evict(self) -> None:
+        entries: list[tuple[str, int, float]] = sorted(self._list_entries(), key=lambda entry: entry[2])
+        total_size: int = sum(size for _, size, _ in entries)
+
+        for cache_file_path, size, _ in entries:
+            if total_size <= self._max_size_bytes:
+                break
+            os.remove(cache_file_path)
+            total_size -= size
+
+    def _list_entries(self) -> list[tuple[str, int, float]]:
+        entries: list[tuple[str, int, float]] = []
+        for file_name in os.listdir(self._cache_directory):
+            if file_name.endswith(CACHE_FILE_SUFFIX):
+                cache_file_path: str = os.path.join(self._cache_directory, file_name)
+                file_stat: os.stat_result = os.stat(cache_file_path)
+                entries.append((cache_file_path, file_stat.st_size, file_stat.st_mtime))
+        return entries
+
+    def _get_cache_file_path(self, key: str) -> str:
+        return os.path.join(self._cache_directory, f"{key}{CACHE_FILE_SUFFIX}")
+
+    @property
+    def size_mb(self) -> float:
+        return sum(size for _, size, _ in self._list_entries()) / 1024**2
@@ -0,0 +1,250 @@
+# ElPsychicMustache
+# 2025-01-14
+
+# Finds near-duplicate rows (differences in case, whitespace, punctuation, accents, word order and small typos) without
+#   comparing every pair of rows. String columns are normalized, identical records are merged, and candidate pairs come
+#   from a blocking key (the sorted words of the record) and from MinHash LSH over character trigrams. Only candidates are
+#   scored, and matching pairs are merged into groups with union-find, so the work grows roughly linearly with the rows.
+
+import numpy as np
+import pandas as pd
+
+from .row_hash_index import DuplicateIndex
+
+_MULTIPLY_SHIFT_SEED: int = 0x9E3779B97F4A7C15
+_MAX_RECORD_LENGTH: int = 96
+_SIGNATURE_BATCH_SIZE: int = 20_000
+_MAX_BUCKET_SIZE: int = 1000
+
+
+class FuzzyDuplicateIndex(DuplicateIndex):
+    def __init__(self, dataframe: pd.DataFrame, threshold: float=0.6, num_perm: int=64, bands: int=16, seed: int=0) -> None:
+        """Groups rows that are near-duplicates on a subset of columns. String columns are compared after normalize_text,
+        other columns (numbers, dates, ...) must match exactly. Offers the group queries of DuplicateIndex, so
+        duplicate_count, example_group and keep_first_mask work the same way; rows are grouped transitively. Unlike
+        RowHashIndex it cannot be extended with appended rows; build a new one instead.
+
+        Args:
+            dataframe (pd.DataFrame): The dataframe to index.
+            threshold (float, optional): The estimated Jaccard similarity of the character trigrams above which two records
+                are duplicates. Defaults to 0.6.
+            num_perm (int, optional): The number of MinHash values per record; more values estimate the similarity more
+                precisely. Defaults to 64.
+            bands (int, optional): The number of LSH bands num_perm is split into. Records become candidates when all
+                values of one band match, which is likely above a similarity of about (1 / bands) ** (bands / num_perm).
+                Defaults to 16.
+            seed (int, optional): Seed of the MinHash functions. Defaults to 0.
+        """
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands}).")
+        super().__init__(dataframe)
+        self._threshold: float = threshold
+        self._bands: int = bands
+        random_generator: np.random.Generator = np.random.default_rng(seed)
+        # one multiply-shift hash function per MinHash value, the multipliers must be odd
+        self._hash_seeds: np.ndarray = random_generator.integers(0, 2**63, num_perm, dtype=np.uint64)
+        self._hash_multipliers: np.ndarray = random_generator.integers(0, 2**63, num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self._normalized_codes: dict[str, tuple[np.ndarray, pd.Index]] = {}
+
+    def _combine_column_codes(self, subset_key: tuple[str, ...]) -> np.ndarray:
+        """Numbers the near-duplicate groups of the subset in order of first appearance.
+
+        Args:
+            subset_key (tuple[str, ...]): The subset columns.
+
+        Returns:
+            np.ndarray: The group id of each row.
+        """
+        text_columns: list[str] = [column for column in subset_key if _is_text_column(self._dataframe[column])]
+        exact_columns: tuple[str, ...] = tuple(column for column in subset_key if column not in text_columns)
+        if not text_columns:
+            return super()._combine_column_codes(exact_columns)
+
+        # rows equal after normalization are one record, so only distinct records are hashed and compared
+        block_ids: np.ndarray = super()._combine_column_codes(exact_columns)
+        record_keys: pd.MultiIndex = pd.MultiIndex.from_arrays([block_ids] + [self._get_normalized_codes(column)[0] for column in text_columns])
+        record_ids, records = pd.factorize(record_keys)
+
+        record_blocks: np.ndarray = records.get_level_values(0).to_numpy(dtype=np.int64)
+        record_texts: pd.Series = self._build_record_texts(records, text_columns)
+        pairs: np.ndarray = self._find_matching_pairs(record_texts, record_blocks)
+
+        components: np.ndarray = _connected_components(len(records), pairs)
+        group_ids, _ = pd.factorize(components[record_ids])
+        return group_ids.astype(np.int64, copy=False)
+
+    def _get_normalized_codes(self, column: str) -> tuple[np.ndarray, pd.Index]:
+        if column not in self._normalized_codes:
+            codes, uniques = pd.factorize(self._dataframe[column])
+            normalized_values: pd.Series = normalize_text(pd.Series(uniques, dtype=object))
+            # values that only differ before normalization share a code; nulls are treated as empty text
+            normalized_codes, normalized_uniques = pd.factorize(pd.concat([normalized_values, pd.Series([""])], ignore_index=True))
+            self._normalized_codes[column] = (normalized_codes[codes], pd.Index(normalized_uniques))
+        return self._normalized_codes[column]
+
+    def _build_record_texts(self, records: pd.MultiIndex, text_columns: list[str]) -> pd.Series:
+        # level 0 of the records is the block, the other levels are the normalized codes of the text columns
+        column_texts: list[pd.Series] = [
+            pd.Series(self._get_normalized_codes(column)[1].take(records.get_level_values(level + 1).to_numpy()), dtype=object)
+            for level, column in enumerate(text_columns)
+        ]
+        record_texts: pd.Series = column_texts[0] if len(column_texts) == 1 else column_texts[0].str.cat(column_texts[1:], sep=" ")
+        return record_texts.str.strip()
+
+    def _find_matching_pairs(self, record_texts: pd.Series, record_blocks: np.ndarray) -> np.ndarray:
+        """Generates candidate pairs of records and keeps the ones similar enough to be duplicates.
+
+        Args:
+            record_texts (pd.Series): The normalized text of each distinct record.
+            record_blocks (np.ndarray): The code of each record's exact columns; only records of the same block are compared.
+
+        Returns:
+            np.ndarray: The matching pairs of record positions, one pair per row.
+        """
+        # records with the same words in any order are duplicates without scoring
+        sorted_words: pd.Series = record_texts.str.split().map(lambda words: " ".join(sorted(words)))
+        word_keys: np.ndarray = _combine_keys(record_blocks.astype(np.uint64), pd.util.hash_array(sorted_words.to_numpy(dtype=object)))
+        word_pairs: np.ndarray = _bucket_pairs(word_keys)
+
+        signatures: np.ndarray = self._compute_signatures(record_texts)
+        rows_per_band: int = signatures.shape[1] // self._bands
+        band_pairs: list[np.ndarray] = []
+        for band in range(self._bands):
+            band_keys: np.ndarray = record_blocks.astype(np.uint64) + np.uint64(band)
+            for position in range(band * rows_per_band, (band + 1) * rows_per_band):
+                band_keys = _combine_keys(band_keys, signatures[:, position].astype(np.uint64))
+            band_pairs.append(_bucket_pairs(band_keys))
+
+        # pairs found by several bands are scored once
+        candidate_pairs: np.ndarray = np.concatenate(band_pairs)
+        pair_keys: np.ndarray = np.unique(candidate_pairs[:, 0] * len(record_texts) + candidate_pairs[:, 1])
+        candidate_pairs = np.column_stack((pair_keys // len(record_texts), pair_keys % len(record_texts)))
+        similarities: np.ndarray = np.concatenate([
+            (signatures[batch[:, 0]] == signatures[batch[:, 1]]).mean(axis=1)
+            for batch in np.array_split(candidate_pairs, max(1, len(candidate_pairs) // _SIGNATURE_BATCH_SIZE))
+        ]) if len(candidate_pairs) else np.zeros(0)
+
+        return np.concatenate((word_pairs, candidate_pairs[similarities >= self._threshold]))
+
+    def _compute_signatures(self, record_texts: pd.Series) -> np.ndarray:
+        """Computes the MinHash signature of the character trigrams of every record, in batches of records.
+
+        Args:
+            record_texts (pd.Series): The normalized text of each record; only the first characters are used for long records.
+
+        Returns:
+            np.ndarray: One row of num_perm 32-bit MinHash values per record.
+        """
+        signatures: np.ndarray = np.empty((len(record_texts), len(self._hash_seeds)), dtype=np.uint32)
+        # padding with spaces gives the first and last characters trigrams of their own
+        padded_texts: np.ndarray = (" " + record_texts.str.slice(0, _MAX_RECORD_LENGTH) + " ").to_numpy(dtype=str)
+        text_lengths: np.ndarray = np.char.str_len(padded_texts)
+        # batches of records of similar length waste little work on padding
+        length_order: np.ndarray = np.argsort(text_lengths, kind="stable")
+
+        for start in range(0, len(padded_texts), _SIGNATURE_BATCH_SIZE):
+            batch_positions: np.ndarray = length_order[start:start + _SIGNATURE_BATCH_SIZE]
+            width: int = max(3, int(text_lengths[batch_positions].max()))
+            characters: np.ndarray = padded_texts[batch_positions].astype(f"U{width}").view(np.uint32).reshape(len(batch_positions), width).astype(np.uint64)
+            # every trigram as one number; code points fit in 21 bits
+            trigrams: np.ndarray = (characters[:, :-2] << np.uint64(42)) | (characters[:, 1:-1] << np.uint64(21)) | characters[:, 2:]
+            # positions past the end of a record repeat its first trigram, which leaves every minimum unchanged
+            valid: np.ndarray = np.arange(width - 2) < (text_lengths[batch_positions] - 2)[:, None]
+            trigrams = _mix_bits(np.where(valid, trigrams, trigrams[:, :1]))
+
+            for index, (hash_seed, multiplier) in enumerate(zip(self._hash_seeds, self._hash_multipliers)):
+                # multiply-shift: the high 32 bits of the product are a well mixed hash
+                signatures[batch_positions, index] = (((trigrams ^ hash_seed) * multiplier) >> np.uint64(32)).min(axis=1)
+
+        return signatures
+
+    @property
+    def threshold(self) -> float:
+        return self._threshold
+
+
+def normalize_text(values: pd.Series) -> pd.Series:
+    """Normalizes text for comparison: lowercase, accents removed, punctuation replaced by spaces and whitespace collapsed.
+    Nulls become empty text.
+
+    Args:
+        values (pd.Series): The values to normalize; non-string values are converted to text first.
+
+    Returns:
+        pd.Series: The normalized text.
+    """
+    text: pd.Series = values.astype(object).where(values.notna(), "").astype(str)
+    text = text.str.lower().str.normalize("NFKD").str.replace("[\u0300-\u036f]", "", regex=True)
+    return text.str.replace(r"[^\w\s]|_", " ", regex=True).str.replace(r"\s+", " ", regex=True).str.strip()
+
+
+def _mix_bits(values: np.ndarray) -> np.ndarray:
+    # the splitmix64 finalizer: nearby inputs, like trigrams sharing two characters, get unrelated outputs
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def _is_text_column(column_data: pd.Series) -> bool:
+    return pd.api.types.is_object_dtype(column_data.dtype) or pd.api.types.is_string_dtype(column_data.dtype) or isinstance(column_data.dtype, pd.CategoricalDtype)
+
+
+def _combine_keys(keys: np.ndarray, values: np.ndarray) -> np.ndarray:
+    # multiply-shift mixing, so keys of different value sequences rarely collide
+    return (keys * np.uint64(_MULTIPLY_SHIFT_SEED)) ^ values.astype(np.uint64) ^ (values.astype(np.uint64) >> np.uint64(29))
+
+
+def _bucket_pairs(keys: np.ndarray) -> np.ndarray:
+    """Pairs the records sharing a key: each record with the first and with the previous record of its bucket, so a bucket
+    of n records gives fewer than 2n pairs. Buckets larger than _MAX_BUCKET_SIZE, e.g. of a placeholder value, are skipped.
+
+    Args:
+        keys (np.ndarray): The key of each record.
+
+    Returns:
+        np.ndarray: The candidate pairs of record positions, the smaller position first.
+    """
+    order: np.ndarray = np.argsort(keys, kind="stable")
+    sorted_keys: np.ndarray = keys[order]
+    bucket_starts: np.ndarray = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+    bucket_sizes: np.ndarray = np.diff(np.append(bucket_starts, len(keys)))
+
+    bucket_firsts: np.ndarray = np.repeat(bucket_starts, bucket_sizes)
+    in_pair_bucket: np.ndarray = np.repeat((bucket_sizes > 1) & (bucket_sizes <= _MAX_BUCKET_SIZE), bucket_sizes)
+    positions: np.ndarray = np.flatnonzero(in_pair_bucket & (np.arange(len(keys)) != bucket_firsts))
+
+    first_pairs: np.ndarray = np.column_stack((order[bucket_firsts[positions]], order[positions]))
+    previous_pairs: np.ndarray = np.column_stack((order[positions - 1], order[positions]))
+    pairs: np.ndarray = np.concatenate((first_pairs, previous_pairs))
+    return np.sort(pairs, axis=1)
+
+
+def _connected_components(node_count: int, pairs: np.ndarray) -> np.ndarray:
+    """Union-find over the pairs by label propagation with pointer jumping: every node ends up labelled with the smallest
+    node of its component.
+
+    Args:
+        node_count (int): The number of nodes.
+        pairs (np.ndarray): The edges, one pair of node positions per row.
+
+    Returns:
+        np.ndarray: The component label of each node.
+    """
+    labels: np.ndarray = np.arange(node_count, dtype=np.int64)
+    if len(pairs) == 0:
+        return labels
+
+    while True:
+        edge_labels: np.ndarray = np.minimum(labels[pairs[:, 0]], labels[pairs[:, 1]])
+        new_labels: np.ndarray = labels.copy()
+        np.minimum.at(new_labels, labels[pairs[:, 0]], edge_labels)
+        np.minimum.at(new_labels, labels[pairs[:, 1]], edge_labels)
+        # pointer jumping: follow the labels to their roots, so long chains collapse in few rounds
+        while True:
+            jumped_labels: np.ndarray = new_labels[new_labels]
+            if np.array_equal(jumped_labels, new_labels):
+                break
+            new_labels = jumped_labels
+        if np.array_equal(new_labels, labels):
+            return labels
+        labels = new_labels
@@ -0,0 +1,197 @@
+# ElPsychicMustache
+# 2025-01-02
+
+# Records how long each step and analyzer method takes and how it changes the dataframe, as a stream of events.
+#   Instrumentation is off until start_instrumentation is called; while off, an instrumented call only checks one global.
+#   Events can be passed to hooks as they happen (e.g. to forward them to a monitoring system) and exported as JSON.
+
+import contextlib
+import functools
+import json
+import time
+import tracemalloc
+from typing import Callable, Iterator
+
+import pandas as pd
+
+_active_instrumentation: "Instrumentation" = None
+
+
+class Instrumentation:
+    def __init__(self, hooks: list[Callable[[dict], None]]=None, trace_allocations: bool=False, deep_memory: bool=False) -> None:
+        """Collects one event per instrumented step. Each event holds the step name, its nesting depth, wall and CPU time,
+        the rows and columns of the dataframe before and after, and the dataframe's memory before and after.
+        Wall time includes time spent waiting on prompts, CPU time does not.
+
+        Args:
+            hooks (list[Callable[[dict], None]], optional): Functions called with every event as soon as its step finishes. Defaults to None.
+            trace_allocations (bool, optional): Also record the peak Python and numpy allocation of each step with tracemalloc.
+                This slows every step down noticeably. Defaults to False.
+            deep_memory (bool, optional): Measure the dataframe memory including the contents of object and string columns.
+                This reads every value of those columns before and after each step, which can take longer than the step
+                itself. Defaults to False, which counts only their pointers.
+        """
+        self.events: list[dict] = []
+        self._hooks: list[Callable[[dict], None]] = list(hooks or [])
+        self._trace_allocations = trace_allocations
+        self._deep_memory = deep_memory
+        # the highest allocation peak seen by the children of each open step, since tracemalloc only has one peak
+        self._open_peaks: list[int] = []
+
+    def add_hook(self, hook: Callable[[dict], None]) -> None:
+        self._hooks.append(hook)
+
+    @contextlib.contextmanager
+    def measure(self, name: str, get_dataframe: Callable[[], pd.DataFrame|None]) -> Iterator[None]:
+        """Records one event for the code run inside the with block.
+
+        Args:
+            name (str): The step name, e.g. "prepare_data.nulls".
+            get_dataframe (Callable[[], pd.DataFrame|None]): Returns the current dataframe; called before and after the step.
+        """
+        event: dict = {"name": name, "depth": len(self._open_peaks), "start_time": time.time()}
+        event.update(self._describe_dataframe(get_dataframe(), "before"))
+
+        if self._trace_allocations:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            allocated_before, peak_before = tracemalloc.get_traced_memory()
+            if self._open_peaks:
+                self._open_peaks[-1] = max(self._open_peaks[-1], peak_before)
+            tracemalloc.reset_peak()
+        self._open_peaks.append(0)
+
+        wall_start: float = time.perf_counter()
+        cpu_start: float = time.process_time()
+        try:
+            yield
+        finally:
+            event["wall_time_s"] = time.perf_counter() - wall_start
+            event["cpu_time_s"] = time.process_time() - cpu_start
+
+            children_peak: int = self._open_peaks.pop()
+            if self._trace_allocations:
+                peak: int = max(tracemalloc.get_traced_memory()[1], children_peak)
+                event["peak_allocation_mb"] = (peak - allocated_before) / 1024**2
+                if self._open_peaks:
+                    self._open_peaks[-1] = max(self._open_peaks[-1], peak)
+
+            event.update(self._describe_dataframe(get_dataframe(), "after"))
+            self._record(event)
+
+    def to_json(self, file_path: str=None) -> str:
+        """Exports every event as a JSON list.
+
+        Args:
+            file_path (str, optional): Also write the JSON to this file. Defaults to None.
+
+        Returns:
+            str: The JSON text.
+        """
+        events_json: str = json.dumps(self.events, indent=2, default=str)
+        if file_path is not None:
+            with open(file_path, "w") as json_file:
+                json_file.write(events_json)
+        return events_json
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.events)
+
+    def clear(self) -> None:
+        self.events.clear()
+
+    def _record(self, event: dict) -> None:
+        self.events.append(event)
+        for hook in self._hooks:
+            hook(event)
+
+    def _describe_dataframe(self, dataframe: pd.DataFrame|None, suffix: str) -> dict:
+        if not isinstance(dataframe, pd.DataFrame):
+            return {}
+        return {
+            f"rows_{suffix}": dataframe.shape[0],
+            f"columns_{suffix}": dataframe.shape[1],
+            f"memory_{suffix}_mb": dataframe.memory_usage(deep=self._deep_memory).sum() / 1024**2,
+        }
+
+
+def start_instrumentation(hooks: list[Callable[[dict], None]]=None, trace_allocations: bool=False, deep_memory: bool=False) -> Instrumentation:
+    """Turns instrumentation on for every instrumented step until stop_instrumentation is called.
+
+    Args:
+        hooks (list[Callable[[dict], None]], optional): Functions called with every event. Defaults to None.
+        trace_allocations (bool, optional): Record the peak allocation of each step with tracemalloc. Defaults to False.
+        deep_memory (bool, optional): Include the contents of object and string columns in the dataframe memory, at the
+            cost of reading them before and after every step. Defaults to False.
+
+    Returns:
+        Instrumentation: The recorder that collects the events.
+    """
+    global _active_instrumentation
+    _active_instrumentation = Instrumentation(hooks=hooks, trace_allocations=trace_allocations, deep_memory=deep_memory)
+    return _active_instrumentation
+
+
+def stop_instrumentation() -> Instrumentation|None:
+    """Turns instrumentation off.
+
+    Returns:
+        Instrumentation|None: The recorder that was active, holding the collected events.
+    """
+    global _active_instrumentation
+    instrumentation: Instrumentation = _active_instrumentation
+    _active_instrumentation = None
+    if instrumentation is not None and instrumentation._trace_allocations and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    return instrumentation
+
+
+def get_instrumentation() -> Instrumentation|None:
+    return _active_instrumentation
+
+
+@contextlib.contextmanager
+def instrument_step(name: str, get_dataframe: Callable[[], pd.DataFrame|None]) -> Iterator[None]:
+    """Records the with block as a step if instrumentation is on, otherwise does nothing.
+
+    Args:
+        name (str): The step name.
+        get_dataframe (Callable[[], pd.DataFrame|None]): Returns the current dataframe.
+    """
+    if _active_instrumentation is None:
+        yield
+        return
+    with _active_instrumentation.measure(name, get_dataframe):
+        yield
+
+
+def instrumented(name: str) -> Callable:
+    """Decorator that records a method (or function) as a step if instrumentation is on. The dataframe is read from the
+    instance's _dataframe (or else the first dataframe argument) before the call, and a returned dataframe is used as the output.
+
+    Args:
+        name (str): The step name, e.g. "null_analyzer.analyze_nulls".
+
+    Returns:
+        Callable: The decorator.
+    """
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _active_instrumentation is None:
+                return function(*args, **kwargs)
+
+            instance: object = args[0] if args else None
+            input_dataframe: pd.DataFrame|None = next((arg for arg in args if isinstance(arg, pd.DataFrame)), None)
+            result: list = []
+
+            def get_dataframe() -> pd.DataFrame|None:
+                if result and isinstance(result[0], pd.DataFrame):
+                    return result[0]
+                return getattr(instance, "_dataframe", input_dataframe)
+
+            with _active_instrumentation.measure(name, get_dataframe):
+                result.append(function(*args, **kwargs))
+            return result[0]
+        return wrapper
+    return decorator
@@ -0,0 +1,189 @@
+# ElPsychicMustache
+# 2025-01-08
+
+# Loads Arrow IPC/Feather, Parquet and .npy column files through memory maps instead of parsing text.
+#   Arrow columns stored in one uncompressed chunk without nulls, and every .npy array, are wrapped without a copy, so the
+#   dataframe reads straight from the OS page cache and worker processes loading the same file share one copy of it.
+
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+from .instrumentation import instrumented
+from .utilities import get_full_file_path
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+MAPPED_FILE_FORMATS: dict[str, str] = {".arrow": "arrow", ".feather": "arrow", ".ipc": "arrow", ".parquet": "parquet", ".npy": "npy"}
+
+
+def get_file_format(full_file_path: str) -> str:
+    """Returns how a file is loaded, based on its suffix. A directory of .npy files is loaded as one column per file.
+
+    Args:
+        full_file_path (str): The full path to the file or directory.
+
+    Returns:
+        str: "csv", "arrow", "parquet" or "npy".
+    """
+    if os.path.isdir(full_file_path):
+        if glob.glob(os.path.join(full_file_path, "*.npy")):
+            return "npy"
+        raise ValueError(f"{full_file_path} is a directory without .npy column files.")
+    return MAPPED_FILE_FORMATS.get(os.path.splitext(full_file_path)[1].lower(), "csv")
+
+
+@instrumented("load.get_df_from_mapped_file")
+def get_df_from_mapped_file(file_path: str, file_name: str, date_columns: list[str]=None, column_names: list[str]=None, usecols: list[str]=None, dtypes: dict[str, str]=None) -> pd.DataFrame:
+    """Loads an Arrow IPC/Feather file, a Parquet file, a .npy file or a directory of .npy column files through a memory map.
+
+    Zero-copy columns are views of the mapped file: Arrow columns are read-only (replacing a column, as every step of
+    DataframeManager does, is fine), while .npy columns are mapped copy-on-write, so writing to them copies only the touched pages.
+    Parquet is always decoded, but only the used columns are read.
+
+    Args:
+        file_path (str): The path to the file.
+        file_name (str): The name of the file, or of the directory of .npy files (one column per file, in file name order).
+        date_columns (list[str], optional): Columns to convert to datetime if they are not stored as one. Defaults to None.
+        column_names (list[str], optional): New names for every column, in file order. Defaults to None.
+        usecols (list[str], optional): Only these columns are read; the others are never mapped. Defaults to None.
+        dtypes (dict[str, str], optional): D-types to convert columns to after loading. Defaults to None.
+
+    Returns:
+        pd.DataFrame: The loaded dataframe.
+    """
+    full_file_path: str = get_full_file_path(file_path, file_name)
+    file_format: str = get_file_format(full_file_path)
+    if file_format in ("arrow", "parquet") and pa is None:
+        raise ImportError(f"pyarrow is required to load {file_format} files. Install it with 'pip install pyarrow'.")
+
+    source_columns: list[str] = _get_source_columns(full_file_path, file_format)
+    rename_dict: dict[str, str] = {}
+    if column_names:
+        if len(column_names) != len(source_columns):
+            raise ValueError(f"column_names has {len(column_names)} names, but {full_file_path} has {len(source_columns)} columns.")
+        rename_dict = {source: name for source, name in zip(source_columns, column_names) if source != name}
+
+    # usecols uses the new names, so it is translated back to the names in the file
+    source_usecols: list[str] = None
+    if usecols:
+        new_names: dict[str, str] = {source: rename_dict.get(source, source) for source in source_columns}
+        source_usecols = [source for source in source_columns if new_names[source] in usecols]
+
+    if file_format == "arrow":
+        dataframe: pd.DataFrame = _read_arrow(full_file_path, source_usecols)
+    elif file_format == "parquet":
+        dataframe = pq.read_table(full_file_path, columns=source_usecols, memory_map=True).to_pandas(split_blocks=True)
+    else:
+        dataframe = _read_npy(full_file_path, source_usecols)
+
+    if rename_dict:
+        dataframe = dataframe.rename(columns=rename_dict)
+
+    converted_columns: dict[str, pd.Series] = {}
+    for column in date_columns or []:
+        if column in dataframe.columns and not pd.api.types.is_datetime64_any_dtype(dataframe[column].dtype):
+            converted_columns[column] = pd.to_datetime(dataframe[column])
+    for column, dtype in (dtypes or {}).items():
+        if column in dataframe.columns:
+            converted_columns[column] = dataframe[column].astype(dtype)
+    # assigning replaces only the converted columns, so the others stay mapped
+    return dataframe.assign(**converted_columns) if converted_columns else dataframe
+
+
+def get_mapped_file_columns(file_path: str, file_name: str, column_names: list[str]=None) -> list[str]:
+    """Returns the column names of an Arrow, Parquet or .npy file by reading only its schema.
+
+    Args:
+        file_path (str): The path to the file.
+        file_name (str): The name of the file or directory of .npy files.
+        column_names (list[str], optional): The names to provide each column. If passed, they are returned as is. Defaults to None.
+
+    Returns:
+        list[str]: The column names.
+    """
+    if column_names:
+        return list(column_names)
+    full_file_path: str = get_full_file_path(file_path, file_name)
+    return _get_source_columns(full_file_path, get_file_format(full_file_path))
+
+
+def _read_arrow(full_file_path: str, columns: list[str]=None) -> pd.DataFrame:
+    """Reads an Arrow IPC file (Feather v2), Feather v1 file or IPC stream through a memory map.
+
+    Args:
+        full_file_path (str): The full path to the file.
+        columns (list[str], optional): The columns to read. Defaults to None, which reads every column.
+
+    Returns:
+        pd.DataFrame: The dataframe; each column is its own block, so no columns are copied into a combined block.
+    """
+    try:
+        table: pa.Table = feather.read_table(full_file_path, columns=columns, memory_map=True)
+    except pa.ArrowInvalid:
+        # an IPC stream has no footer to look up single columns in, so it is mapped whole and the columns are selected after
+        with pa.memory_map(full_file_path, "r") as source:
+            table = pa.ipc.open_stream(source).read_all()
+        if columns is not None:
+            table = table.select(columns)
+    return table.to_pandas(split_blocks=True)
+
+
+def _read_npy(full_file_path: str, columns: list[str]=None) -> pd.DataFrame:
+    """Maps a .npy file or every .npy file of a directory. A 1-D file is one column named after the file and a 2-D file is
+    one column per array column. Arrays of Python objects cannot be mapped and are refused, since loading them runs pickle.
+
+    Args:
+        full_file_path (str): The full path to the file or directory.
+        columns (list[str], optional): The columns to map. Defaults to None, which maps every column.
+
+    Returns:
+        pd.DataFrame: The dataframe wrapping the mapped arrays.
+    """
+    if os.path.isdir(full_file_path):
+        column_files: dict[str, str] = _get_npy_column_files(full_file_path)
+        arrays: dict[str, np.ndarray] = {column: np.load(column_files[column], mmap_mode="c") for column in columns or column_files}
+        for column, array in arrays.items():
+            if array.ndim != 1:
+                raise ValueError(f"The column file {column_files[column]} must hold a 1-D array, but it has {array.ndim} dimensions.")
+        return pd.DataFrame(arrays, copy=False)
+
+    array: np.ndarray = np.load(full_file_path, mmap_mode="c")
+    if array.ndim == 1:
+        return pd.DataFrame({_get_npy_column_name(full_file_path): array}, copy=False)
+
+    dataframe: pd.DataFrame = pd.DataFrame(array, columns=[str(index) for index in range(array.shape[1])], copy=False)
+    return dataframe[columns] if columns is not None else dataframe
+
+
+def _get_source_columns(full_file_path: str, file_format: str) -> list[str]:
+    if file_format == "arrow":
+        with pa.memory_map(full_file_path, "r") as source:
+            for open_reader in (pa.ipc.open_file, pa.ipc.open_stream):
+                try:
+                    return list(open_reader(source).schema.names)
+                except pa.ArrowInvalid:
+                    source.seek(0)
+        return list(feather.read_table(full_file_path, memory_map=True).schema.names)  # Feather v1
+    if file_format == "parquet":
+        return list(pq.read_schema(full_file_path).names)
+
+    if os.path.isdir(full_file_path):
+        return list(_get_npy_column_files(full_file_path))
+    array: np.ndarray = np.load(full_file_path, mmap_mode="r")
+    return [_get_npy_column_name(full_file_path)] if array.ndim == 1 else [str(index) for index in range(array.shape[1])]
+
+
+def _get_npy_column_files(directory: str) -> dict[str, str]:
+    return {_get_npy_column_name(column_file): column_file for column_file in sorted(glob.glob(os.path.join(directory, "*.npy")))}
+
+
+def _get_npy_column_name(column_file: str) -> str:
+    return os.path.splitext(os.path.basename(column_file))[0]
@@ -6,25 +6,38 @@
 
 import pandas as pd
 
+from .column_profile import ColumnProfile
+from .instrumentation import instrumented
+from .null_imputer import NullImputer
+from .null_index import NullMaskIndex
 from .utilities import prompt_selection_for_column_list, prompt_user_for_int 
 from .validate_input import get_user_confirmation, validate_argument
 
 class NullAnalyzer:
-    def __init__(self, dataframe: pd.DataFrame):
+    def __init__(self, dataframe: pd.DataFrame, profile: ColumnProfile=None, null_index: NullMaskIndex=None, analyze: bool=True):
         """Takes in a dataframe as an argument, and then performs all null analysis steps.
         You will want to 
 
         Args:
             dataframe (pd.DataFrame): The dataframe to analyze.
+            profile (ColumnProfile, optional): Cached column statistics of the dataframe. Defaults to None, which creates a new profile.
+            null_index (NullMaskIndex, optional): Null masks of the dataframe, kept up to date by the analysis. Defaults to None, which builds a new index.
+            analyze (bool, optional): Start the interactive analysis right away. Defaults to True.
         """
         self._dataframe = dataframe
-        self.analyze_nulls()
+        self._profile = profile if profile is not None else ColumnProfile(dataframe)
+        self._null_index = null_index if null_index is not None else NullMaskIndex(dataframe)
+        self._null_imputer: NullImputer = None
+        if analyze:
+            self.analyze_nulls()
 
+    @instrumented("null_analyzer.analyze_nulls")
     def analyze_nulls(self) -> None:
             
         if get_user_confirmation(message="[*] Would you like to analyze null values? [Y/n] ", true_options=["yes", "y", ""], false_options=["no", "n"]):
             self._show_null_values()
             columns_with_null: list[str] = self._get_columns_with_null()
+            self._show_co_missing(columns_with_null=columns_with_null)
             print()  # making output a bit nicer
             self._display_null_ratios(columns_with_null=columns_with_null)
             print()
@@ -34,7 +47,7 @@ class NullAnalyzer:
         """Prints how many null values appear in each column.
         """
         print("======= Null values in each column ======= \n")
-        print(f"{self._dataframe.isna().sum()}")
+        print(f"{self._null_index.null_counts()}")
 
     def _get_columns_with_null(self) -> list[str]:
         """Provides a list of columns that contain null values.
@@ -42,8 +55,23 @@ class NullAnalyzer:
         Returns:
             list[str]: List of columns that contain null values.
         """
-        columns_with_nulls_series: pd.Series = self._dataframe.isnull().sum()
-        return list(columns_with_nulls_series.loc[columns_with_nulls_series != 0].index)
+        return self._null_index.columns_with_null()
+
+    def _show_co_missing(self, columns_with_null: list[str]) -> None:
+        """Prints how many rows contain any null, and which columns tend to be null together.
+
+        Args:
+            columns_with_null (list[str]): The list of columns that contain null values.
+        """
+        if not columns_with_null or self._null_index.row_count == 0:
+            return
+
+        rows_with_null: int = self._null_index.rows_with_any_null(columns_with_null)
+        print(f"\n[!] {rows_with_null} rows ({'{:.2%}'.format(rows_with_null / self._null_index.row_count)}) contain at least one null value.")
+
+        if len(columns_with_null) > 1:
+            print("======= Rows null in both columns =======")
+            print(self._null_index.co_missing_matrix(columns_with_null))
     
     def _display_null_ratios(self, columns_with_null: list[str]) -> None:
         """Prints out each column, shows the % of rows that are null, and then provides a recommendation on what to do with the null values.
@@ -55,27 +83,43 @@ class NullAnalyzer:
             return
 
         input("[!] Press enter to continue . . . \n")
-        
-        num_rows: int = self._dataframe.shape[0]
+        self.show_null_recommendations()
+
+    def show_null_recommendations(self, null_ratio_estimates: pd.DataFrame=None) -> None:
+        """Prints the null percentage of each column containing nulls, with a recommendation on what to do with them.
 
+        Args:
+            null_ratio_estimates (pd.DataFrame, optional): When the dataframe is a sample, the estimated null ratios of the
+                whole data with "lower" and "upper" interval bounds per column, printed next to each percentage. Defaults to None.
+        """
         print("======= Percentage of null values in each column =======")
+        columns_with_null: list[str] = self._get_columns_with_null()
+        # the statistics behind the recommendations are computed for every column in parallel before printing
+        self._profile.compute(columns_with_null)
+        self._profile.compute_modes([column for column in columns_with_null if "mean" in self._profile.get_column_stats(column)])
         for column in columns_with_null:
-            null_percentage: float = self._dataframe[column].isnull().sum() / num_rows
-            self._print_column_null_summary(column_name=column, null_percentage=null_percentage)
-            self._determine_recommendation(self._dataframe[column], null_percentage)
+            null_percentage: float = self._null_index.null_ratio(column)
+            self._print_column_null_summary(column_name=column, null_percentage=null_percentage, null_ratio_estimate=None if null_ratio_estimates is None else null_ratio_estimates.loc[column])
+            self._determine_recommendation(column, null_percentage)
 
-    def _print_column_null_summary(self, column_name: str, null_percentage: float) -> None:
+    def _print_column_null_summary(self, column_name: str, null_percentage: float, null_ratio_estimate: pd.Series=None) -> None:
         print(f"[!] {column_name} {'{:.2%}'.format(null_percentage)}", end="")
+        if null_ratio_estimate is not None:
+            print(f" (whole data: {'{:.2%}'.format(null_ratio_estimate['lower'])} to {'{:.2%}'.format(null_ratio_estimate['upper'])})", end="")
 
-    def _determine_recommendation(self, column_data: pd.Series, percentage_null: float) -> None:
+    def _determine_recommendation(self, column: str, percentage_null: float) -> None:
         """Prints to the user some simple recommendations on what to do based on data type and what % of rows are null.
 
         Args:
-            column_data (pd.Series): A pandas series containing a column's values.
+            column (str): The name of the column.
             percentage_null (float): The percentage of values that are null (in decimal form).
         """
 
-        dtype_as_string: str = str(column_data.dtype)[0]
+        column_dtype = self._profile.get_stat(column, "dtype")
+        if isinstance(column_dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(column_dtype):
+            dtype_as_string: str = 'o'  # categorical and string columns are recommended like object columns
+        else:
+            dtype_as_string: str = str(column_dtype)[0]
         high_perc_flag: bool = percentage_null > 0.3
 
         recommendation_func: dict[str, callable] = {
@@ -87,21 +131,21 @@ class NullAnalyzer:
         }.get(dtype_as_string, self._no_recommendation)
 
         # using dictionary to call appropriate function
-        recommendation_func(dtype_as_string, column_data, high_perc_flag)
+        recommendation_func(dtype_as_string, column, high_perc_flag)
 
-    def _recommend_for_numeric_column(self, column_dtype: str, column_data: pd.Series, high_perc_flag: bool) -> None:
-        mean_value: int|float = column_data.mean()
-        median_value: int|float = column_data.median()
-        mode_value: int|float = column_data.mode()[0]
+    def _recommend_for_numeric_column(self, column_dtype: str, column: str, high_perc_flag: bool) -> None:
+        mean_value: int|float = self._profile.get_stat(column, "mean")
+        median_value: int|float = self._profile.get_stat(column, "50%")
+        mode_value: int|float = self._profile.get_stat(column, "mode")
         self._show_recommendation(column_type=column_dtype, high_perc_flag=high_perc_flag)
         print(f"\tMean: {mean_value}, median: {median_value}, mode: {mode_value}")
 
-    def _recommend_for_object_column(self, column_dtype: str, column_data: pd.Series, high_perc_flag: bool) -> None:
-        most_common_value: str = column_data.value_counts().index[0]
+    def _recommend_for_object_column(self, column_dtype: str, column: str, high_perc_flag: bool) -> None:
+        most_common_value: str = self._profile.get_stat(column, "top")
         self._show_recommendation(column_type=column_dtype, high_perc_flag=high_perc_flag)
         print(f"\tMost common value: {most_common_value}")
 
-    def _no_recommendation(self, column_dtype: str, column_data: pd.Series, high_perc_flag: bool) -> None:
+    def _no_recommendation(self, column_dtype: str, column: str, high_perc_flag: bool) -> None:
         print(" --> No recommendations for this data type..")
 
     def _show_recommendation(self, column_type: str, high_perc_flag: bool) -> None:
@@ -156,9 +200,15 @@ class NullAnalyzer:
             3: "Replace with mode (or most common value)",
             4: "Forward fill", 
             5: "Remove entire column",
-            6: "Remove all rows that contain null values: "
+            6: "Remove all rows that contain null values",
+            7: "Replace with median (numeric) or mode (other) within groups of other columns",
         }
-        
+        fill_strategies: dict[int, str] = {1: "mean", 2: "median", 3: "mode", 4: "ffill"}
+
+        # every choice is collected first, so all fills are computed and applied as one batch
+        fill_plan: dict[str, str|dict] = {}
+        columns_to_drop: list[str] = []
+        row_drop_columns: list[str] = []
         for column in list_of_columns:
 
             print()  # printing for nicer output
@@ -167,47 +217,78 @@ class NullAnalyzer:
             if user_selection == 0:
                 print("[!] Doing nothing.")
                 pass
-            elif user_selection == 1:
-                self._replace_with_mean_median_mode(column=column, method="mean")
-            elif user_selection == 2:
-                self._replace_with_mean_median_mode(column=column, method="median")
-            elif user_selection == 3:
-                self._replace_with_mean_median_mode(column=column, method="mode")
-            elif user_selection == 4:
-                self._replace_with_ffill()
+            elif user_selection in fill_strategies:
+                fill_plan[column] = fill_strategies[user_selection]
             elif user_selection == 5:
-                self._drop_nulls(column=column, axis=1)
+                columns_to_drop.append(column)
             elif user_selection == 6:
-                self._drop_nulls(column=column, axis=0)
+                row_drop_columns.append(column)
+            elif user_selection == 7:
+                group_columns: list[str] = prompt_selection_for_column_list(message=f"[*] Please enter the numbers next to the columns to group {column} by. Leaving blank skips this column.", list_of_options=[other for other in self._dataframe.columns if other != column], default_all=False)
+                if group_columns:
+                    strategy: str = "median" if pd.api.types.is_numeric_dtype(self._dataframe[column].dtype) else "mode"
+                    fill_plan[column] = {"strategy": strategy, "by": group_columns}
+
+        # removals run first, so the fill statistics are computed from the rows and columns that are kept
+        for column in columns_to_drop:
+            self._drop_nulls(column=column, axis=1)
+        for column in row_drop_columns:
+            self._drop_nulls(column=column, axis=0)
+        fill_plan = {column: strategy for column, strategy in fill_plan.items() if column in self._dataframe.columns}
+        if fill_plan:
+            self._fill_nulls(fill_plan)
                 
     # Null replacement suite
-    def _replace_with_mean_median_mode(self, column: str, method: str) -> None:
-        if method == "mean":
-            mean: float|int = self._dataframe[column].mean()
-            print(f"[!] Replacing null values with the mean {mean}")
-            self._dataframe[column] = self._dataframe[column].fillna(mean)
-        elif method == "median":
-            median: float|int = self._dataframe[column].median()
-            print(f"[!] Replacing null values with the median {median}")
-            self._dataframe[column] = self._dataframe[column].fillna(median)
-        elif method == "mode":
-            mode: float|int|str = self._dataframe[column].mode()[0]
-            print(f"[!] Replacing null values with the mode {mode}")
-            self._dataframe[column] = self._dataframe[column].fillna(mode)
-
-    def _replace_with_ffill(self, column: str) -> None:
-        print("[!] Replacing null values with forward filling.")
-        self._dataframe[column] = self._dataframe[column].fillna(method="ffill")
+    @instrumented("null_analyzer.fill_nulls")
+    def _fill_nulls(self, fill_plan: dict[str, str|dict]) -> None:
+        """Fills the nulls of every planned column with one NullImputer pass.
+
+        Args:
+            fill_plan (dict[str, str|dict]): The NullImputer strategy of each column.
+        """
+        null_imputer = NullImputer(fill_plan).fit(self._dataframe, profile=self._profile)
+        for column, strategy in fill_plan.items():
+            if isinstance(strategy, dict):
+                print(f"[!] Replacing null values in {column} with the {strategy['strategy']} of each {strategy['by']} group (else {null_imputer.fill_values.get(column)})")
+            elif strategy == "ffill":
+                print(f"[!] Replacing null values in {column} with forward filling.")
+            else:
+                print(f"[!] Replacing null values in {column} with the {strategy} {null_imputer.fill_values[column]}")
 
+        self._dataframe = null_imputer.transform(self._dataframe)
+        self._profile.set_dataframe(self._dataframe)
+        self._profile.invalidate(list(fill_plan))
+        for column in fill_plan:
+            self._null_index.update_column(column, self._dataframe[column])  # e.g. leading nulls are not forward filled
+        self._null_imputer = null_imputer
+
+    @instrumented("null_analyzer.drop_nulls")
     def _drop_nulls(self, column: str, axis: int) -> None:
         if axis == 0:
             print(f"[!] Removing all rows that contain null values in {column}")
-            self._dataframe = self._dataframe.dropna(subset=[column])
+            keep_mask = ~self._null_index.null_mask(column)
+            self._dataframe = self._dataframe.loc[keep_mask]
+            self._null_index.drop_rows(keep_mask)
+            self._profile.set_dataframe(self._dataframe)
+            self._profile.invalidate()  # removing rows changes every column's statistics
         elif axis == 1:
             print(f"[!] Removing column {column}")
             self._dataframe = self._dataframe.drop(columns=[column])
+            self._null_index.drop_column(column)
+            self._profile.set_dataframe(self._dataframe)
+            self._profile.drop([column])
     # End null replacement suite
 
     @property
     def dataframe(self) -> pd.DataFrame:
         return self._dataframe
+
+    @property
+    def null_index(self) -> NullMaskIndex:
+        return self._null_index
+
+    @property
+    def null_imputer(self) -> NullImputer|None:
+        """The imputer fitted by the last fill, to fill new batches of the same data with the same values.
+        """
+        return self._null_imputer
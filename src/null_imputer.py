@@ -0,0 +1,220 @@
+# ElPsychicMustache
+# 2025-01-06
+
+# Fills nulls from a whole plan at once instead of column by column. Fitting computes every statistic the plan needs,
+#   one batched call per statistic (or one groupby per statistic and group), and transforming applies them with one fill.
+#   The fitted values are kept, so new batches of the same data are filled without computing the statistics again.
+
+import pandas as pd
+
+from .column_profile import ColumnProfile
+from .validate_input import validate_argument
+
+FILL_STRATEGIES: list[str] = ["mean", "median", "mode", "ffill"]
+_PROFILE_STATS: dict[str, str] = {"mean": "mean", "median": "50%", "mode": "mode"}
+
+
+class NullImputer:
+    def __init__(self, plan: dict[str, str|dict]) -> None:
+        """Fills the null values of several columns.
+
+        The plan maps each column to one of:
+            "mean", "median", "mode" or "ffill".
+            {"value": fill_value} to fill with a constant.
+            {"strategy": "mean"|"median"|"mode"|"ffill", "by": column or list of columns} to compute the strategy within
+                each group of the by columns. Rows whose group has no value (or is not seen while fitting) fall back to the
+                statistic of the whole column.
+
+        Args:
+            plan (dict[str, str|dict]): The strategy of each column.
+        """
+        for column, strategy in plan.items():
+            validate_fill_strategy(column, strategy)
+
+        self._plan: dict[str, str|dict] = plan
+        self._fill_values: dict[str, object] = None
+        self._group_fill_values: dict[tuple[str, tuple[str, ...]], pd.DataFrame] = {}
+
+    def fit(self, dataframe: pd.DataFrame, profile: ColumnProfile=None) -> "NullImputer":
+        """Computes the fill values of every column in the plan.
+
+        Args:
+            dataframe (pd.DataFrame): The data to compute the statistics from.
+            profile (ColumnProfile, optional): Cached statistics of dataframe; used instead of computing them again. Defaults to None.
+
+        Returns:
+            NullImputer: The fitted imputer.
+        """
+        fill_values: dict[str, object] = {}
+        columns_by_strategy: dict[str, list[str]] = {}
+        columns_by_group: dict[tuple[str, tuple[str, ...]], list[str]] = {}
+
+        for column, strategy in self._plan.items():
+            if isinstance(strategy, dict) and "value" in strategy:
+                fill_values[column] = strategy["value"]
+                continue
+            strategy_name, by = _split_strategy(strategy)
+            if strategy_name == "ffill":
+                continue
+            # grouped columns also need the whole column statistic as the fallback for groups without values
+            columns_by_strategy.setdefault(strategy_name, []).append(column)
+            if by:
+                columns_by_group.setdefault((strategy_name, by), []).append(column)
+
+        for strategy_name, columns in columns_by_strategy.items():
+            fill_values.update(self._compute_statistic(dataframe, strategy_name, columns, profile))
+
+        self._group_fill_values = {
+            (strategy_name, by): _compute_group_statistic(dataframe, strategy_name, list(by), columns)
+            for (strategy_name, by), columns in columns_by_group.items()
+        }
+        self._fill_values = fill_values
+        return self
+
+    def transform(self, dataframe: pd.DataFrame) -> pd.DataFrame:
+        """Fills the nulls of a dataframe with the fitted values.
+
+        Args:
+            dataframe (pd.DataFrame): The dataframe to fill, e.g. the fitted data or a new batch of it.
+
+        Returns:
+            pd.DataFrame: The filled dataframe.
+        """
+        if self._fill_values is None:
+            raise ValueError("The NullImputer must be fitted before transform is called.")
+
+        # per row fill values of grouped columns, with the whole column statistic for rows without a group value
+        row_fill_values: dict[str, pd.Series] = {}
+        for (strategy_name, by), group_values in self._group_fill_values.items():
+            group_keys: pd.Index = pd.MultiIndex.from_frame(dataframe[list(by)]) if len(by) > 1 else pd.Index(dataframe[by[0]])
+            aligned_values: pd.DataFrame = group_values.reindex(group_keys).set_axis(dataframe.index)
+            for column in group_values.columns:
+                row_fill_values[column] = aligned_values[column]
+
+        global_fill_values: dict[str, object] = {column: value for column, value in self._fill_values.items() if column not in row_fill_values and column in dataframe.columns}
+        dataframe = _add_fill_categories(dataframe, global_fill_values, row_fill_values)
+
+        if row_fill_values:
+            filled_columns: pd.DataFrame = dataframe[list(row_fill_values)].fillna(pd.DataFrame(row_fill_values))
+            filled_columns = filled_columns.fillna({column: self._fill_values[column] for column in row_fill_values})
+            dataframe = dataframe.assign(**{column: filled_columns[column] for column in filled_columns.columns})
+
+        if global_fill_values:
+            dataframe = dataframe.fillna(value=global_fill_values)
+
+        ffill_columns: dict[tuple[str, ...], list[str]] = {}
+        for column, strategy in self._plan.items():
+            if isinstance(strategy, dict) and "value" in strategy:
+                continue
+            strategy_name, by = _split_strategy(strategy)
+            if strategy_name == "ffill":
+                ffill_columns.setdefault(by, []).append(column)
+        for by, columns in ffill_columns.items():
+            filled: pd.DataFrame = dataframe.groupby(list(by), sort=False)[columns].ffill() if by else dataframe[columns].ffill()
+            dataframe = dataframe.assign(**{column: filled[column] for column in columns})
+
+        return dataframe
+
+    def fit_transform(self, dataframe: pd.DataFrame, profile: ColumnProfile=None) -> pd.DataFrame:
+        return self.fit(dataframe, profile=profile).transform(dataframe)
+
+    def _compute_statistic(self, dataframe: pd.DataFrame, strategy_name: str, columns: list[str], profile: ColumnProfile=None) -> dict[str, object]:
+        if profile is not None:
+            profile.compute(columns)  # one batched pass for every column that is not cached
+            return {column: profile.get_stat(column, _PROFILE_STATS[strategy_name]) for column in columns}
+
+        if strategy_name == "mean":
+            return dataframe[columns].mean().to_dict()
+        if strategy_name == "median":
+            return dataframe[columns].median().to_dict()
+        modes: pd.DataFrame = dataframe[columns].mode()
+        return {column: modes[column].iloc[0] if len(modes) else None for column in columns}
+
+    @property
+    def fill_values(self) -> dict[str, object]:
+        """The fitted fill value of each column, for grouped columns the fallback for rows without a group value.
+        """
+        return self._fill_values
+
+    @property
+    def group_fill_values(self) -> dict[tuple[str, tuple[str, ...]], pd.DataFrame]:
+        """The fitted fill values of grouped columns, one table per (strategy, by columns) indexed by the group keys.
+        """
+        return self._group_fill_values
+
+    @property
+    def plan(self) -> dict[str, str|dict]:
+        return self._plan
+
+
+def validate_fill_strategy(column: str, strategy: str|dict) -> None:
+    """Raises a ValueError if a plan entry is not a valid fill strategy.
+
+    Args:
+        column (str): The column the strategy is for.
+        strategy (str|dict): The strategy.
+    """
+    if isinstance(strategy, dict):
+        if "value" in strategy:
+            return
+        if "strategy" not in strategy or "by" not in strategy:
+            raise ValueError(f"The null strategy for '{column}' must be one of {FILL_STRATEGIES}, {{'value': fill_value}} or {{'strategy': ..., 'by': ...}}.")
+        strategy = strategy["strategy"]
+    validate_argument(valid_arg_options=FILL_STRATEGIES, user_input=strategy, parameter_name=f"nulls['{column}']")
+
+
+def _split_strategy(strategy: str|dict) -> tuple[str, tuple[str, ...]]:
+    if isinstance(strategy, str):
+        return strategy, ()
+    by: str|list[str] = strategy["by"]
+    return strategy["strategy"], (by,) if isinstance(by, str) else tuple(by)
+
+
+def _compute_group_statistic(dataframe: pd.DataFrame, strategy_name: str, by: list[str], columns: list[str]) -> pd.DataFrame:
+    """Computes a statistic of several columns within every group, in one groupby.
+
+    Args:
+        dataframe (pd.DataFrame): The data.
+        strategy_name (str): "mean", "median" or "mode".
+        by (list[str]): The group columns.
+        columns (list[str]): The columns to compute the statistic of.
+
+    Returns:
+        pd.DataFrame: The statistic of each column (columns) for each group (index).
+    """
+    grouped = dataframe.groupby(by, observed=True, dropna=True)
+    if strategy_name in ("mean", "median"):
+        return grouped[columns].agg(strategy_name)
+
+    # the mode of each group is the most common (group, value) pair, ties go to the smallest value like pd.Series.mode
+    group_modes: dict[str, pd.Series] = {}
+    for column in columns:
+        pair_counts: pd.Series = dataframe.groupby(by + [column], observed=True, dropna=True).size()
+        most_common: pd.Series = pair_counts.sort_values(ascending=False, kind="stable").groupby(level=list(range(len(by))), sort=True).head(1)
+        group_modes[column] = pd.Series(most_common.index.get_level_values(len(by)), index=most_common.index.droplevel(len(by)))
+    return pd.DataFrame(group_modes)
+
+
+def _add_fill_categories(dataframe: pd.DataFrame, fill_values: dict[str, object], row_fill_values: dict[str, pd.Series]) -> pd.DataFrame:
+    """Adds fill values that are not yet a category to categorical columns, since categoricals only accept known categories.
+
+    Args:
+        dataframe (pd.DataFrame): The dataframe to fill.
+        fill_values (dict[str, object]): The fill value of each column filled with one value.
+        row_fill_values (dict[str, pd.Series]): The per row fill values of each grouped column.
+
+    Returns:
+        pd.DataFrame: The dataframe with the categories added.
+    """
+    new_categories: dict[str, pd.Series] = {}
+    for column in dataframe.columns:
+        if not isinstance(dataframe[column].dtype, pd.CategoricalDtype):
+            continue
+        values: list = [fill_values[column]] if column in fill_values else []
+        if column in row_fill_values:
+            values += list(pd.unique(row_fill_values[column].dropna()))
+        missing_categories: list = [value for value in values if pd.notna(value) and value not in dataframe[column].cat.categories]
+        if missing_categories:
+            new_categories[column] = dataframe[column].cat.add_categories(list(dict.fromkeys(missing_categories)))
+
+    return dataframe.assign(**new_categories) if new_categories else dataframe
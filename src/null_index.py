@@ -0,0 +1,229 @@
+# ElPsychicMustache
+# 2024-12-04
+
+# Keeps one packed bit mask of null positions per column, so null counts, ratios and co-missingness
+#   can be answered without building a full boolean frame each time. Updated in place when nulls are filled or rows/columns are removed.
+
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+from .parallel import map_columns
+
+# number of set bits for every possible byte value
+_POPCOUNT_TABLE: np.ndarray = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+class NullMaskIndex:
+    def __init__(self, dataframe: pd.DataFrame) -> None:
+        """Builds a packed null mask for each column of the dataframe.
+
+        Args:
+            dataframe (pd.DataFrame): The dataframe to index.
+        """
+        self._row_count: int = len(dataframe)
+        self._masks: dict[str, np.ndarray|None] = {}
+        self._null_counts: dict[str, int] = {}
+
+        # the masks of the columns are built in parallel, then stored in column order
+        column_masks: dict[str, tuple[np.ndarray|None, int]] = map_columns(lambda column: self._build_mask(dataframe[column]), dataframe.columns, row_count=len(dataframe))
+        for column, (mask, null_count) in column_masks.items():
+            self._masks[column] = mask
+            self._null_counts[column] = null_count
+
+    # Query suite
+    def null_count(self, column: str) -> int:
+        return self._null_counts[column]
+
+    def null_counts(self) -> pd.Series:
+        """Returns how many null values appear in each column.
+
+        Returns:
+            pd.Series: Null count per column.
+        """
+        return pd.Series(self._null_counts, dtype="int64")
+
+    def null_ratio(self, column: str) -> float:
+        if self._row_count == 0:
+            return 0.0
+        return self._null_counts[column] / self._row_count
+
+    def columns_with_null(self) -> list[str]:
+        return [column for column, null_count in self._null_counts.items() if null_count != 0]
+
+    def null_mask(self, column: str) -> np.ndarray:
+        """Returns the unpacked boolean null mask of a column.
+
+        Args:
+            column (str): The column name.
+
+        Returns:
+            np.ndarray: True where the column is null.
+        """
+        return self._unpack(self._masks[column])
+
+    def rows_with_any_null(self, columns: list[str]=None) -> int:
+        """Counts the rows where at least one of the columns is null.
+
+        Args:
+            columns (list[str], optional): The columns to consider. Defaults to None, which considers all columns.
+
+        Returns:
+            int: The number of rows with at least one null.
+        """
+        combined_mask: np.ndarray|None = self._combine_masks(columns, np.bitwise_or)
+        return self._popcount(combined_mask)
+
+    def any_null_mask(self, columns: list[str]=None) -> np.ndarray:
+        """Returns a boolean mask of the rows where at least one of the columns is null.
+
+        Args:
+            columns (list[str], optional): The columns to consider. Defaults to None, which considers all columns.
+
+        Returns:
+            np.ndarray: True for every row containing a null.
+        """
+        return self._unpack(self._combine_masks(columns, np.bitwise_or))
+
+    def co_missing_count(self, column_a: str, column_b: str) -> int:
+        """Counts the rows where both columns are null.
+
+        Args:
+            column_a (str): The first column.
+            column_b (str): The second column.
+
+        Returns:
+            int: The number of rows where both columns are null.
+        """
+        return self._popcount(self._combine_masks([column_a, column_b], np.bitwise_and))
+
+    def co_missing_matrix(self, columns: list[str]=None) -> pd.DataFrame:
+        """Builds a matrix of how many rows are null in both columns. The diagonal is each column's null count.
+
+        Args:
+            columns (list[str], optional): The columns to compare. Defaults to None, which uses every column containing nulls.
+
+        Returns:
+            pd.DataFrame: The pairwise co-missing counts.
+        """
+        if columns is None:
+            columns = self.columns_with_null()
+
+        matrix: np.ndarray = np.zeros((len(columns), len(columns)), dtype=np.int64)
+        for i, column_a in enumerate(columns):
+            matrix[i, i] = self._null_counts[column_a]
+            for j in range(i + 1, len(columns)):
+                matrix[i, j] = matrix[j, i] = self.co_missing_count(column_a, columns[j])
+
+        return pd.DataFrame(matrix, index=columns, columns=columns)
+    # End query suite
+
+    # Update suite
+    def update_column(self, column: str, column_data: pd.Series) -> None:
+        """Rebuilds the mask of a single column, e.g. after a forward fill that may leave leading nulls.
+
+        Args:
+            column (str): The column name.
+            column_data (pd.Series): The new values of the column.
+        """
+        self._masks[column], self._null_counts[column] = self._build_mask(column_data)
+
+    def fill(self, column: str) -> None:
+        """Marks every value of a column as no longer null.
+
+        Args:
+            column (str): The filled column.
+        """
+        self._masks[column] = None
+        self._null_counts[column] = 0
+
+    def drop_column(self, column: str) -> None:
+        self._masks.pop(column, None)
+        self._null_counts.pop(column, None)
+
+    def rename(self, rename_dict: dict[str, str]) -> None:
+        self._masks = {rename_dict.get(column, column): mask for column, mask in self._masks.items()}
+        self._null_counts = {rename_dict.get(column, column): null_count for column, null_count in self._null_counts.items()}
+
+    def drop_rows(self, keep_mask: np.ndarray) -> None:
+        """Removes rows from every mask. Only columns containing nulls need to be touched.
+
+        Args:
+            keep_mask (np.ndarray): Boolean array, True for every row that is kept.
+        """
+        keep_mask = np.asarray(keep_mask, dtype=bool)
+
+        for column, mask in self._masks.items():
+            if mask is None:
+                continue
+            kept_nulls: np.ndarray = self._unpack(mask)[keep_mask]
+            null_count: int = int(kept_nulls.sum())
+            self._masks[column] = np.packbits(kept_nulls) if null_count else None
+            self._null_counts[column] = null_count
+
+        self._row_count = int(keep_mask.sum())
+
+    def append(self, new_rows: pd.DataFrame) -> None:
+        """Extends every mask with rows appended to the end of the dataframe. Only the new rows are scanned for nulls.
+
+        Args:
+            new_rows (pd.DataFrame): The appended rows, with the indexed columns.
+        """
+        new_null_masks: pd.DataFrame = new_rows[list(self._null_counts)].isna()
+
+        for column in self._null_counts:
+            new_mask: np.ndarray = new_null_masks[column].to_numpy()
+            new_null_count: int = int(new_mask.sum())
+            # masks are combined bytewise, so an existing mask is extended even when the new rows have no nulls
+            if new_null_count or self._masks[column] is not None:
+                self._masks[column] = self._append_bits(self._masks[column], new_mask)
+            self._null_counts[column] += new_null_count
+
+        self._row_count += len(new_rows)
+    # End update suite
+
+    def _build_mask(self, column_data: pd.Series) -> tuple[np.ndarray|None, int]:
+        null_mask: np.ndarray = column_data.isna().to_numpy()
+        null_count: int = int(null_mask.sum())
+        # columns without nulls do not need a mask at all
+        return (np.packbits(null_mask) if null_count else None), null_count
+
+    def _append_bits(self, packed_mask: np.ndarray|None, new_mask: np.ndarray) -> np.ndarray:
+        if packed_mask is None:
+            packed_mask = np.zeros((self._row_count + 7) // 8, dtype=np.uint8)
+
+        used_bits: int = self._row_count % 8
+        if used_bits == 0:
+            return np.concatenate((packed_mask, np.packbits(new_mask)))
+
+        # the last byte is only partly used, so the new bits continue inside it
+        last_bits: np.ndarray = np.unpackbits(packed_mask[-1:])[:used_bits]
+        return np.concatenate((packed_mask[:-1], np.packbits(np.concatenate((last_bits, new_mask)))))
+
+    def _combine_masks(self, columns: list[str], bitwise_func: np.ufunc) -> np.ndarray|None:
+        if columns is None:
+            columns = list(self._masks.keys())
+
+        masks: list[np.ndarray|None] = [self._masks[column] for column in columns]
+        if bitwise_func is np.bitwise_and and any(mask is None for mask in masks):
+            return None  # a column without nulls can never be null together with another column
+
+        masks = [mask for mask in masks if mask is not None]
+        if not masks:
+            return None
+        return reduce(bitwise_func, masks)
+
+    def _popcount(self, packed_mask: np.ndarray|None) -> int:
+        if packed_mask is None:
+            return 0
+        return int(_POPCOUNT_TABLE[packed_mask].sum(dtype=np.int64))
+
+    def _unpack(self, packed_mask: np.ndarray|None) -> np.ndarray:
+        if packed_mask is None:
+            return np.zeros(self._row_count, dtype=bool)
+        return np.unpackbits(packed_mask, count=self._row_count).astype(bool)
+
+    @property
+    def row_count(self) -> int:
+        return self._row_count
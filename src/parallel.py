@@ -0,0 +1,56 @@
+# ElPsychicMustache
+# 2025-01-18
+
+# Fans per-column work out across a thread pool. Most per-column kernels (NumPy reductions, sorts and quantiles, bincounts,
+#   Arrow string kernels) release the GIL, so threads use several cores without copying columns into worker processes.
+#   Results are returned in column order, whichever thread finishes first, so output never depends on scheduling.
+#   Small frames run inline, where starting threads would cost more than it saves.
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, TypeVar
+
+ResultType = TypeVar("ResultType")
+
+# below this many rows per column the work is done on the calling thread
+MIN_PARALLEL_ROWS: int = 50_000
+
+_max_workers: int = None
+
+
+def set_max_workers(max_workers: int|None) -> None:
+    """Sets how many threads per-column work uses everywhere in the library.
+
+    Args:
+        max_workers (int|None): The number of threads; 1 runs everything on the calling thread. None uses one per CPU.
+    """
+    if max_workers is not None and max_workers < 1:
+        raise ValueError(f"max_workers must be at least 1, got {max_workers}.")
+    global _max_workers
+    _max_workers = max_workers
+
+
+def get_max_workers() -> int:
+    return _max_workers if _max_workers is not None else os.cpu_count() or 1
+
+
+def map_columns(func: Callable[[str], ResultType], columns: Iterable[str], row_count: int=None, max_workers: int=None) -> dict[str, ResultType]:
+    """Calls func once per column on a thread pool. func must not change shared state; the caller merges the results.
+
+    Args:
+        func (Callable[[str], ResultType]): Computes the result of one column from its name.
+        columns (Iterable[str]): The columns.
+        row_count (int, optional): The number of rows per column. Fewer than MIN_PARALLEL_ROWS runs inline. Defaults to None.
+        max_workers (int, optional): The number of threads. Defaults to None, which uses set_max_workers or one per CPU.
+
+    Returns:
+        dict[str, ResultType]: The result of each column, in the order of columns.
+    """
+    columns = list(columns)
+    worker_count: int = min(len(columns), max_workers or get_max_workers())
+    if worker_count <= 1 or (row_count is not None and row_count < MIN_PARALLEL_ROWS):
+        return {column: func(column) for column in columns}
+
+    with ThreadPoolExecutor(max_workers=worker_count) as executor:
+        # map yields in submission order and raises the first failed column's error
+        return dict(zip(columns, executor.map(func, columns)))
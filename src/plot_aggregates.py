@@ -0,0 +1,81 @@
+# ElPsychicMustache
+# 2024-12-23
+
+# Small aggregates that plots are drawn from, instead of handing the raw columns to matplotlib.
+#   Histograms are counted with one bincount per column and top values are taken from cached value counts,
+#   so the aggregates can be cached on the ColumnProfile and reused for reports and exports.
+
+import numpy as np
+import pandas as pd
+
+from .parallel import map_columns
+
+DEFAULT_BINS: int = 10
+DEFAULT_TOP_N: int = 20
+MAX_LABEL_LENGTH: int = 30
+
+
+def compute_histograms(dataframe: pd.DataFrame, columns: list[str], value_ranges: dict[str, tuple[float, float]]=None, bins: int=DEFAULT_BINS) -> dict[str, tuple[np.ndarray, np.ndarray]]:
+    """Counts equal-width histogram bins for every column, skipping nulls. Columns are counted in parallel.
+
+    Args:
+        dataframe (pd.DataFrame): The dataframe holding the columns.
+        columns (list[str]): The numeric (or boolean) columns.
+        value_ranges (dict[str, tuple[float, float]], optional): Known (min, max) per column, e.g. from a ColumnProfile,
+            so the values do not need to be scanned twice. Defaults to None.
+        bins (int, optional): The number of bins. Defaults to 10.
+
+    Returns:
+        dict[str, tuple[np.ndarray, np.ndarray]]: The (counts, bin edges) of each column.
+    """
+    value_ranges = value_ranges or {}
+    return map_columns(lambda column: _compute_histogram(dataframe[column], value_ranges.get(column), bins), columns, row_count=len(dataframe))
+
+
+def _compute_histogram(column_data: pd.Series, value_range: tuple[float, float]|None, bins: int) -> tuple[np.ndarray, np.ndarray]:
+    values: np.ndarray = column_data.to_numpy(dtype=np.float64, na_value=np.nan)
+    values = values[np.isfinite(values)]
+
+    if value_range is not None:
+        min_value, max_value = (float(value) for value in value_range)
+    elif len(values):
+        min_value, max_value = float(values.min()), float(values.max())
+    else:
+        min_value, max_value = 0.0, 1.0
+
+    if min_value == max_value:
+        # same as numpy: a single value is centered in a unit wide range
+        min_value, max_value = min_value - 0.5, max_value + 0.5
+
+    bin_edges: np.ndarray = np.linspace(min_value, max_value, bins + 1)
+    bin_indexes: np.ndarray = ((values - min_value) * (bins / (max_value - min_value))).astype(np.int64)
+    np.clip(bin_indexes, 0, bins - 1, out=bin_indexes)  # the max value belongs to the last bin
+
+    return np.bincount(bin_indexes, minlength=bins), bin_edges
+
+
+def get_top_values(value_counts: pd.Series, top_n: int=DEFAULT_TOP_N, max_label_length: int=MAX_LABEL_LENGTH) -> pd.Series:
+    """Returns the top_n most common values, with labels longer than max_label_length shortened.
+
+    Args:
+        value_counts (pd.Series): The value counts of a column, sorted descending.
+        top_n (int, optional): How many values to keep. Defaults to 20.
+        max_label_length (int, optional): Longer labels are cut and end with "...". Defaults to 30.
+
+    Returns:
+        pd.Series: The top values.
+    """
+    top_values: pd.Series = value_counts.head(top_n)
+
+    labels: pd.Index = top_values.index.astype(str)
+    too_long: np.ndarray = np.asarray(labels.str.len() > max_label_length)
+    if too_long.any():
+        shortened_labels: pd.Index = labels.str.slice(0, max_label_length - 3) + "..."
+        top_values = top_values.set_axis(labels.where(~too_long, shortened_labels))
+
+    return top_values
+
+
+def histogram_to_dict(histogram: tuple[np.ndarray, np.ndarray]) -> dict[str, list]:
+    counts, bin_edges = histogram
+    return {"counts": counts.tolist(), "bin_edges": bin_edges.tolist()}
@@ -0,0 +1,304 @@
+# ElPsychicMustache
+# 2024-12-14
+
+# Runs the prepare_data steps from a declarative spec instead of prompts, so the same preparation can be replayed on every new file.
+#   The spec is compiled into a plan first: column drops (including "drop_column" null strategies) and renames become one projection,
+#   and every fill is computed and applied as one batch.
+
+import json
+
+import pandas as pd
+
+from .dtype_optimizer import convert_column, propose_dtypes
+from .instrumentation import instrument_step, instrumented
+from .null_imputer import NullImputer, validate_fill_strategy
+from .row_hash_index import RowHashIndex
+from .type_conversion import CONVERSION_TARGETS, convert_columns
+
+SPEC_KEYS: list[str] = ["drop_columns", "rename_columns", "optimize_dtypes", "dtypes", "nulls", "duplicate_subset", "reset_index"]
+NULL_STRATEGIES: list[str] = ["mean", "median", "mode", "ffill", "drop_column", "drop_rows"]
+DTYPE_SHORTCUTS: dict[str, str] = {"datetime": "datetime", "numeric": "numeric", "categorical": "category"}
+
+
+class PreparationPipeline:
+    def __init__(self, spec: dict) -> None:
+        """A non-interactive version of DataframeManager.prepare_data.
+
+        The spec is a dict with any of the following keys (column names after the rename step use the new names):
+            drop_columns (list[str]): Columns to remove.
+            rename_columns (dict[str, str]): Mapping of old column names to new column names.
+            optimize_dtypes (bool): Convert every column to its most compact safe d-type.
+            dtypes (dict[str, str]): "datetime", "numeric", "categorical" or any pandas d-type, per column. Values that cannot
+                be converted to datetime or numeric become null and are listed in conversion_report.
+            nulls (dict[str, str|dict]): "mean", "median", "mode", "ffill", "drop_column", "drop_rows", {"value": fill_value}
+                or a group-wise {"strategy": "mean"|"median"|"mode"|"ffill", "by": column(s)}, per column. See NullImputer.
+            duplicate_subset (list[str]|str): Columns used to remove duplicates (first row kept), or "all" for every column.
+            reset_index (bool): Reset the index at the end.
+
+        Args:
+            spec (dict): The preparation spec.
+        """
+        unknown_keys: list[str] = [key for key in spec if key not in SPEC_KEYS]
+        if unknown_keys:
+            raise ValueError(f"Unknown pipeline spec keys {unknown_keys}. Expected any of {SPEC_KEYS}.")
+
+        for column, strategy in spec.get("nulls", {}).items():
+            if strategy in ("drop_column", "drop_rows"):
+                continue
+            validate_fill_strategy(column, strategy)
+
+        self._spec: dict = spec
+        # fitted by the last run, so its fill values can be reused on new batches of the same data
+        self._null_imputer: NullImputer = None
+        # values of the last run's datetime/numeric conversions that could not be converted
+        self._conversion_report: pd.DataFrame = None
+
+    @classmethod
+    def from_file(cls, file_path: str) -> "PreparationPipeline":
+        """Reads a spec from a json or yaml file.
+
+        Args:
+            file_path (str): Path to a .json, .yaml or .yml file.
+
+        Returns:
+            PreparationPipeline: The pipeline described by the file.
+        """
+        with open(file_path, "r") as spec_file:
+            if file_path.endswith((".yaml", ".yml")):
+                try:
+                    import yaml
+                except ImportError:
+                    raise ImportError("PyYAML is required to read yaml pipeline specs. Install it or use a json spec.")
+                return cls(yaml.safe_load(spec_file) or {})
+            return cls(json.load(spec_file))
+
+    def compile(self, columns: list[str], source_columns: list[str]=None) -> list[tuple[str, object]]:
+        """Turns the spec into the ordered list of operations to run on a dataframe with the given columns.
+
+        Args:
+            columns (list[str]): The columns of the input dataframe.
+            source_columns (list[str], optional): The columns of the file the dataframe was loaded from, when the reader
+                already left out the dropped columns. Defaults to None.
+
+        Returns:
+            list[tuple[str, object]]: The plan, as (operation, argument) pairs.
+        """
+        self._check_columns(list(columns) + [column for column in source_columns or [] if column not in columns])
+        rename_dict: dict[str, str] = self._spec.get("rename_columns", {})
+        original_names: dict[str, str] = {new_name: old_name for old_name, new_name in rename_dict.items()}
+        null_strategies: dict[str, str|dict] = self._spec.get("nulls", {})
+
+        # "drop_column" null strategies are fused into the first projection, so those columns are never converted or filled
+        dropped_after_rename: list[str] = [column for column, strategy in null_strategies.items() if strategy == "drop_column"]
+        columns_to_drop: set[str] = set(self._spec.get("drop_columns", [])) | {original_names.get(column, column) for column in dropped_after_rename}
+
+        kept_columns: list[str] = [column for column in columns if column not in columns_to_drop]
+        new_names: list[str] = [rename_dict.get(column, column) for column in kept_columns]
+
+        plan: list[tuple[str, object]] = []
+        if len(kept_columns) != len(columns) or new_names != kept_columns:
+            plan.append(("project", (kept_columns, new_names)))
+
+        if self._spec.get("optimize_dtypes"):
+            plan.append(("optimize_dtypes", None))
+
+        dtype_changes: dict[str, str] = {column: dtype for column, dtype in self._spec.get("dtypes", {}).items() if column in new_names}
+        if dtype_changes:
+            plan.append(("dtypes", dtype_changes))
+
+        row_drop_columns: list[str] = [column for column, strategy in null_strategies.items() if strategy == "drop_rows" and column in new_names]
+        if row_drop_columns:
+            plan.append(("drop_null_rows", row_drop_columns))
+
+        fill_strategies: dict[str, str|dict] = {column: strategy for column, strategy in null_strategies.items() if strategy not in ("drop_column", "drop_rows") and column in new_names}
+        if fill_strategies:
+            plan.append(("fill_nulls", fill_strategies))
+
+        if self._spec.get("duplicate_subset") is not None:
+            plan.append(("remove_duplicates", self._get_duplicate_subset()))
+
+        if self._spec.get("reset_index"):
+            plan.append(("reset_index", None))
+
+        return plan
+
+    def _check_columns(self, columns: list[str]) -> None:
+        """Raises if the spec names a column the dataframe does not have, so a typo in an unattended spec is not a silent no-op.
+        drop_columns and rename_columns use the names before the rename, dtypes and nulls the names after it. The duplicate
+        subset and the "by" columns of group-wise null strategies are used after the drops, so they must also be kept.
+
+        Args:
+            columns (list[str]): The columns of the input dataframe (or its source file).
+        """
+        rename_dict: dict[str, str] = self._spec.get("rename_columns", {})
+        null_strategies: dict[str, str|dict] = self._spec.get("nulls", {})
+        renamed_columns: set[str] = {rename_dict.get(column, column) for column in columns}
+        dropped_columns: set[str] = {rename_dict.get(column, column) for column in self._spec.get("drop_columns", [])}
+        dropped_columns |= {column for column, strategy in null_strategies.items() if strategy == "drop_column"}
+
+        group_columns: list[str] = []
+        for strategy in null_strategies.values():
+            if isinstance(strategy, dict) and "by" in strategy:
+                group_columns += [strategy["by"]] if isinstance(strategy["by"], str) else list(strategy["by"])
+
+        unknown_columns: list[str] = [column for column in list(self._spec.get("drop_columns", [])) + list(rename_dict) if column not in columns]
+        unknown_columns += [column for column in list(self._spec.get("dtypes", {})) + list(null_strategies) if column not in renamed_columns]
+        unknown_columns += [column for column in (self._get_duplicate_subset() or []) + group_columns if column not in renamed_columns or column in dropped_columns]
+        if unknown_columns:
+            renamed_note: str = f" ({[rename_dict.get(column, column) for column in columns]} after the rename)" if rename_dict else ""
+            raise ValueError(f"The pipeline spec refers to columns that do not exist or are dropped: {list(dict.fromkeys(unknown_columns))}. The columns are {list(columns)}{renamed_note}.")
+
+    def _get_duplicate_subset(self) -> list[str]|None:
+        # a single column may be given as a string, "all" (or no subset) uses every column
+        duplicate_subset: list[str]|str|None = self._spec.get("duplicate_subset")
+        if duplicate_subset is None or duplicate_subset == "all":
+            return None
+        return [duplicate_subset] if isinstance(duplicate_subset, str) else list(duplicate_subset)
+
+    def read_options(self, columns: list[str]) -> dict[str, object]:
+        """Works out which parts of the plan can be pushed into the csv reader, so dropped columns are never parsed and
+        d-type conversions happen while parsing. Names are the original csv column names.
+
+        Args:
+            columns (list[str]): The columns of the csv file.
+
+        Returns:
+            dict[str, object]: The "usecols", "dtypes" and "date_columns" to load the file with.
+        """
+        plan: dict[str, object] = dict(self.compile(columns))
+        original_names: dict[str, str] = {new_name: old_name for old_name, new_name in self._spec.get("rename_columns", {}).items()}
+
+        usecols: list[str]|None = plan["project"][0] if "project" in plan else None
+
+        dtypes: dict[str, str] = {}
+        date_columns: list[str] = []
+        for column, dtype in plan.get("dtypes", {}).items():
+            dtype = DTYPE_SHORTCUTS.get(dtype, dtype)
+            if dtype == "datetime":
+                date_columns.append(original_names.get(column, column))
+            elif dtype != "numeric":
+                # "numeric" stays a post-load pd.to_numeric, since the reader's dtype would not match its semantics
+                dtypes[original_names.get(column, column)] = dtype
+
+        return {"usecols": usecols, "dtypes": dtypes or None, "date_columns": date_columns or None}
+
+    def explain(self, columns: list[str], source_columns: list[str]=None) -> None:
+        """Prints the compiled plan for a dataframe with the given columns.
+
+        Args:
+            columns (list[str]): The columns of the input dataframe.
+            source_columns (list[str], optional): The columns of the file the dataframe was loaded from. Defaults to None.
+        """
+        print("======= Preparation plan =======")
+        for index, (operation, argument) in enumerate(self.compile(columns, source_columns)):
+            print(f"{index + 1}: {operation} {argument if argument is not None else ''}")
+
+    @instrumented("pipeline.run")
+    def run(self, dataframe: pd.DataFrame, source_columns: list[str]=None) -> pd.DataFrame:
+        """Compiles the spec for the dataframe and runs every operation without prompting.
+
+        Args:
+            dataframe (pd.DataFrame): The dataframe to prepare.
+            source_columns (list[str], optional): The columns of the file the dataframe was loaded from, when the reader
+                already left out the dropped columns. Defaults to None.
+
+        Returns:
+            pd.DataFrame: The prepared dataframe.
+        """
+        operation_funcs: dict[str, callable] = {
+            "project": self._project,
+            "optimize_dtypes": self._optimize_dtypes,
+            "dtypes": self._change_dtypes,
+            "drop_null_rows": self._drop_null_rows,
+            "fill_nulls": self._fill_nulls,
+            "remove_duplicates": self._remove_duplicates,
+            "reset_index": self._reset_index,
+        }
+
+        for operation, argument in self.compile(list(dataframe.columns), source_columns):
+            print(f"[!] Running {operation} ...")
+            with instrument_step(f"pipeline.{operation}", lambda: dataframe):
+                dataframe = operation_funcs[operation](dataframe, argument)
+
+        print("[+] Pipeline finished!")
+        return dataframe
+
+    # Operation suite
+    def _project(self, dataframe: pd.DataFrame, columns: tuple[list[str], list[str]]) -> pd.DataFrame:
+        kept_columns, new_names = columns
+        return dataframe.loc[:, kept_columns].set_axis(new_names, axis=1)
+
+    def _optimize_dtypes(self, dataframe: pd.DataFrame, _: None) -> pd.DataFrame:
+        proposals: dict[str, str] = propose_dtypes(dataframe)
+        return dataframe.assign(**{column: convert_column(dataframe[column], dtype) for column, dtype in proposals.items()})
+
+    def _change_dtypes(self, dataframe: pd.DataFrame, dtype_changes: dict[str, str]) -> pd.DataFrame:
+        conversions: dict[str, str] = {}
+        astype_changes: dict[str, str] = {}
+
+        for column, dtype in dtype_changes.items():
+            dtype = DTYPE_SHORTCUTS.get(dtype, dtype)
+            if self._has_dtype(dataframe[column], dtype):
+                continue  # already converted while the file was read
+            if dtype in CONVERSION_TARGETS:
+                conversions[column] = dtype
+            else:
+                astype_changes[column] = dtype
+
+        if astype_changes:
+            dataframe = dataframe.astype(astype_changes)
+        if conversions:
+            dataframe, self._conversion_report = convert_columns(dataframe, conversions)
+            failed_report: pd.DataFrame = self._conversion_report[self._conversion_report["failed"] > 0]
+            if not failed_report.empty:
+                print(f"[-] Some values could not be converted and were set to null: \n{failed_report[['target', 'failed', 'examples']]}")
+        return dataframe
+
+    def _has_dtype(self, column_data: pd.Series, dtype: str) -> bool:
+        if dtype == "datetime":
+            return pd.api.types.is_datetime64_any_dtype(column_data.dtype)
+        if dtype == "numeric":
+            return pd.api.types.is_numeric_dtype(column_data.dtype)
+        return str(column_data.dtype) == dtype
+
+    def _drop_null_rows(self, dataframe: pd.DataFrame, columns: list[str]) -> pd.DataFrame:
+        return dataframe.dropna(subset=columns)
+
+    def _fill_nulls(self, dataframe: pd.DataFrame, fill_strategies: dict[str, str|dict]) -> pd.DataFrame:
+        self._null_imputer = NullImputer(fill_strategies)
+        return self._null_imputer.fit_transform(dataframe)
+
+    def _remove_duplicates(self, dataframe: pd.DataFrame, subset_list: list[str]|None) -> pd.DataFrame:
+        return dataframe.loc[RowHashIndex(dataframe).keep_first_mask(subset_list)]
+
+    def _reset_index(self, dataframe: pd.DataFrame, _: None) -> pd.DataFrame:
+        return dataframe.reset_index(drop=True)
+    # End operation suite
+
+    @property
+    def spec(self) -> dict:
+        return self._spec
+
+    @property
+    def null_imputer(self) -> NullImputer|None:
+        return self._null_imputer
+
+    @property
+    def conversion_report(self) -> pd.DataFrame|None:
+        return self._conversion_report
+
+
+def load_pipeline(pipeline: PreparationPipeline|dict|str) -> PreparationPipeline:
+    """Returns a PreparationPipeline from a pipeline, spec dict or path to a json/yaml spec.
+
+    Args:
+        pipeline (PreparationPipeline|dict|str): The pipeline or its spec.
+
+    Returns:
+        PreparationPipeline: The pipeline.
+    """
+    if isinstance(pipeline, dict):
+        return PreparationPipeline(pipeline)
+    if isinstance(pipeline, str):
+        return PreparationPipeline.from_file(pipeline)
+    return pipeline
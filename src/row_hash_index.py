@@ -0,0 +1,243 @@
+# ElPsychicMustache
+# 2024-12-06
+
+# Factorizes each column once and combines the column codes into one group id per row for a subset of columns.
+#   Rows with the same group id are duplicates, so counts, groups, examples and the keep-first mask all come from one array.
+#   Column codes are cached, so trying a different subset only combines codes instead of rehashing the data.
+#   Appended rows are encoded against the cached codes and groups, so only the new rows are hashed.
+#   DuplicateIndex holds the group queries shared with FuzzyDuplicateIndex; RowHashIndex adds appending rows.
+
+import numpy as np
+import pandas as pd
+
+_MAX_COMBINED_SIZE: int = 2**63 - 1
+
+
+class DuplicateIndex:
+    def __init__(self, dataframe: pd.DataFrame) -> None:
+        """The duplicate queries of a dataframe, computed lazily per column and per subset from one group id per row.
+        Rows are grouped by exact equality; subclasses change how group ids are computed in _combine_column_codes.
+
+        Args:
+            dataframe (pd.DataFrame): The dataframe to index.
+        """
+        self._dataframe = dataframe
+        self._column_codes: dict[str, tuple[np.ndarray, int]] = {}
+        self._column_uniques: dict[str, pd.Index] = {}
+        self._subset_group_ids: dict[tuple[str, ...], np.ndarray] = {}
+
+    def group_ids(self, subset_list: list[str]=None) -> np.ndarray:
+        """Returns a group id for every row. Rows share an id when they are equal on every column of the subset.
+        Ids are numbered in order of first appearance.
+
+        Args:
+            subset_list (list[str], optional): The columns to consider duplicates. Defaults to None, which uses all columns.
+
+        Returns:
+            np.ndarray: The group id of each row.
+        """
+        subset_key: tuple[str, ...] = self._get_subset_key(subset_list)
+
+        if subset_key not in self._subset_group_ids:
+            self._subset_group_ids[subset_key] = self._combine_column_codes(subset_key)
+
+        return self._subset_group_ids[subset_key]
+
+    def duplicate_mask(self, subset_list: list[str]=None) -> np.ndarray:
+        """Returns True for every row that has at least one duplicate (same as duplicated(keep=False)).
+
+        Args:
+            subset_list (list[str], optional): The columns to consider duplicates. Defaults to None.
+
+        Returns:
+            np.ndarray: Boolean mask of duplicated rows.
+        """
+        group_ids: np.ndarray = self.group_ids(subset_list)
+        return np.bincount(group_ids)[group_ids] > 1
+
+    def duplicate_count(self, subset_list: list[str]=None) -> int:
+        return int(self.duplicate_mask(subset_list).sum())
+
+    def duplicate_groups(self, subset_list: list[str]=None) -> pd.Series:
+        """Returns the group id of every duplicated row, indexed like the dataframe.
+
+        Args:
+            subset_list (list[str], optional): The columns to consider duplicates. Defaults to None.
+
+        Returns:
+            pd.Series: The group id of each duplicated row.
+        """
+        duplicate_mask: np.ndarray = self.duplicate_mask(subset_list)
+        return pd.Series(self.group_ids(subset_list)[duplicate_mask], index=self._dataframe.index[duplicate_mask], name="duplicate_group")
+
+    def example_group(self, subset_list: list[str]=None) -> pd.DataFrame:
+        """Returns every row of the first duplicate group found in the dataframe.
+
+        Args:
+            subset_list (list[str], optional): The columns to consider duplicates. Defaults to None.
+
+        Returns:
+            pd.DataFrame: The rows of the example group, or an empty dataframe when there are no duplicates.
+        """
+        duplicate_positions: np.ndarray = np.flatnonzero(self.duplicate_mask(subset_list))
+        if len(duplicate_positions) == 0:
+            return self._dataframe.iloc[0:0]
+
+        group_ids: np.ndarray = self.group_ids(subset_list)
+        return self._dataframe.iloc[np.flatnonzero(group_ids == group_ids[duplicate_positions[0]])]
+
+    def keep_first_mask(self, subset_list: list[str]=None) -> np.ndarray:
+        """Returns True for the first row of every group (same rows drop_duplicates(keep="first") keeps).
+
+        Args:
+            subset_list (list[str], optional): The columns to consider duplicates. Defaults to None.
+
+        Returns:
+            np.ndarray: Boolean mask of rows to keep.
+        """
+        group_ids: np.ndarray = self.group_ids(subset_list)
+        if len(group_ids) == 0:
+            return np.zeros(0, dtype=bool)
+
+        # ids are numbered in order of first appearance, so a row is the first of its group when its id is larger than every id before it
+        previous_max: np.ndarray = np.maximum.accumulate(group_ids)[:-1]
+        return np.concatenate(([True], group_ids[1:] > previous_max))
+
+    def set_dataframe(self, dataframe: pd.DataFrame) -> None:
+        """Points the index at a dataframe with the same rows in the same order, e.g. after the index labels were reset.
+
+        Args:
+            dataframe (pd.DataFrame): The new dataframe.
+        """
+        self._dataframe = dataframe
+
+    def _combine_column_codes(self, subset_key: tuple[str, ...]) -> np.ndarray:
+        if not subset_key:
+            return np.zeros(len(self._dataframe), dtype=np.int64)
+
+        combined_codes, combined_size = self._get_column_codes(subset_key[0])
+
+        for column in subset_key[1:]:
+            codes, cardinality = self._get_column_codes(column)
+            if combined_size * cardinality > _MAX_COMBINED_SIZE:
+                # compress the codes so far before they can overflow int64
+                combined_codes, uniques = pd.factorize(combined_codes)
+                combined_size = len(uniques)
+            combined_codes = combined_codes * cardinality + codes
+            combined_size *= cardinality
+
+        group_ids, _ = pd.factorize(combined_codes)
+        return group_ids.astype(np.int64, copy=False)
+
+    def _get_column_codes(self, column: str) -> tuple[np.ndarray, int]:
+        if column not in self._column_codes:
+            # nulls get their own code, since duplicated() treats nulls as equal to each other
+            codes, uniques = pd.factorize(self._dataframe[column], use_na_sentinel=False)
+            self._column_codes[column] = (codes.astype(np.int64, copy=False), max(len(uniques), 1))
+            self._column_uniques[column] = pd.Index(uniques)
+        return self._column_codes[column]
+
+    def _get_subset_key(self, subset_list: list[str]=None) -> tuple[str, ...]:
+        if subset_list is None:
+            return tuple(self._dataframe.columns)
+        return tuple(subset_list)
+
+    @property
+    def dataframe(self) -> pd.DataFrame:
+        return self._dataframe
+
+
+class RowHashIndex(DuplicateIndex):
+    def __init__(self, dataframe: pd.DataFrame) -> None:
+        """Builds exact duplicate lookups for a dataframe lazily, per column and per subset, and extends them when rows are
+        appended.
+
+        Args:
+            dataframe (pd.DataFrame): The dataframe to index.
+        """
+        super().__init__(dataframe)
+        # the code combination of every group (in group id order) and the position of its first row, built on the first append
+        self._subset_groups: dict[tuple[str, ...], tuple[pd.MultiIndex, np.ndarray]] = {}
+
+    def appended_duplicates(self, start: int, subset_list: list[str]=None) -> pd.DataFrame:
+        """Finds the rows from position start on that repeat an earlier row, e.g. the rows of the last append.
+
+        Args:
+            start (int): The position of the first new row.
+            subset_list (list[str], optional): The columns to consider duplicates. Defaults to None.
+
+        Returns:
+            pd.DataFrame: One row per repeated new row, indexed like the dataframe, with the index label of the first row of
+                its group ("duplicate_of") and whether that row came before start ("matches_history").
+        """
+        group_ids: np.ndarray = self.group_ids(subset_list)
+        _, first_positions = self._get_subset_groups(self._get_subset_key(subset_list))
+
+        group_first_positions: np.ndarray = first_positions[group_ids[start:]]
+        repeated_positions: np.ndarray = start + np.flatnonzero(group_first_positions < np.arange(start, len(group_ids)))
+        original_positions: np.ndarray = first_positions[group_ids[repeated_positions]]
+
+        return pd.DataFrame(
+            {"duplicate_of": self._dataframe.index[original_positions], "matches_history": original_positions < start},
+            index=self._dataframe.index[repeated_positions],
+        )
+
+    def append(self, new_rows: pd.DataFrame, dataframe: pd.DataFrame) -> None:
+        """Extends the cached column codes and group ids with rows appended to the end of the dataframe.
+        Only the new rows are hashed; existing rows keep their codes and ids.
+
+        Args:
+            new_rows (pd.DataFrame): The appended rows.
+            dataframe (pd.DataFrame): The dataframe including the appended rows.
+        """
+        row_count: int = len(self._dataframe)
+        for subset_key in self._subset_group_ids:
+            self._get_subset_groups(subset_key)  # group keys are read from the codes of the existing rows
+
+        for column in self._column_codes:
+            self._append_column_codes(column, new_rows[column])
+        self._dataframe = dataframe
+
+        for subset_key, group_ids in self._subset_group_ids.items():
+            self._subset_group_ids[subset_key] = np.concatenate((group_ids, self._append_group_ids(subset_key, row_count)))
+
+    def _append_column_codes(self, column: str, new_values: pd.Series) -> None:
+        codes, _ = self._column_codes[column]
+        uniques: pd.Index = self._column_uniques[column]
+
+        new_codes: np.ndarray = uniques.get_indexer(new_values).astype(np.int64, copy=False)
+        unseen_mask: np.ndarray = new_codes == -1
+        if unseen_mask.any():
+            # values not seen before are numbered after the existing ones, in order of first appearance
+            unseen_codes, unseen_uniques = pd.factorize(new_values[unseen_mask], use_na_sentinel=False)
+            new_codes[unseen_mask] = len(uniques) + unseen_codes
+            uniques = uniques.append(pd.Index(unseen_uniques))
+
+        self._column_codes[column] = (np.concatenate((codes, new_codes)), max(len(uniques), 1))
+        self._column_uniques[column] = uniques
+
+    def _append_group_ids(self, subset_key: tuple[str, ...], start: int) -> np.ndarray:
+        new_row_count: int = len(self._dataframe) - start
+        if not subset_key:
+            return np.zeros(new_row_count, dtype=np.int64)
+
+        group_keys, first_positions = self._subset_groups[subset_key]
+        new_keys: pd.MultiIndex = pd.MultiIndex.from_arrays([self._get_column_codes(column)[0][start:] for column in subset_key])
+
+        new_group_ids: np.ndarray = group_keys.get_indexer(new_keys).astype(np.int64, copy=False)
+        unseen_positions: np.ndarray = np.flatnonzero(new_group_ids == -1)
+        if len(unseen_positions):
+            unseen_group_ids, unseen_keys = pd.factorize(new_keys[unseen_positions])
+            new_group_ids[unseen_positions] = len(group_keys) + unseen_group_ids
+            # factorize numbers groups in order of first appearance, so the first row of each new group is where its id first shows up
+            _, first_indexes = np.unique(unseen_group_ids, return_index=True)
+            self._subset_groups[subset_key] = (group_keys.append(unseen_keys), np.concatenate((first_positions, start + unseen_positions[first_indexes])))
+
+        return new_group_ids
+
+    def _get_subset_groups(self, subset_key: tuple[str, ...]) -> tuple[pd.MultiIndex, np.ndarray]:
+        if subset_key not in self._subset_groups:
+            first_positions: np.ndarray = np.flatnonzero(self.keep_first_mask(list(subset_key)))
+            group_keys: pd.MultiIndex = pd.MultiIndex.from_arrays([self._get_column_codes(column)[0][first_positions] for column in subset_key]) if subset_key else None
+            self._subset_groups[subset_key] = (group_keys, first_positions)
+        return self._subset_groups[subset_key]
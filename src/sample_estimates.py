@@ -0,0 +1,91 @@
+# ElPsychicMustache
+# 2025-01-12
+
+# Estimates full-data statistics from a row sample, so a first look at a huge file does not need the whole file loaded.
+#   Null percentages get Wilson score intervals, which stay inside [0, 1] even for rare or very common nulls, and means get
+#   normal intervals. Both shrink with the finite population correction as the sample approaches the whole file.
+
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from .column_profile import ColumnProfile
+
+
+def get_z_value(confidence: float) -> float:
+    """Returns the two-sided standard normal quantile of a confidence level, e.g. 1.96 for 0.95.
+
+    Args:
+        confidence (float): The confidence level, between 0 and 1.
+
+    Returns:
+        float: The z value.
+    """
+    if not 0 < confidence < 1:
+        raise ValueError(f"confidence must be between 0 and 1, got {confidence}.")
+    return NormalDist().inv_cdf(0.5 + confidence / 2)
+
+
+def null_ratio_intervals(profile: ColumnProfile, population_rows: int, confidence: float=0.95) -> pd.DataFrame:
+    """Estimates the null ratio of every column of the full data from the profile of a sample.
+
+    Args:
+        profile (ColumnProfile): The profile of the sampled rows.
+        population_rows (int): The (estimated) number of rows of the full data.
+        confidence (float, optional): The confidence level of the intervals. Defaults to 0.95.
+
+    Returns:
+        pd.DataFrame: The sampled null ratio and the lower and upper bound of its interval ("null_ratio", "lower", "upper"), per column.
+    """
+    sample_rows: int = len(profile.dataframe)
+    z_value: float = get_z_value(confidence) * _finite_population_correction(sample_rows, population_rows)
+
+    null_ratios: pd.Series = profile.null_counts() / sample_rows if sample_rows else profile.null_counts().astype(np.float64)
+    lower, upper = _wilson_interval(null_ratios.to_numpy(dtype=np.float64), sample_rows, z_value)
+    return pd.DataFrame({"null_ratio": null_ratios, "lower": lower, "upper": upper}, index=null_ratios.index)
+
+
+def mean_intervals(profile: ColumnProfile, population_rows: int, confidence: float=0.95) -> pd.DataFrame:
+    """Estimates the mean of every numeric column of the full data from the profile of a sample.
+
+    Args:
+        profile (ColumnProfile): The profile of the sampled rows.
+        population_rows (int): The (estimated) number of rows of the full data.
+        confidence (float, optional): The confidence level of the intervals. Defaults to 0.95.
+
+    Returns:
+        pd.DataFrame: The sampled mean and the lower and upper bound of its interval ("mean", "lower", "upper"), per numeric column.
+    """
+    sample_rows: int = len(profile.dataframe)
+    profile.compute()
+    z_value: float = get_z_value(confidence)
+
+    intervals: dict[str, dict[str, float]] = {}
+    for column in profile.dataframe.columns:
+        column_stats: dict[str, object] = profile.get_column_stats(column)
+        if "mean" not in column_stats:
+            continue
+        count: int = column_stats["count"]
+        # the non-null values of the full data are estimated from the sampled null ratio
+        population_count: float = population_rows * count / sample_rows if sample_rows else 0.0
+        margin: float = z_value * column_stats["std"] / np.sqrt(count) * _finite_population_correction(count, population_count) if count > 1 else np.nan
+        intervals[column] = {"mean": column_stats["mean"], "lower": column_stats["mean"] - margin, "upper": column_stats["mean"] + margin}
+
+    return pd.DataFrame.from_dict(intervals, orient="index", columns=["mean", "lower", "upper"])
+
+
+def _wilson_interval(ratios: np.ndarray, sample_rows: int, z_value: float) -> tuple[np.ndarray, np.ndarray]:
+    if sample_rows == 0:
+        return np.full(len(ratios), np.nan), np.full(len(ratios), np.nan)
+    z_squared: float = z_value**2
+    center: np.ndarray = (ratios + z_squared / (2 * sample_rows)) / (1 + z_squared / sample_rows)
+    margin: np.ndarray = z_value / (1 + z_squared / sample_rows) * np.sqrt(ratios * (1 - ratios) / sample_rows + z_squared / (4 * sample_rows**2))
+    return np.clip(center - margin, 0, 1), np.clip(center + margin, 0, 1)
+
+
+def _finite_population_correction(sample_count: float, population_count: float) -> float:
+    # a sample of the whole data has no sampling error left
+    if population_count <= 1 or sample_count >= population_count:
+        return 0.0
+    return float(np.sqrt((population_count - sample_count) / (population_count - 1)))
@@ -0,0 +1,239 @@
+# ElPsychicMustache
+# 2024-12-30
+
+# Fixed-size summaries of a column that are updated one chunk at a time and can be merged, so files that do not fit in memory
+#   can be profiled chunk by chunk, file by file or worker by worker, and the partial results combined afterwards.
+#   Every sketch states its error: a rank error for quantiles, a relative error for distinct counts and an absolute
+#   undercount for value frequencies.
+
+import math
+
+import numpy as np
+import pandas as pd
+
+
+class QuantileSketch:
+    def __init__(self, k: int=200, seed: int=0) -> None:
+        """A KLL style quantile sketch. Values are kept in levels of sorted compactors, where an item on level h stands for
+        2**h input values. A full level is sorted and every other item (from a random offset) is promoted to the next level.
+
+        Args:
+            k (int, optional): Size of the top compactor. Larger is more accurate and uses more memory. Defaults to 200.
+            seed (int, optional): Seed of the compaction offsets, so results are reproducible. Defaults to 0.
+        """
+        if k < 2:
+            raise ValueError(f"k must be at least 2, but got {k}.")
+
+        self._k = k
+        self._levels: list[np.ndarray] = [np.empty(0, dtype=np.float64)]
+        self._rng: np.random.Generator = np.random.default_rng(seed)
+        self.count: int = 0
+
+    def update(self, values: np.ndarray) -> None:
+        """Adds values to the sketch. NaN values are ignored.
+
+        Args:
+            values (np.ndarray): The values of one chunk.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+
+        self._levels[0] = np.concatenate([self._levels[0], values])
+        self.count += len(values)
+        self._compress()
+
+    def merge(self, other: "QuantileSketch") -> None:
+        """Adds every value summarized by another sketch to this one.
+
+        Args:
+            other (QuantileSketch): A sketch with the same k.
+        """
+        if other._k != self._k:
+            raise ValueError(f"Cannot merge quantile sketches with different k ({self._k} and {other._k}).")
+
+        for level, items in enumerate(other._levels):
+            if level == len(self._levels):
+                self._levels.append(np.empty(0, dtype=np.float64))
+            self._levels[level] = np.concatenate([self._levels[level], items])
+        self.count += other.count
+        self._compress()
+
+    def quantile(self, quantiles: float|list[float]) -> float|np.ndarray:
+        """Returns the approximate value at each quantile.
+
+        Args:
+            quantiles (float|list[float]): Quantiles between 0 and 1.
+
+        Returns:
+            float|np.ndarray: The value at each quantile, NaN if the sketch is empty.
+        """
+        is_scalar: bool = np.isscalar(quantiles)
+        quantiles = np.atleast_1d(np.asarray(quantiles, dtype=np.float64))
+        if self.count == 0:
+            result: np.ndarray = np.full(len(quantiles), np.nan)
+            return result[0] if is_scalar else result
+
+        items: np.ndarray = np.concatenate(self._levels)
+        weights: np.ndarray = np.concatenate([np.full(len(level_items), 2**level, dtype=np.int64) for level, level_items in enumerate(self._levels)])
+
+        order: np.ndarray = np.argsort(items, kind="stable")
+        cumulative_weights: np.ndarray = np.cumsum(weights[order])
+        positions: np.ndarray = np.searchsorted(cumulative_weights, quantiles * cumulative_weights[-1], side="left")
+
+        result = items[order][np.minimum(positions, len(items) - 1)]
+        return result[0] if is_scalar else result
+
+    def _compress(self) -> None:
+        # compacting the lowest level that is over capacity until none are, each compaction halves that level
+        while True:
+            full_levels: list[int] = [level for level, items in enumerate(self._levels) if len(items) > self._capacity(level)]
+            if not full_levels:
+                return
+            level: int = full_levels[0]
+            if level + 1 == len(self._levels):
+                self._levels.append(np.empty(0, dtype=np.float64))
+
+            items: np.ndarray = np.sort(self._levels[level])
+            # an odd item stays behind, so the total weight is unchanged
+            leftover: np.ndarray = items[len(items) - len(items) % 2:]
+            promoted: np.ndarray = items[self._rng.integers(2):len(items) - len(items) % 2:2]
+
+            self._levels[level] = leftover
+            self._levels[level + 1] = np.concatenate([self._levels[level + 1], promoted])
+
+    def _capacity(self, level: int) -> int:
+        # lower levels hold less, shrinking by 2/3 per level below the top
+        depth: int = len(self._levels) - level - 1
+        return max(int(math.ceil(self._k * (2 / 3) ** depth)), 2)
+
+    @property
+    def rank_error(self) -> float:
+        """The approximate normalized rank error: a returned value's true quantile is usually within this of the requested one.
+        """
+        return 1.7 / self._k
+
+    @property
+    def size(self) -> int:
+        return sum(len(items) for items in self._levels)
+
+
+class DistinctCountSketch:
+    def __init__(self, precision: int=12) -> None:
+        """A HyperLogLog distinct count over 64 bit hashes, using 2**precision one byte registers.
+
+        Args:
+            precision (int, optional): Number of hash bits that pick a register, between 4 and 18. Defaults to 12 (4 KB, about 1.6% error).
+        """
+        if not 4 <= precision <= 18:
+            raise ValueError(f"precision must be between 4 and 18, but got {precision}.")
+
+        self._precision = precision
+        self._registers: np.ndarray = np.zeros(2**precision, dtype=np.uint8)
+
+    def update(self, hashes: np.ndarray) -> None:
+        """Adds hashed values to the sketch.
+
+        Args:
+            hashes (np.ndarray): uint64 hashes of the values, e.g. from pd.util.hash_pandas_object.
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        remaining_bits: int = 64 - self._precision
+
+        register_index: np.ndarray = (hashes >> np.uint64(remaining_bits)).astype(np.intp)
+        remaining: np.ndarray = hashes & np.uint64((1 << remaining_bits) - 1)
+        # frexp gives the bit length of each integer, the rank is the position of the first set bit
+        bit_lengths: np.ndarray = np.frexp(remaining.astype(np.float64))[1]
+        ranks: np.ndarray = np.clip(remaining_bits - bit_lengths + 1, 1, remaining_bits + 1).astype(np.uint8)
+
+        np.maximum.at(self._registers, register_index, ranks)
+
+    def merge(self, other: "DistinctCountSketch") -> None:
+        if other._precision != self._precision:
+            raise ValueError(f"Cannot merge distinct count sketches with different precision ({self._precision} and {other._precision}).")
+        np.maximum(self._registers, other._registers, out=self._registers)
+
+    def estimate(self) -> int:
+        """Returns the estimated number of distinct values.
+
+        Returns:
+            int: The estimate.
+        """
+        register_count: int = len(self._registers)
+        alpha: float = 0.7213 / (1 + 1.079 / register_count)
+        estimate: float = alpha * register_count**2 / np.sum(np.ldexp(1.0, -self._registers.astype(np.int64)))
+
+        empty_registers: int = int(np.count_nonzero(self._registers == 0))
+        if estimate <= 2.5 * register_count and empty_registers:
+            # linear counting is more accurate for small cardinalities
+            estimate = register_count * math.log(register_count / empty_registers)
+        return int(round(estimate))
+
+    @property
+    def relative_error(self) -> float:
+        """The standard error of the estimate relative to the true distinct count.
+        """
+        return 1.04 / math.sqrt(len(self._registers))
+
+
+class HeavyHitterSketch:
+    def __init__(self, capacity: int=100) -> None:
+        """A Misra-Gries summary that keeps at most capacity value counts. Every kept count is an undercount by at most
+        frequency_error, which is never more than total / (capacity + 1), so every value more common than that is kept.
+
+        Args:
+            capacity (int, optional): The maximum number of counters. Defaults to 100.
+        """
+        if capacity < 1:
+            raise ValueError(f"capacity must be at least 1, but got {capacity}.")
+
+        self._capacity = capacity
+        self._counts: pd.Series = pd.Series(dtype=np.int64)
+        self.total: int = 0
+        self.frequency_error: int = 0
+
+    def update(self, values: pd.Series) -> None:
+        """Adds the values of one chunk. Nulls are ignored.
+
+        Args:
+            values (pd.Series): The values.
+        """
+        # the exact counts of a chunk are a summary with no error, so a chunk is merged like any other summary
+        chunk_counts: pd.Series = values.value_counts(dropna=True)
+        self._merge_counts(chunk_counts, int(chunk_counts.sum()))
+
+    def merge(self, other: "HeavyHitterSketch") -> None:
+        self._merge_counts(other._counts, other.total)
+        self.frequency_error += other.frequency_error
+
+    def top(self, top_n: int=None) -> pd.Series:
+        """Returns the most common values with their (under)estimated counts, sorted descending.
+
+        Args:
+            top_n (int, optional): How many values to return. Defaults to None, every kept value.
+
+        Returns:
+            pd.Series: The counts.
+        """
+        return self._counts if top_n is None else self._counts.head(top_n)
+
+    def relabel(self, labels: pd.Index) -> None:
+        """Replaces the kept values, e.g. numbers by their text, adding up the counts of values that get the same label.
+
+        Args:
+            labels (pd.Index): The new label of each kept value, in the order of top().
+        """
+        if self._counts.empty:
+            return
+        self._counts = self._counts.groupby(labels, sort=False).sum().astype(np.int64).sort_values(ascending=False, kind="stable")
+
+    def _merge_counts(self, counts: pd.Series, total: int) -> None:
+        combined: pd.Series = counts.astype(np.int64) if self._counts.empty else self._counts.add(counts, fill_value=0).astype(np.int64)
+        self.total += total
+
+        if len(combined) > self._capacity:
+            # subtracting the (capacity + 1)th largest count from every counter leaves at most capacity positive counters
+            threshold: int = int(combined.nlargest(self._capacity + 1).iloc[-1])
+            combined = combined[combined > threshold] - threshold
+            self.frequency_error += threshold
+
+        self._counts = combined.sort_values(ascending=False, kind="stable")
@@ -0,0 +1,190 @@
+# ElPsychicMustache
+# 2024-12-09
+
+# Removes duplicate rows from a csv that is too large to load, by reading it chunk by chunk and only remembering the keys already seen.
+#   Rows are compared on the raw text of the subset columns, with every default null spelling treated as the same null, and the
+#   first occurrence of each key is kept, like DuplicateAnalyzer._remove_duplicates. The original text is written unchanged.
+
+import math
+import os
+import sqlite3
+import tempfile
+
+import numpy as np
+import pandas as pd
+# the text pd.read_csv reads as null by default, e.g. "", "NA", "NaN" and "null"
+from pandas._libs.parsers import STR_NA_VALUES
+
+from .validate_input import validate_argument
+
+_KEY_SEPARATOR: str = "\x1f"
+# every null spelling gets this key, since a frame loaded with the default null parsing sees them all as the same null
+_NULL_KEY: str = "\x00"
+
+
+def deduplicate_csv(input_path: str, output_path: str, subset_list: list[str]=None, chunk_size: int=100_000, mode: str="exact", spill_directory: str=None, expected_rows: int=10_000_000, false_positive_rate: float=0.001) -> int:
+    """Writes a copy of a csv file without duplicate rows, keeping the first row of each duplicate group.
+
+    Args:
+        input_path (str): The csv file to deduplicate.
+        output_path (str): Where to write the deduplicated csv.
+        subset_list (list[str], optional): The columns to consider duplicates. Defaults to None, which uses all columns.
+        chunk_size (int, optional): Number of rows to read per chunk. Defaults to 100_000.
+        mode (str, optional): Can be "exact" or "approximate". "exact" keeps the seen keys in an on-disk sqlite table.
+            "approximate" keeps row hashes in a fixed-size bloom filter; it never keeps a duplicate, but may drop a unique row
+            with probability false_positive_rate. Defaults to "exact".
+        spill_directory (str, optional): Directory for the "exact" mode key table. Defaults to None, the system temp directory.
+        expected_rows (int, optional): Number of distinct rows the bloom filter is sized for in "approximate" mode. Defaults to 10_000_000.
+        false_positive_rate (float, optional): Target false positive rate of the bloom filter. Defaults to 0.001.
+
+    Returns:
+        int: The number of rows written to output_path.
+    """
+    validate_argument(valid_arg_options=["exact", "approximate"], user_input=mode, parameter_name="mode")
+
+    if mode == "exact":
+        seen_keys: SqliteKeyStore|BloomFilter = SqliteKeyStore(spill_directory)
+    else:
+        seen_keys = BloomFilter(expected_rows=expected_rows, false_positive_rate=false_positive_rate)
+        print(f"[!] Bloom filter uses {seen_keys.size_mb:.2f} MB.")
+
+    rows_read: int = 0
+    rows_written: int = 0
+
+    try:
+        # reading everything as text keeps the output identical to the input and makes keys comparable across chunks
+        chunks = pd.read_csv(input_path, chunksize=chunk_size, dtype=str, keep_default_na=False)
+        for index, chunk in enumerate(chunks):
+            keys: pd.Series = _build_keys(chunk, subset_list)
+            first_in_chunk: np.ndarray = ~keys.duplicated().to_numpy()
+
+            unique_keys: pd.Series = keys[first_in_chunk]
+            is_new: np.ndarray = seen_keys.add_and_check_new(unique_keys)
+
+            keep_mask: np.ndarray = first_in_chunk.copy()
+            keep_mask[first_in_chunk] = is_new
+
+            chunk.loc[keep_mask].to_csv(output_path, mode="w" if index == 0 else "a", header=index == 0, index=False)
+
+            rows_read += len(chunk)
+            rows_written += int(keep_mask.sum())
+            print(f"[!] Chunk {index + 1} processed, {rows_read - rows_written} duplicate rows removed so far.")
+    finally:
+        seen_keys.close()
+
+    if rows_read == 0:
+        pd.read_csv(input_path, nrows=0).to_csv(output_path, index=False)
+
+    print(f"[+] Wrote {rows_written} of {rows_read} rows to {output_path}")
+    return rows_written
+
+
+def _build_keys(chunk: pd.DataFrame, subset_list: list[str]=None) -> pd.Series:
+    """Joins the text of the subset columns into one key per row. Text pandas reads as null by default becomes one null key.
+
+    Args:
+        chunk (pd.DataFrame): The chunk, read with dtype=str.
+        subset_list (list[str], optional): The columns to consider duplicates. Defaults to None.
+
+    Returns:
+        pd.Series: The key of each row.
+    """
+    if subset_list is None:
+        subset_list = list(chunk.columns)
+
+    key_columns: list[pd.Series] = [chunk[column].astype(object).mask(chunk[column].isin(STR_NA_VALUES), _NULL_KEY) for column in subset_list]
+    if len(key_columns) == 1:
+        return key_columns[0]
+    return key_columns[0].str.cat(key_columns[1:], sep=_KEY_SEPARATOR)
+
+
+class SqliteKeyStore:
+    def __init__(self, spill_directory: str=None) -> None:
+        """An exact set of keys kept in a temporary on-disk sqlite database, so memory use does not grow with the file.
+
+        Args:
+            spill_directory (str, optional): Directory for the database file. Defaults to None, the system temp directory.
+        """
+        file_descriptor, self._database_path = tempfile.mkstemp(suffix=".sqlite", dir=spill_directory)
+        os.close(file_descriptor)
+
+        self._connection = sqlite3.connect(self._database_path)
+        self._connection.execute("PRAGMA journal_mode=OFF")
+        self._connection.execute("PRAGMA synchronous=OFF")
+        self._connection.execute("CREATE TABLE seen (key TEXT PRIMARY KEY) WITHOUT ROWID")
+        self._connection.execute("CREATE TEMP TABLE chunk_keys (key TEXT PRIMARY KEY) WITHOUT ROWID")
+
+    def add_and_check_new(self, keys: pd.Series) -> np.ndarray:
+        """Adds unique keys to the store.
+
+        Args:
+            keys (pd.Series): Keys that are unique within the series.
+
+        Returns:
+            np.ndarray: True for every key that had not been seen before.
+        """
+        cursor = self._connection.cursor()
+        cursor.execute("DELETE FROM chunk_keys")
+        cursor.executemany("INSERT INTO chunk_keys VALUES (?)", ((key,) for key in keys))
+
+        existing_keys: set[str] = {row[0] for row in cursor.execute("SELECT key FROM chunk_keys WHERE key IN (SELECT key FROM seen)")}
+        cursor.execute("INSERT OR IGNORE INTO seen SELECT key FROM chunk_keys")
+        self._connection.commit()
+
+        return ~keys.isin(existing_keys).to_numpy()
+
+    def close(self) -> None:
+        self._connection.close()
+        os.remove(self._database_path)
+
+
+class BloomFilter:
+    def __init__(self, expected_rows: int, false_positive_rate: float) -> None:
+        """A fixed-size bloom filter over 64 bit row hashes.
+
+        Args:
+            expected_rows (int): The number of distinct keys the filter is sized for.
+            false_positive_rate (float): The target false positive rate at expected_rows keys.
+        """
+        if not 0 < false_positive_rate < 1:
+            raise ValueError(f"false_positive_rate must be between 0 and 1, but got {false_positive_rate}.")
+
+        self._bit_count: int = max(8, int(-expected_rows * math.log(false_positive_rate) / math.log(2) ** 2))
+        self._hash_count: int = max(1, round(self._bit_count / max(expected_rows, 1) * math.log(2)))
+        self._bits: np.ndarray = np.zeros(math.ceil(self._bit_count / 8), dtype=np.uint8)
+
+    def add_and_check_new(self, keys: pd.Series) -> np.ndarray:
+        """Adds unique keys to the filter.
+
+        Args:
+            keys (pd.Series): Keys that are unique within the series.
+
+        Returns:
+            np.ndarray: True for every key that was (probably) not seen before.
+        """
+        positions: np.ndarray = self._bit_positions(keys)
+        bytes_index: np.ndarray = positions >> 3
+        bit_values: np.ndarray = (np.uint8(1) << (positions & 7).astype(np.uint8))
+
+        already_set: np.ndarray = (self._bits[bytes_index] & bit_values) != 0
+        is_new: np.ndarray = ~already_set.all(axis=1)
+
+        np.bitwise_or.at(self._bits, bytes_index.ravel(), bit_values.ravel())
+        return is_new
+
+    def _bit_positions(self, keys: pd.Series) -> np.ndarray:
+        # double hashing: position i = h1 + i * h2, derived from the two halves of one 64 bit hash
+        hashes: np.ndarray = pd.util.hash_pandas_object(keys, index=False).to_numpy()
+        first_hash: np.ndarray = (hashes & np.uint64(0xFFFFFFFF)).astype(np.uint64)
+        second_hash: np.ndarray = ((hashes >> np.uint64(32)) | np.uint64(1)).astype(np.uint64)
+
+        hash_numbers: np.ndarray = np.arange(self._hash_count, dtype=np.uint64)
+        positions: np.ndarray = (first_hash[:, None] + hash_numbers[None, :] * second_hash[:, None]) % np.uint64(self._bit_count)
+        return positions.astype(np.int64)
+
+    def close(self) -> None:
+        pass
+
+    @property
+    def size_mb(self) -> float:
+        return self._bits.nbytes / 1024**2
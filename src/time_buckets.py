@@ -0,0 +1,111 @@
+# ElPsychicMustache
+# 2024-12-27
+
+# Counts datetime values per hour, day, week or month directly on the datetime64 integer representation,
+#   instead of converting every value to a pandas Period. Empty buckets are filled with 0, and a coarser frequency
+#   can be derived from the counts of a finer one, so switching granularity does not rescan the column.
+
+import numpy as np
+import pandas as pd
+
+from .validate_input import validate_argument
+
+FREQUENCIES: list[str] = ["hour", "day", "week", "month"]
+MAX_AUTO_BUCKETS: int = 60
+
+_NUMPY_UNITS: dict[str, str] = {"hour": "h", "day": "D", "week": "D", "month": "M"}
+_FREQUENCY_HOURS: dict[str, float] = {"hour": 1, "day": 24, "week": 24 * 7, "month": 24 * 30.44}
+# 1970-01-01 is a Thursday, so weeks starting on Monday begin 3 days before every multiple of 7 days
+_WEEK_OFFSET_DAYS: int = 3
+
+
+def bucket_datetimes(column_data: pd.Series, frequency: str="auto") -> pd.Series:
+    """Counts the values of a datetime column per bucket.
+
+    Args:
+        column_data (pd.Series): A datetime column. Nulls are ignored and time zones are dropped (local wall time is kept).
+        frequency (str, optional): "hour", "day", "week", "month" or "auto". Defaults to "auto".
+
+    Returns:
+        pd.Series: The count per bucket, indexed by the start of each bucket, with empty buckets included.
+    """
+    values: np.ndarray = _to_naive_datetime64(column_data)
+
+    if frequency == "auto":
+        frequency = choose_frequency(values.min(), values.max()) if len(values) else "month"
+    validate_argument(valid_arg_options=FREQUENCIES, user_input=frequency, parameter_name="frequency")
+
+    return _count_buckets(values, frequency, weights=None, name=column_data.name)
+
+
+def rebucket(buckets: pd.Series, frequency: str) -> pd.Series:
+    """Derives the counts of a coarser frequency from the counts of a finer one, e.g. months from days.
+
+    Args:
+        buckets (pd.Series): Counts returned by bucket_datetimes.
+        frequency (str): The coarser frequency.
+
+    Returns:
+        pd.Series: The count per bucket of the new frequency.
+    """
+    validate_argument(valid_arg_options=FREQUENCIES, user_input=frequency, parameter_name="frequency")
+    return _count_buckets(buckets.index.to_numpy(), frequency, weights=buckets.to_numpy(), name=buckets.name)
+
+
+def can_rebucket(finer_frequency: str, frequency: str) -> bool:
+    """Whether buckets of finer_frequency always fall into exactly one bucket of frequency. Weeks do not fit into months.
+
+    Args:
+        finer_frequency (str): The frequency of the existing buckets.
+        frequency (str): The wanted frequency.
+
+    Returns:
+        bool: True if rebucket gives exact counts.
+    """
+    return finer_frequency in ("hour", "day") and FREQUENCIES.index(finer_frequency) < FREQUENCIES.index(frequency)
+
+
+def choose_frequency(min_value: np.datetime64|pd.Timestamp, max_value: np.datetime64|pd.Timestamp, max_buckets: int=MAX_AUTO_BUCKETS) -> str:
+    """Picks the finest frequency that splits the span between min_value and max_value into at most max_buckets buckets.
+
+    Args:
+        min_value (np.datetime64|pd.Timestamp): The earliest value.
+        max_value (np.datetime64|pd.Timestamp): The latest value.
+        max_buckets (int, optional): The maximum number of buckets. Defaults to 60.
+
+    Returns:
+        str: The chosen frequency.
+    """
+    if pd.isna(min_value) or pd.isna(max_value):
+        return "month"
+
+    span_hours: float = pd.Timedelta(pd.Timestamp(max_value) - pd.Timestamp(min_value)) / pd.Timedelta(hours=1)
+    for frequency in FREQUENCIES:
+        if span_hours / _FREQUENCY_HOURS[frequency] < max_buckets:
+            return frequency
+    return "month"
+
+
+def _count_buckets(values: np.ndarray, frequency: str, weights: np.ndarray|None, name: str) -> pd.Series:
+    bucket_numbers: np.ndarray = values.astype(f"datetime64[{_NUMPY_UNITS[frequency]}]").view(np.int64)
+    step: int = 1
+    if frequency == "week":
+        bucket_numbers = (bucket_numbers + _WEEK_OFFSET_DAYS) // 7 * 7 - _WEEK_OFFSET_DAYS
+        step = 7
+
+    if len(bucket_numbers) == 0:
+        return pd.Series([], index=pd.DatetimeIndex([]), dtype=np.int64, name=name)
+
+    first_bucket: int = int(bucket_numbers.min())
+    # bincount over the offset from the first bucket fills every empty bucket in between with 0
+    counts: np.ndarray = np.bincount((bucket_numbers - first_bucket) // step, weights=weights)
+
+    bucket_starts: np.ndarray = (first_bucket + np.arange(len(counts)) * step).astype(f"datetime64[{_NUMPY_UNITS[frequency]}]")
+    return pd.Series(counts.astype(np.int64), index=pd.DatetimeIndex(bucket_starts.astype("datetime64[ns]")), name=name)
+
+
+def _to_naive_datetime64(column_data: pd.Series) -> np.ndarray:
+    column_data = column_data.dropna()
+    if getattr(column_data.dt, "tz", None) is not None:
+        column_data = column_data.dt.tz_localize(None)
+    return column_data.to_numpy()
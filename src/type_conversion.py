@@ -0,0 +1,190 @@
+# ElPsychicMustache
+# 2025-01-10
+
+# Converts text columns to datetime or numeric without aborting on bad values. Every distinct value is parsed once and
+#   the results are spread back over the rows with the factorized codes, so low-cardinality columns cost almost nothing.
+#   Datetime formats are inferred from a sample, so the bulk of the values is parsed with one explicit format instead of
+#   being guessed value by value. Values that cannot be converted become null and are reported with counts and examples.
+
+import warnings
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.api import guess_datetime_format
+
+from .parallel import map_columns
+from .validate_input import validate_argument
+
+CONVERSION_TARGETS: list[str] = ["datetime", "numeric"]
+FORMAT_SAMPLE_SIZE: int = 200
+MAX_FAILURE_EXAMPLES: int = 5
+
+
+def convert_columns(dataframe: pd.DataFrame, conversions: dict[str, str], max_workers: int=None, dayfirst: bool=False) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Converts several columns at once, in parallel on the thread pool of parallel.py.
+
+    Args:
+        dataframe (pd.DataFrame): The dataframe holding the columns.
+        conversions (dict[str, str]): "datetime" or "numeric" per column.
+        max_workers (int, optional): Number of threads. Defaults to None, which uses the library setting (see parallel.set_max_workers).
+        dayfirst (bool, optional): Read ambiguous dates like 01/02/2024 as day first. Defaults to False.
+
+    Returns:
+        tuple[pd.DataFrame, pd.DataFrame]: The dataframe with the converted columns, and the conversion report (see convert_column).
+    """
+    for column, target in conversions.items():
+        validate_argument(valid_arg_options=CONVERSION_TARGETS, user_input=target, parameter_name=f"conversions['{column}']")
+    if not conversions:
+        return dataframe, _build_report({})
+
+    results: dict[str, tuple[pd.Series, dict]] = map_columns(lambda column: convert_column(dataframe[column], conversions[column], dayfirst), conversions, row_count=len(dataframe), max_workers=max_workers)
+
+    converted_dataframe: pd.DataFrame = dataframe.assign(**{column: converted_column for column, (converted_column, _) in results.items()})
+    return converted_dataframe, _build_report({column: report for column, (_, report) in results.items()})
+
+
+def convert_column(column_data: pd.Series, target: str, dayfirst: bool=False) -> tuple[pd.Series, dict]:
+    """Converts one column to datetime or numeric. Values that cannot be converted become null instead of raising.
+
+    Args:
+        column_data (pd.Series): The column's values.
+        target (str): "datetime" or "numeric".
+        dayfirst (bool, optional): Read ambiguous dates as day first. Defaults to False.
+
+    Returns:
+        tuple[pd.Series, dict]: The converted column, and its report: the target, the datetime format used, how many
+            values were converted, how many failed and the most common failed values.
+    """
+    validate_argument(valid_arg_options=CONVERSION_TARGETS, user_input=target, parameter_name="target")
+    report: dict = {"target": target, "format": None, "converted": 0, "failed": 0, "examples": []}
+
+    if target == "datetime" and pd.api.types.is_datetime64_any_dtype(column_data.dtype) or target == "numeric" and pd.api.types.is_numeric_dtype(column_data.dtype):
+        report["converted"] = int(column_data.notna().sum())
+        return column_data, report
+
+    if not (pd.api.types.is_object_dtype(column_data.dtype) or pd.api.types.is_string_dtype(column_data.dtype) or isinstance(column_data.dtype, pd.CategoricalDtype)):
+        # e.g. numbers to datetime, which pandas reads as epoch values; there are no strings to memoize
+        converted_column: pd.Series = pd.to_datetime(column_data, errors="coerce") if target == "datetime" else pd.to_numeric(column_data, errors="coerce")
+        return converted_column, _count_failures(column_data, converted_column, report)
+
+    if not isinstance(column_data.dtype, pd.CategoricalDtype) and _is_mostly_distinct(column_data):
+        # memoizing only pays off when values repeat; otherwise factorizing would cost as much as the parsing it saves
+        if target == "datetime":
+            report["format"] = infer_datetime_format(column_data, dayfirst=dayfirst)
+            converted_column = _parse_datetimes(column_data, report["format"], dayfirst)
+        else:
+            converted_column = pd.to_numeric(column_data.astype(object), errors="coerce")
+        return converted_column, _count_failures(column_data, converted_column, report)
+
+    codes, uniques = _factorize(column_data)
+    if target == "datetime":
+        report["format"] = infer_datetime_format(uniques, dayfirst=dayfirst)
+        parsed_uniques: pd.Index = pd.Index(_parse_datetimes(pd.Series(uniques, dtype=object), report["format"], dayfirst))
+    else:
+        # to_numeric already ignores surrounding whitespace
+        parsed_uniques = pd.Index(pd.to_numeric(pd.Series(uniques, dtype=object), errors="coerce"))
+
+    # codes of -1 (nulls) take a null, so ints become floats only when the column had nulls
+    converted_values = pd.api.extensions.take(parsed_uniques.array, codes, allow_fill=True)
+    converted_column = pd.Series(converted_values, index=column_data.index, name=column_data.name)
+
+    failed_uniques: np.ndarray = np.flatnonzero(parsed_uniques.isna())
+    value_counts: np.ndarray = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    report["converted"] = int(value_counts.sum() - value_counts[failed_uniques].sum())
+    report["failed"] = int(value_counts[failed_uniques].sum())
+    most_common_failures: np.ndarray = failed_uniques[np.argsort(-value_counts[failed_uniques], kind="stable")[:MAX_FAILURE_EXAMPLES]]
+    report["examples"] = [uniques[index] for index in most_common_failures]
+    return converted_column, report
+
+
+def infer_datetime_format(values: pd.Index|pd.Series, dayfirst: bool=False, sample_size: int=FORMAT_SAMPLE_SIZE) -> str|None:
+    """Infers the strftime format of date strings from a sample, picking the guessed format that parses most of the sample.
+
+    Args:
+        values (pd.Index|pd.Series): Date strings, e.g. the distinct values of a column.
+        dayfirst (bool, optional): Prefer day first formats for ambiguous dates. Defaults to False.
+        sample_size (int, optional): The number of values to guess and check formats on. Defaults to 200.
+
+    Returns:
+        str|None: The format, or None if no format could be guessed.
+    """
+    sample: pd.Series = pd.Series(values, dtype=object).dropna()
+    if len(sample) > sample_size:
+        # evenly spaced rather than the first values, so a format change later in the column is noticed
+        sample = sample.iloc[np.linspace(0, len(sample) - 1, sample_size).astype(np.int64)]
+    sample = sample[sample.map(lambda value: isinstance(value, str))]
+    if sample.empty:
+        return None
+
+    sample = sample.str.strip()
+    with warnings.catch_warnings():
+        # guess_datetime_format warns when dayfirst does not fit a value, e.g. ISO dates; the candidates are checked below anyway
+        warnings.simplefilter("ignore", UserWarning)
+        candidate_formats: set[str] = {guess_datetime_format(value, dayfirst=dayfirst) for value in sample.iloc[:20]} - {None}
+
+    best_format: str|None = None
+    best_parsed_count: int = 0
+    for candidate_format in sorted(candidate_formats):
+        parsed_count: int = int(_to_datetime(sample, candidate_format, dayfirst).notna().sum())
+        if parsed_count > best_parsed_count:
+            best_format, best_parsed_count = candidate_format, parsed_count
+    return best_format
+
+
+def _parse_datetimes(strings: pd.Series, date_format: str|None, dayfirst: bool) -> pd.Series:
+    """Parses distinct date strings with the inferred format. Values the format does not fit, e.g. a second format in
+    the same column or surrounding whitespace, are stripped and parsed one by one, which is slow but only happens for those values.
+
+    Args:
+        strings (pd.Series): The values, usually the distinct values of a column.
+        date_format (str|None): The inferred format.
+        dayfirst (bool): Read ambiguous dates as day first.
+
+    Returns:
+        pd.Series: The parsed datetimes, NaT where a value could not be parsed.
+    """
+    if date_format is None:
+        return _to_datetime(_strip_strings(strings), "mixed", dayfirst)
+
+    parsed: pd.Series = _to_datetime(strings, date_format, dayfirst)
+    unparsed_mask: pd.Series = parsed.isna() & strings.notna()
+    if unparsed_mask.any():
+        parsed = parsed.combine_first(_to_datetime(_strip_strings(strings[unparsed_mask]), "mixed", dayfirst))
+    return parsed
+
+
+def _to_datetime(strings: pd.Series, date_format: str, dayfirst: bool) -> pd.Series:
+    try:
+        return pd.to_datetime(strings, format=date_format, dayfirst=dayfirst, errors="coerce")
+    except ValueError:
+        # mixed time zone offsets cannot share one d-type, so they are converted to UTC
+        return pd.to_datetime(strings, format=date_format, dayfirst=dayfirst, errors="coerce", utc=True)
+
+
+def _is_mostly_distinct(column_data: pd.Series) -> bool:
+    sample: pd.Series = column_data.iloc[np.linspace(0, len(column_data) - 1, min(len(column_data), 1000)).astype(np.int64)]
+    return sample.nunique() > 0.95 * len(sample)
+
+
+def _strip_strings(strings: pd.Series) -> pd.Series:
+    return strings.map(lambda value: value.strip() if isinstance(value, str) else value)
+
+
+def _factorize(column_data: pd.Series) -> tuple[np.ndarray, pd.Index]:
+    if isinstance(column_data.dtype, pd.CategoricalDtype):
+        # the categories already are the distinct values
+        return column_data.cat.codes.to_numpy(dtype=np.int64), pd.Index(column_data.cat.categories)
+    codes, uniques = pd.factorize(column_data)
+    return codes.astype(np.int64, copy=False), pd.Index(uniques)
+
+
+def _count_failures(column_data: pd.Series, converted_column: pd.Series, report: dict) -> dict:
+    failed_mask: pd.Series = column_data.notna() & converted_column.isna()
+    report["converted"] = int(converted_column.notna().sum())
+    report["failed"] = int(failed_mask.sum())
+    report["examples"] = list(column_data[failed_mask].value_counts().index[:MAX_FAILURE_EXAMPLES])
+    return report
+
+
+def _build_report(column_reports: dict[str, dict]) -> pd.DataFrame:
+    return pd.DataFrame.from_dict(column_reports, orient="index", columns=["target", "format", "converted", "failed", "examples"])
@@ -2,26 +2,398 @@
 # Author: ElPsychicMustache
 # Created: 2024-11-04
 
+import io
+import os
+import sys
+
+import numpy as np
 import pandas as pd
 
+from .instrumentation import instrumented
+
+
+@instrumented("load.get_df_from_csv")
+def get_df_from_csv(file_path: str, file_name: str, date_columns: list[str], column_names: list[str], chunk_size: int=None, memory_budget_mb: float=None, usecols: list[str]=None, dtypes: dict[str, str]=None) -> pd.DataFrame:
+    """Loads a csv file into a dataframe.
 
-def get_df_from_csv(file_path: str, file_name: str, date_columns: list[str], column_names: list[str]) -> pd.DataFrame:
+    Args:
+        file_path (str): The path to the csv file.
+        file_name (str): The name of the csv file.
+        date_columns (list[str]): Columns that contain date information.
+        column_names (list[str]): The names to provide each column.
+        chunk_size (int, optional): Number of rows to read per chunk. Enables chunked loading. Defaults to None.
+        memory_budget_mb (float, optional): Approximate memory (in MB) a single raw chunk may use. Enables chunked loading
+            and is used to determine the chunk size when chunk_size is not passed. Defaults to None.
+        usecols (list[str], optional): Only these columns are parsed; the others are never materialized. Defaults to None.
+        dtypes (dict[str, str]): D-types to parse columns as, instead of converting them after loading. Defaults to None.
+
+    Returns:
+        pd.DataFrame: The loaded dataframe.
+    """
     
-    # TODO: Move full_file_path to validate_input
-    # making sure user did not forget to add '/' at the end of file path
-    if file_path[-1] != '/':
-        file_path += '/'
+    full_file_path: str = get_full_file_path(file_path, file_name)
+
+    read_csv_kwargs: dict = _get_read_csv_kwargs(date_columns, column_names, usecols, dtypes)
+
+    if chunk_size is None and memory_budget_mb is None:
+        return pd.read_csv(full_file_path, **read_csv_kwargs)
+
+    return _get_df_from_csv_chunked(full_file_path, read_csv_kwargs, chunk_size, memory_budget_mb)
+
+
+def get_csv_rows_after(full_file_path: str, offset: int, column_names: list[str], date_columns: list[str]=None, usecols: list[str]=None, dtypes: dict[str, str]=None) -> tuple[pd.DataFrame, int]:
+    """Reads only the rows appended to a csv file after a byte offset, e.g. the size of the file when it was last loaded.
+    A last line without a line break may still be being written, so it is left for the next read.
+
+    Args:
+        full_file_path (str): The full path to the csv file.
+        offset (int): The byte offset to start reading at; must be at the start of a line.
+        column_names (list[str]): The names of every column in the file, since the new rows have no header.
+        date_columns (list[str], optional): Columns that contain date information. Defaults to None.
+        usecols (list[str], optional): Only parse these columns. Defaults to None.
+        dtypes (dict[str, str], optional): D-types to parse columns as. Defaults to None.
+
+    Returns:
+        tuple[pd.DataFrame, int]: The new rows and the offset after the last complete row.
+    """
+    if os.path.getsize(full_file_path) < offset:
+        raise ValueError(f"{full_file_path} is smaller than when it was loaded, so it was rewritten rather than appended to.")
+
+    with open(full_file_path, "rb") as csv_file:
+        csv_file.seek(offset)
+        new_bytes: bytes = csv_file.read()
+
+    complete_length: int = new_bytes.rfind(b"\n") + 1
+    read_csv_kwargs: dict = _get_read_csv_kwargs(date_columns, column_names, usecols, dtypes)
+    if complete_length == 0:
+        return pd.read_csv(io.BytesIO(b""), header=None, **read_csv_kwargs), offset
+    return pd.read_csv(io.BytesIO(new_bytes[:complete_length]), header=None, **read_csv_kwargs), offset + complete_length
+
+
+@instrumented("load.get_csv_reservoir_sample")
+def get_csv_reservoir_sample(file_path: str, file_name: str, date_columns: list[str], column_names: list[str], sample_size: int, seed: int=0, chunk_size: int=100_000, usecols: list[str]=None, dtypes: dict[str, str]=None) -> tuple[pd.DataFrame, int]:
+    """Draws a uniform random sample of rows from a csv file in one streaming pass, keeping at most about twice the
+    sample in memory. Every row has the same chance of being kept, wherever it is in the file.
+
+    Args:
+        file_path (str): The path to the csv file.
+        file_name (str): The name of the csv file.
+        date_columns (list[str]): Columns that contain date information.
+        column_names (list[str]): The names to provide each column.
+        sample_size (int): The number of rows to keep. Files with fewer rows are returned whole.
+        seed (int, optional): Seed of the random generator, so the same sample can be drawn again. Defaults to 0.
+        chunk_size (int, optional): Number of rows to read per chunk. Defaults to 100_000.
+        usecols (list[str], optional): Only parse these columns. Defaults to None.
+        dtypes (dict[str, str], optional): D-types to parse columns as. Defaults to None.
+
+    Returns:
+        tuple[pd.DataFrame, int]: The sampled rows in file order, indexed by their row number in the file, and the exact number of rows in the file.
+    """
+    if sample_size <= 0:
+        raise ValueError(f"sample_size must be positive, but got {sample_size}.")
+
+    full_file_path: str = get_full_file_path(file_path, file_name)
+    read_csv_kwargs: dict = _get_read_csv_kwargs(date_columns, column_names, usecols, dtypes)
+    random_generator: np.random.Generator = np.random.default_rng(seed)
 
-    full_file_path: str = f"{file_path}{file_name}"
+    kept_chunks: list[pd.DataFrame] = []
+    kept_row_count: int = 0
+    # the position of each reservoir slot's row within the concatenated kept chunks
+    slot_positions: np.ndarray = np.empty(0, dtype=np.int64)
+    row_count: int = 0
 
+    for chunk in pd.read_csv(full_file_path, chunksize=chunk_size, **read_csv_kwargs):
+        chunk = chunk.set_axis(pd.RangeIndex(row_count, row_count + len(chunk)))
+        filled_count: int = min(len(chunk), max(0, sample_size - len(slot_positions)))
+
+        # Algorithm R: row number i replaces a random slot with probability sample_size / (i + 1)
+        row_numbers: np.ndarray = np.arange(row_count + filled_count, row_count + len(chunk))
+        slots: np.ndarray = random_generator.integers(0, row_numbers + 1)
+        accepted_rows: np.ndarray = np.flatnonzero(slots < sample_size) + filled_count
+        accepted_slots: np.ndarray = slots[accepted_rows - filled_count]
+        # when several rows of the chunk pick the same slot, the last one wins, as if they had been processed in order
+        last_slots, last_indexes = np.unique(accepted_slots[::-1], return_index=True)
+        replacing_rows: np.ndarray = accepted_rows[::-1][last_indexes]
+
+        kept_rows: np.ndarray = np.concatenate((np.arange(filled_count), np.sort(replacing_rows)))
+        if len(kept_rows):
+            kept_chunks.append(chunk.iloc[kept_rows])
+            slot_positions = np.concatenate((slot_positions, kept_row_count + np.arange(filled_count)))
+            slot_positions[last_slots] = kept_row_count + np.searchsorted(kept_rows, replacing_rows)
+            kept_row_count += len(kept_rows)
+
+        if kept_row_count > 2 * sample_size:
+            # rows that lost their slot are dropped, so memory stays bounded however long the file is
+            kept_chunks = [pd.concat(kept_chunks).iloc[slot_positions]]
+            slot_positions = np.arange(len(slot_positions))
+            kept_row_count = len(slot_positions)
+        row_count += len(chunk)
+
+    if not kept_chunks:
+        return pd.read_csv(full_file_path, **read_csv_kwargs), 0
+
+    sample: pd.DataFrame = pd.concat(kept_chunks).iloc[slot_positions].sort_index()
+    return _restore_dtypes(sample, kept_chunks[0].dtypes), row_count
+
+
+@instrumented("load.get_csv_block_sample")
+def get_csv_block_sample(file_path: str, file_name: str, date_columns: list[str], column_names: list[str], sample_size: int, seed: int=0, block_count: int=100, usecols: list[str]=None, dtypes: dict[str, str]=None) -> tuple[pd.DataFrame, int]:
+    """Reads runs of consecutive rows from random places in a csv file, without reading the rest of the file.
+    The file is split into block_count equal byte ranges and one run of rows is read from a random offset in each,
+    so the blocks never overlap and cover the whole file. Much faster than a reservoir sample on large files,
+    but rows within a block are neighbours, so sorted or grouped files give a less representative sample.
+    Quoted values containing line breaks are not supported, since a block may start inside one.
+
+    Args:
+        file_path (str): The path to the csv file.
+        file_name (str): The name of the csv file.
+        date_columns (list[str]): Columns that contain date information.
+        column_names (list[str]): The names to provide each column.
+        sample_size (int): The number of rows to read in total.
+        seed (int, optional): Seed of the random offsets, so the same sample can be read again. Defaults to 0.
+        block_count (int, optional): The number of blocks to read. Defaults to 100.
+        usecols (list[str], optional): Only parse these columns. Defaults to None.
+        dtypes (dict[str, str], optional): D-types to parse columns as. Defaults to None.
+
+    Returns:
+        tuple[pd.DataFrame, int]: The sampled rows, and the number of rows in the file estimated from the bytes per sampled row.
+    """
+    if sample_size <= 0 or block_count <= 0:
+        raise ValueError(f"sample_size and block_count must be positive, but got {sample_size} and {block_count}.")
+
+    full_file_path: str = get_full_file_path(file_path, file_name)
+    file_size: int = os.path.getsize(full_file_path)
+    random_generator: np.random.Generator = np.random.default_rng(seed)
+    rows_per_block: int = -(-sample_size // block_count)
+
+    sampled_lines: list[bytes] = []
+    with open(full_file_path, "rb") as csv_file:
+        header: bytes = csv_file.readline()
+        # passed column names replace the header, so the first line is read as data like get_df_from_csv does
+        data_start: int = 0 if column_names else len(header)
+        boundaries: np.ndarray = np.linspace(data_start, file_size, block_count + 1).astype(np.int64)
+        offsets: np.ndarray = boundaries[:-1] + (random_generator.random(block_count) * np.diff(boundaries)).astype(np.int64)
+
+        for block_index, offset in enumerate(offsets):
+            next_offset: int = int(offsets[block_index + 1]) if block_index + 1 < block_count else file_size
+            csv_file.seek(max(int(offset) - 1, data_start))
+            if offset > data_start:
+                csv_file.readline()  # the rest of the line the offset falls in; a line starting exactly at the offset is kept
+            # stopping at the next block's offset keeps a row from being read by two blocks
+            for _ in range(rows_per_block):
+                if csv_file.tell() >= next_offset:
+                    break
+                line: bytes = csv_file.readline()
+                if not line.endswith(b"\n"):
+                    if line.strip():
+                        sampled_lines.append(line + b"\n")
+                    break
+                sampled_lines.append(line)
+
+    read_csv_kwargs: dict = _get_read_csv_kwargs(date_columns, column_names or list(pd.read_csv(io.BytesIO(header), nrows=0).columns), usecols, dtypes)
+    sample: pd.DataFrame = pd.read_csv(io.BytesIO(b"".join(sampled_lines)), header=None, **read_csv_kwargs)
+    if sample.empty:
+        return sample, 0
+
+    bytes_per_row: float = sum(len(line) for line in sampled_lines) / len(sampled_lines)
+    estimated_row_count: int = max(len(sample), round((file_size - data_start) / bytes_per_row))
+    if estimated_row_count <= sample_size:
+        # the sample would be most of the file anyway, so the whole file is read instead of the rows between the blocks being missed
+        dataframe: pd.DataFrame = pd.read_csv(full_file_path, **_get_read_csv_kwargs(date_columns, column_names, usecols, dtypes))
+        return dataframe, len(dataframe)
+    return sample, estimated_row_count
+
+
+def _restore_dtypes(dataframe: pd.DataFrame, dtypes: pd.Series) -> pd.DataFrame:
+    # concatenating chunks whose categoricals have different categories falls back to object
+    changed_columns: dict[str, pd.Series] = {column: dataframe[column].astype("category") for column, dtype in dtypes.items() if isinstance(dtype, pd.CategoricalDtype) and not isinstance(dataframe[column].dtype, pd.CategoricalDtype)}
+    return dataframe.assign(**changed_columns) if changed_columns else dataframe
+
+
+def _get_read_csv_kwargs(date_columns: list[str], column_names: list[str], usecols: list[str]=None, dtypes: dict[str, str]=None) -> dict:
     read_csv_kwargs: dict = {}
 
     if date_columns:
         read_csv_kwargs['parse_dates'] = date_columns
     if column_names:
         read_csv_kwargs['names'] = column_names
+    if usecols:
+        read_csv_kwargs['usecols'] = usecols
+        if date_columns:
+            # pandas raises if a date column is not also a used column
+            read_csv_kwargs['parse_dates'] = [column for column in date_columns if column in usecols]
+    if dtypes:
+        read_csv_kwargs['dtype'] = dtypes
 
-    return pd.read_csv(full_file_path, **read_csv_kwargs)
+    return read_csv_kwargs
+
+
+def get_full_file_path(file_path: str, file_name: str) -> str:
+    # TODO: Move full_file_path to validate_input
+    # making sure user did not forget to add '/' at the end of file path
+    if file_path[-1] != '/':
+        file_path += '/'
+
+    return f"{file_path}{file_name}"
+
+
+def get_csv_columns(file_path: str, file_name: str, column_names: list[str]=None) -> list[str]:
+    """Returns the column names of a csv file by reading only its header.
+
+    Args:
+        file_path (str): The path to the csv file.
+        file_name (str): The name of the csv file.
+        column_names (list[str], optional): The names to provide each column. If passed, they are returned as is. Defaults to None.
+
+    Returns:
+        list[str]: The column names.
+    """
+    if column_names:
+        return list(column_names)
+    return list(pd.read_csv(get_full_file_path(file_path, file_name), nrows=0).columns)
+
+
+def _get_df_from_csv_chunked(full_file_path: str, read_csv_kwargs: dict, chunk_size: int, memory_budget_mb: float) -> pd.DataFrame:
+    """Streams a csv file in chunks, compacting each chunk before it is kept, so the raw object-dtype frame never exists in full.
+
+    Args:
+        full_file_path (str): The full path to the csv file.
+        read_csv_kwargs (dict): Keyword arguments passed through to pd.read_csv.
+        chunk_size (int): Number of rows to read per chunk. If None, it is estimated from memory_budget_mb.
+        memory_budget_mb (float): Approximate memory (in MB) a single raw chunk may use.
+
+    Returns:
+        pd.DataFrame: The compacted dataframe.
+    """
+    if chunk_size is None:
+        chunk_size = _estimate_chunk_size(full_file_path, read_csv_kwargs, memory_budget_mb)
+
+    print(f"[!] Loading {full_file_path} in chunks of {chunk_size} rows ...")
+
+    chunks: list[pd.DataFrame] = []
+    # the d-type each string column was first read with, restored if the column does not stay categorical
+    string_dtypes: dict[str, object] = {}
+
+    for chunk in pd.read_csv(full_file_path, chunksize=chunk_size, **read_csv_kwargs):
+        for column in chunk.columns:
+            if pd.api.types.is_string_dtype(chunk[column].dtype):
+                string_dtypes.setdefault(column, chunk[column].dtype)
+        chunks.append(_compact_chunk(chunk))
+
+    if not chunks:
+        return pd.read_csv(full_file_path, **read_csv_kwargs)
+
+    chunk_count: int = len(chunks)
+    dataframe: pd.DataFrame = _concat_chunks(chunks, string_dtypes)
+
+    print(f"[+] Loaded {dataframe.shape[0]} rows in {chunk_count} chunks using {dataframe.memory_usage(deep=True).sum() / 1024**2:.2f} MB.")
+    peak_memory_mb: float = get_peak_memory_mb()
+    if peak_memory_mb is not None:
+        print(f"[!] Peak resident memory: {peak_memory_mb:.2f} MB")
+
+    return dataframe
+
+
+def _estimate_chunk_size(full_file_path: str, read_csv_kwargs: dict, memory_budget_mb: float, sample_rows: int=1000) -> int:
+    """Estimates how many rows fit in the memory budget, based on the raw size of the first few rows.
+
+    Args:
+        full_file_path (str): The full path to the csv file.
+        read_csv_kwargs (dict): Keyword arguments passed through to pd.read_csv.
+        memory_budget_mb (float): Approximate memory (in MB) a single raw chunk may use.
+        sample_rows (int, optional): How many rows to sample for the estimate. Defaults to 1000.
+
+    Returns:
+        int: The number of rows per chunk.
+    """
+    if memory_budget_mb <= 0:
+        raise ValueError(f"memory_budget_mb must be positive, but got {memory_budget_mb}.")
+
+    sample: pd.DataFrame = pd.read_csv(full_file_path, nrows=sample_rows, **read_csv_kwargs)
+    if sample.empty:
+        return sample_rows
+
+    bytes_per_row: float = sample.memory_usage(deep=True).sum() / len(sample)
+    return max(1, int(memory_budget_mb * 1024**2 / bytes_per_row))
+
+
+def _compact_chunk(chunk: pd.DataFrame, max_unique_ratio: float=0.5) -> pd.DataFrame:
+    """Downcasts integer columns, and float columns where every value stays the same, and stores a string column as
+    categorical if its share of unique values in the chunk is at most max_unique_ratio, so e.g. unique ids stay strings.
+    Whether a column stays categorical in the whole file is decided in _concat_chunks, once every chunk is read.
+
+    Args:
+        chunk (pd.DataFrame): The chunk to compact.
+        max_unique_ratio (float, optional): The maximum ratio of unique values to rows of a categorical column. Defaults to 0.5.
+
+    Returns:
+        pd.DataFrame: The compacted chunk.
+    """
+    for column in chunk.columns:
+        column_data: pd.Series = chunk[column]
+        if pd.api.types.is_integer_dtype(column_data.dtype):
+            chunk[column] = pd.to_numeric(column_data, downcast="integer")
+        elif pd.api.types.is_float_dtype(column_data.dtype):
+            downcast_data: pd.Series = pd.to_numeric(column_data, downcast="float")
+            if downcast_data.dtype != column_data.dtype and np.array_equal(downcast_data.to_numpy(dtype=np.float64, na_value=np.nan), column_data.to_numpy(dtype=np.float64, na_value=np.nan), equal_nan=True):
+                chunk[column] = downcast_data
+        elif pd.api.types.is_string_dtype(column_data.dtype) and column_data.nunique() <= max_unique_ratio * len(column_data):
+            chunk[column] = column_data.astype("category")
+    return chunk
+
+
+def _concat_chunks(chunks: list[pd.DataFrame], string_dtypes: dict[str, object], max_unique_ratio: float=0.5) -> pd.DataFrame:
+    """Concatenates compacted chunks. A string column stays categorical, with the union of every chunk's categories, if
+    every chunk kept it categorical and its share of unique values in the whole file is at most max_unique_ratio. Chunks
+    where the column is all null count as strings, and chunks parsed as other types (e.g. a run of numbers) are converted
+    to text, like a single read parses them.
+
+    Args:
+        chunks (list[pd.DataFrame]): The compacted chunks.
+        string_dtypes (dict[str, object]): The string columns and the d-type they were read with.
+        max_unique_ratio (float, optional): The maximum ratio of unique values to rows of a categorical column. Defaults to 0.5.
+
+    Returns:
+        pd.DataFrame: The concatenated dataframe.
+    """
+    row_count: int = sum(len(chunk) for chunk in chunks)
+    for column, string_dtype in string_dtypes.items():
+        # a chunk with too many unique values kept the column as strings, so the other chunks are converted back too
+        is_categorical: bool = not any(pd.api.types.is_string_dtype(chunk[column].dtype) and not isinstance(chunk[column].dtype, pd.CategoricalDtype) for chunk in chunks)
+        if is_categorical:
+            for chunk in chunks:
+                if not isinstance(chunk[column].dtype, pd.CategoricalDtype) and chunk[column].notna().any():
+                    chunk[column] = chunk[column].astype(string_dtype).astype("category")
+            column_chunks: list[pd.Series] = [chunk[column] for chunk in chunks]
+
+            # all null chunks get the categories' d-type, so they union with the others
+            empty_categories: pd.Index = next(column_data for column_data in column_chunks if isinstance(column_data.dtype, pd.CategoricalDtype)).cat.categories[:0]
+            union = pd.api.types.union_categoricals([column_data if isinstance(column_data.dtype, pd.CategoricalDtype) else pd.Categorical(column_data, categories=empty_categories) for column_data in column_chunks])
+            is_categorical = len(union.categories) <= max_unique_ratio * row_count
+        for chunk in chunks:
+            chunk[column] = pd.Categorical(chunk[column], categories=union.categories) if is_categorical else chunk[column].astype(string_dtype)
+
+    dataframe: pd.DataFrame = pd.concat(chunks, ignore_index=True)
+    chunks.clear()
+    return dataframe
+
+
+def get_peak_memory_mb() -> float|None:
+    """Returns the peak resident memory of the current process in MB, or None if the platform does not report it.
+
+    Returns:
+        float|None: The peak resident memory in MB.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak_memory: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macOS reports bytes
+    if sys.platform == "darwin":
+        return peak_memory / 1024**2
+    return peak_memory / 1024
 
 
 def prompt_selection_for_column_list(message: str, list_of_options: list[str], default_all: bool=True) -> list[str]:
@@ -29,14 +401,20 @@ def prompt_selection_for_column_list(message: str, list_of_options: list[str], d
     option_dict: dict[int, str] = {i: list_of_options[i] for i in range(len(list_of_options))}
 
     show_options_to_user(message=message, option_dict=option_dict, default_all_flag=default_all)
-    user_input = get_user_input_str(message="Enter options: ")
-    selection_list = generate_list_from_input_str(user_input=user_input, option_dict=option_dict)
+    # a typo asks again instead of aborting the step and everything done before it
+    while True:
+        user_input = get_user_input_str(message="Enter options: ")
+        try:
+            selection_list = generate_list_from_input_str(user_input=user_input, option_dict=option_dict)
+            break
+        except (KeyError, ValueError) as e:
+            print(f"[-] {e.args[0]}")
 
     if selection_list:
         return selection_list
     else:
         if default_all:
-            return list_of_options
+            return list(list_of_options)
         else:
             return []
     
@@ -63,7 +441,7 @@ def generate_list_from_input_str(user_input:str, option_dict:dict[str,str]) -> l
     if user_input.strip() == "":
         return []
     
-    user_input_list: list[str] = user_input.strip().split(" ")
+    user_input_list: list[str] = user_input.split()
     selection_list = []
     for selection in user_input_list:
         try:
@@ -93,9 +471,14 @@ def prompt_user_for_int(message: str, options: dict[int, str]) -> int:
     for key, value in options.items():
         print(f"{key}: {value}")
     
-    user_input: int = int(get_user_input_str(message="Enter option: "))
-
-    return validate_input_is_in_options(user_input=user_input, options=options)
+    while True:
+        try:
+            user_input: int = int(get_user_input_str(message="Enter option: "))
+            return validate_input_is_in_options(user_input=user_input, options=options)
+        except ValueError:
+            print(f"[-] Please enter one of the numbers {list(options.keys())}.")
+        except KeyError as e:
+            print(f"[-] {e.args[0]}")
     
     
 def validate_input_is_in_options(user_input:int|str, options:dict[str|int, str]):